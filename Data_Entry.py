@@ -1,8 +1,11 @@
 import streamlit as st
-from connection_utils import (upload_db_to_drive, share_file_with_user, check_existing_file)
-from utils import (fetch_data_from_db, register_date_adapter_converter, create_new_project, store_session_state,
-                   clear_input, connect_db)
-from pandas import DataFrame
+from utils import (create_new_project, store_session_state, clear_input, save_to_drive, sync_status_sidebar,
+                   show_budget_alerts, cached_projects, cached_reference_data, open_project)
+import os
+import services
+import attachments
+import duplicates
+from services import Purchase, SyncError
 import datetime
 
 
@@ -12,8 +15,7 @@ def show_main_functionality(service, db_name):
     # Checking if there are any projects
 
     if 'db_downloaded' in st.session_state and st.session_state.db_downloaded:
-        project_query = "SELECT project_id || ' - ' || project_name AS project FROM projects;"
-        project = fetch_data_from_db(project_query, db_name)
+        project = [p.label for p in cached_projects(db_name)]
         # st.write(project)
         project_decision = st.selectbox('Select an option', ["Select Existing Project", "Create New Project"])
 
@@ -31,140 +33,321 @@ def show_main_functionality(service, db_name):
                 store_session_state("project_id_selected", project_id_selected)
                 store_session_state("project_selection", project_selection)
 
-                categories = fetch_data_from_db('SELECT category FROM category', db_name)
-                payment_options = fetch_data_from_db('SELECT mode_of_payment FROM mode_of_payment', db_name)
-                stage_options = fetch_data_from_db('SELECT stage FROM stages', db_name)
-                existing_vendors = fetch_data_from_db('SELECT distinct vendor FROM purchases', db_name)
-
-                st.header("🧾 Purchase Data Entry Form", divider=True)
-
-                vendor_option = st.selectbox("Vendor Type:", ["Select Existing Vendor", "Enter New Vendor"],
-                                             on_change=lambda: clear_input('vendor'))
-                mode_of_payment = st.selectbox("Select mode of payment:", payment_options,
-                                               index=payment_options.index(st.session_state.get("reset_mode_of_payment", payment_options[0])),
-                                               on_change=lambda: clear_input('paid_amount'), key="mode_of_payment",
-                                               placeholder="Select Mode of Payment")
-
-                # Form for user data input
-                with st.form("purchases_data_entry", clear_on_submit=True):
-                    # Create two columns
-                    col1, col2, col3 = st.columns(3)
-
-                    # First column: Item name input
-                    with col1:
-                        item_name = st.text_input("Enter the item name:", placeholder='Please enter an item name',
-                                                  key='item_name')
-
-                    # Second column: Item quantity input
-                    with col2:
-                        unit = st.selectbox("Select unit:", ["Nos", "MT", "Liters", "Units", "Kg", "Others"], key='unit', index=None,
-                                            placeholder='Please choose a unit if applicable')
-
-                    # Second column: Select box for units or item type
-                    with col3:
-                        item_qty = st.number_input("Enter the item quantity:", min_value=0.0, max_value=1000000.0,
-                                                   step=0.01, key='item_qty', value=None,
-                                                   placeholder='Please enter an item quantity')
-
-                    col4, col5 = st.columns(2)
-
-                    with col4:
-                        stage = st.selectbox("Select stage:", stage_options, key='stage', index=None,
-                                             placeholder='Please select a stage')
-
-                    with col5:
-                        category = st.selectbox("Select category:", categories, key='category', index=None,
-                                                placeholder='Please select a category')
-
-                    # Conditional input based on vendor option
-                    if vendor_option == "Select Existing Vendor":
-                        vendor = st.selectbox("Select vendor:", existing_vendors, key="vendor", index=None,
-                                              placeholder='Please choose a vendor')
-                    elif vendor_option == "Enter New Vendor":
-                        vendor = st.text_input("Enter the new vendor name:", key="vendor",
-                                               placeholder='Please enter an vendor name')
-                    register_date_adapter_converter()
-                    date = st.date_input("Select the date:", datetime.date.today(), min_value=datetime.date(2000, 1, 1),
-                                         max_value=datetime.date.today(), key='date')
-                    purchase_amount = st.number_input("Enter the purchase amount:", min_value=-10000, max_value=1000000,
-                                                      value=0, key='purchase_amount')
-
-                    # Conditionally display the paid amount input
-                    if mode_of_payment != "No Payment":
-                        paid_amount = st.number_input("Enter the paid amount:", min_value=0, max_value=1000000, value=0,
-                                                      key="paid_amount")
-                        paid_by = st.text_input("Who paid the amount?:", key='paid_by')
-                    else:
-                        paid_amount = 0  # Default to 0 if 'No Payment' is selected
-                        paid_by = None
-
-                    notes = st.text_input("Add notes if necessary:", key='notes')
-
-                    required_fields = [item_name, vendor, mode_of_payment, category, stage, date]
-                    submit_enabled = all(required_fields) and (purchase_amount != 0 or paid_amount > 0)
-
-                    submitted = st.form_submit_button("Submit", icon="🚨")
-
-                if submitted:
-                    if submit_enabled:
-                        with connect_db(db_name) as conn:
-                            cursor = conn.cursor()
-                            cursor.execute('''INSERT INTO purchases 
-                                            (project_id, item_name, item_qty, unit, vendor, stage, category, date, 
-                                            purchase_amount, mode_of_payment, paid_amount, paid_by, notes)
-                                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                                           (project_id, item_name, item_qty, unit, vendor, stage, category, date,
-                                            purchase_amount, mode_of_payment, paid_amount, paid_by, notes))
-                            conn.commit()
-                            st.success("Data submitted successfully!")
-                    else:
-                        st.error("All fields are mandatory! Please fill in all fields.")
-
-                if st.button("View Purchases"):
-                    with connect_db(db_name) as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(f'''
-                            SELECT 
-                                purchase_id as 'Purchase ID', 
-                                item_name as 'Item Name',
-                                unit as 'Unit', 
-                                item_qty as 'Item Qty',                        
-                                CASE 
-                                WHEN unit = 'Nos' or unit = 'Others' OR unit is null
-                                THEN COALESCE(CAST(item_qty AS INTEGER),'') || ' ' || COALESCE(unit,'')
-                                ELSE COALESCE(printf('%.2f', item_qty), '') || ' ' || COALESCE(unit,'')
-                            END AS 'Item Quantity',
-                            vendor as Vendor, 
-                            stage as Stage, 
-                            category as Category,
-                            date as Date, 
-                            purchase_amount as 'Purchase Amount', 
-                            mode_of_payment as 'Mode of Payment',
-                            paid_amount as 'Paid Amount',
-                            paid_by as 'Paid By',
-                            notes as Notes
-                            FROM purchases
-                            WHERE project_id = {project_id}    
-                    ''')
-                    data = cursor.fetchall()
-                    if data:
-                        results_df = DataFrame(data, columns=[desc[0] for desc in cursor.description])
-                        st.dataframe(results_df)
-                    else:
-                        st.write("No data found for the selected criteria.")
+                # The project's own database when the projects are sharded (see shards.py)
+                project_db = open_project(service, db_name, project_id)
+                if project_db is None:
+                    return
+                sync_status_sidebar(db_name, project_db)
+
+                purchase_entry(project_db, project_id)
+                purchase_viewer(project_db, project_id)
+
+                with st.expander("Receipts and Attachments"):
+                    purchase_attachments(service, project_db, project_id)
 
                 if st.button("Save"):
-                    existing_file_id = check_existing_file(service, db_name)
-                    if existing_file_id:
-                        result_id = upload_db_to_drive(service, db_name, existing_file_id)
-                        st.success(f"Updated the file with ID: {db_name}")
-                        share_file_with_user(service, result_id, st.session_state['user_email'])
-                        st.rerun()
-                    else:
-                        st.write('Error while saving the file')
+                    save_to_drive(service, project_db, db_name)
+                return
 
         else:
             create_new_project(db_name)
+        sync_status_sidebar(db_name)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Purchase entry
+# ----------------------------------------------------------------------------------------------------
+
+# The entry forms, the purchase viewer and the attachments are fragments: interacting with one of
+# them reruns only that function, not the login, project selection and the rest of the page.
+
+@st.fragment
+def purchase_entry(db_name, project_id):
+    # Read on every fragment run, so a vendor entered a moment ago is offered straight away
+    reference = cached_reference_data(db_name)
+    entry_mode = st.radio("Entry mode:", ["Single Item", "Invoice"], horizontal=True, key='entry_mode')
+    if entry_mode == "Invoice":
+        invoice_entry(db_name, project_id, reference)
+    else:
+        single_item_entry(db_name, project_id, reference)
+    if 'pending_entry' in st.session_state:
+        confirm_pending_entry(db_name, project_id)
+
+
+def single_item_entry(db_name, project_id, reference):
+    """Form for one purchase; the vendor and payment selectors above it only rerun the entry fragment."""
+    categories = reference.categories
+    payment_options = reference.payment_modes
+    stage_options = reference.stages
+    existing_vendors = reference.vendors
+
+    st.header("🧾 Purchase Data Entry Form", divider=True)
+
+    vendor_option = st.selectbox("Vendor Type:", ["Select Existing Vendor", "Enter New Vendor"],
+                                 on_change=lambda: clear_input('vendor'))
+    mode_of_payment = st.selectbox("Select mode of payment:", payment_options,
+                                   index=payment_options.index(st.session_state.get("reset_mode_of_payment", payment_options[0])),
+                                   on_change=lambda: clear_input('paid_amount'), key="mode_of_payment",
+                                   placeholder="Select Mode of Payment")
+
+    # Form for user data input
+    with st.form("purchases_data_entry", clear_on_submit=True):
+        # Create two columns
+        col1, col2, col3 = st.columns(3)
+
+        # First column: Item name input
+        with col1:
+            item_name = st.text_input("Enter the item name:", placeholder='Please enter an item name',
+                                      key='item_name')
+
+        # Second column: Item quantity input
+        with col2:
+            unit = st.selectbox("Select unit:", ["Nos", "MT", "Liters", "Units", "Kg", "Others"], key='unit', index=None,
+                                placeholder='Please choose a unit if applicable')
+
+        # Second column: Select box for units or item type
+        with col3:
+            item_qty = st.number_input("Enter the item quantity:", min_value=0.0, max_value=1000000.0,
+                                       step=0.01, key='item_qty', value=None,
+                                       placeholder='Please enter an item quantity')
+
+        col4, col5 = st.columns(2)
+
+        with col4:
+            stage = st.selectbox("Select stage:", stage_options, key='stage', index=None,
+                                 placeholder='Please select a stage')
+
+        with col5:
+            category = st.selectbox("Select category:", categories, key='category', index=None,
+                                    placeholder='Please select a category')
+
+        # Conditional input based on vendor option
+        if vendor_option == "Select Existing Vendor":
+            vendor = st.selectbox("Select vendor:", existing_vendors, key="vendor", index=None,
+                                  placeholder='Please choose a vendor')
+        elif vendor_option == "Enter New Vendor":
+            vendor = st.text_input("Enter the new vendor name:", key="vendor",
+                                   placeholder='Please enter an vendor name')
+        date = st.date_input("Select the date:", datetime.date.today(), min_value=datetime.date(2000, 1, 1),
+                             max_value=datetime.date.today(), key='date')
+        purchase_amount = st.number_input("Enter the purchase amount:", min_value=-10000, max_value=1000000,
+                                          value=0, key='purchase_amount')
+
+        # Conditionally display the paid amount input
+        if mode_of_payment != "No Payment":
+            paid_amount = st.number_input("Enter the paid amount:", min_value=0, max_value=1000000, value=0,
+                                          key="paid_amount")
+            paid_by = st.text_input("Who paid the amount?:", key='paid_by')
+        else:
+            paid_amount = 0  # Default to 0 if 'No Payment' is selected
+            paid_by = None
+
+        notes = st.text_input("Add notes if necessary:", key='notes')
+
+        submitted = st.form_submit_button("Submit", icon="🚨")
+
+    if submitted:
+        purchase = Purchase(project_id, item_name, item_qty, unit, vendor, stage, category, date,
+                            purchase_amount, mode_of_payment, paid_amount, paid_by, notes)
+        submit_entry(db_name, project_id, 'single', [purchase])
+
+
+def save_single_item(db_name, project_id, purchases):
+    purchase, = purchases
+    try:
+        services.add_purchase(db_name, purchase)
+        st.success("Data submitted successfully!")
+    except ValueError as e:
+        st.error(str(e))
+    else:
+        show_budget_alerts(db_name, project_id, [(purchase.stage, purchase.category)])
+
+
+@st.fragment
+def purchase_viewer(db_name, project_id):
+    if st.button("View Purchases"):
+        purchases = services.view_purchases(db_name, project_id)
+        if purchases.rows:
+            st.dataframe(dict(zip(purchases.columns, zip(*purchases.rows))))
+        else:
+            st.write("No data found for the selected criteria.")
+
+
+# ----------------------------------------------------------------------------------------------------
+# Invoice entry
+# ----------------------------------------------------------------------------------------------------
+
+INVOICE_ROWS = 10
+UNITS = ["Nos", "MT", "Liters", "Units", "Kg", "Others"]
+
+
+def blank_invoice_rows():
+    return [{'item_name': None, 'item_qty': None, 'unit': None, 'category': None, 'purchase_amount': None,
+             'paid_amount': None, 'notes': None} for _ in range(INVOICE_ROWS)]
+
+
+def invoice_entry(db_name, project_id, reference):
+    """Enters all line items of one vendor invoice at once.
+
+    The vendor, date, stage and payment details are entered once for the whole invoice and the
+    line items in an editable grid. Editing the grid does not rerun the page: everything is
+    validated and written in one transaction when the form is submitted.
+    """
+    st.header("🧾 Invoice Entry Form", divider=True)
+
+    with st.form("invoice_data_entry", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            vendor = st.selectbox("Select vendor:", reference.vendors, index=None, accept_new_options=True,
+                                  placeholder='Please choose or enter a vendor', key='invoice_vendor')
+            stage = st.selectbox("Select stage:", reference.stages, index=None, placeholder='Please select a stage',
+                                 key='invoice_stage')
+        with col2:
+            date = st.date_input("Select the date:", datetime.date.today(), min_value=datetime.date(2000, 1, 1),
+                                 max_value=datetime.date.today(), key='invoice_date')
+            mode_of_payment = st.selectbox("Select mode of payment:", reference.payment_modes,
+                                           key='invoice_mode_of_payment')
+        paid_by = st.text_input("Who paid the amount?:", key='invoice_paid_by')
+
+        line_items = st.data_editor(
+            blank_invoice_rows(),
+            num_rows="dynamic",
+            use_container_width=True,
+            key='invoice_line_items',
+            column_config={
+                'item_name': st.column_config.TextColumn("Item Name"),
+                'item_qty': st.column_config.NumberColumn("Item Qty", min_value=0.0, max_value=1000000.0, step=0.01),
+                'unit': st.column_config.SelectboxColumn("Unit", options=UNITS),
+                'category': st.column_config.SelectboxColumn("Category", options=reference.categories),
+                'purchase_amount': st.column_config.NumberColumn("Purchase Amount", min_value=-10000,
+                                                                 max_value=1000000),
+                'paid_amount': st.column_config.NumberColumn("Paid Amount", min_value=0, max_value=1000000),
+                'notes': st.column_config.TextColumn("Notes"),
+            },
+        )
+
+        submitted = st.form_submit_button("Submit Invoice", icon="🚨")
+
+    if submitted:
+        # Untouched rows of the grid are ignored
+        filled_rows = [row for row in line_items if any(value not in (None, '') for value in row.values())]
+        paid = mode_of_payment != "No Payment"
+        purchases = [Purchase(project_id, row['item_name'], row['item_qty'], row['unit'], vendor, stage,
+                              row['category'], date, row['purchase_amount'] or 0, mode_of_payment,
+                              (row['paid_amount'] or 0) if paid else 0, (paid_by or None) if paid else None,
+                              row['notes'] or None)
+                     for row in filled_rows]
+        submit_entry(db_name, project_id, 'invoice', purchases)
+
+
+def save_invoice(db_name, project_id, purchases):
+    try:
+        count = services.add_purchases(db_name, purchases)
+        st.success(f"Invoice submitted successfully with {count} line items!")
+    except ValueError as e:
+        st.error(f"Invoice not saved. {e}")
+    else:
+        show_budget_alerts(db_name, project_id, [(purchase.stage, purchase.category) for purchase in purchases])
+
+
+# ----------------------------------------------------------------------------------------------------
+# Duplicate check
+# ----------------------------------------------------------------------------------------------------
+
+ENTRY_SAVERS = {'single': save_single_item, 'invoice': save_invoice}
+
+
+def submit_entry(db_name, project_id, kind, purchases):
+    """Saves the submitted purchases, unless some look like purchases already saved.
+
+    Those are shown instead, and the entry waits in the session until it is saved anyway or discarded.
+    """
+    # An invalid entry is reported by the save, without looking for duplicates
+    found = {} if services.validate_purchases(purchases) else duplicates.find_duplicates(db_name, purchases)
+    if found:
+        st.session_state['pending_entry'] = (db_name, project_id, kind, purchases, found)
+    else:
+        ENTRY_SAVERS[kind](db_name, project_id, purchases)
+
+
+def confirm_pending_entry(db_name, project_id):
+    pending_db, pending_project, kind, purchases, found = st.session_state['pending_entry']
+    if (pending_db, pending_project) != (db_name, project_id):
+        # Entered on another project; never saved into this one
+        del st.session_state['pending_entry']
+        return
+
+    from reports import display_table
+    notice = st.empty()
+    with notice.container():
+        st.warning(f"This entry looks like purchases already saved: same vendor and amount within "
+                   f"{duplicates.DATE_WINDOW_DAYS} days, and a similar item. It has not been saved yet.", icon="⚠️")
+        display_table(duplicates.candidates_table(found))
+        col1, col2 = st.columns(2)
+        with col1:
+            save = st.button("Save anyway", key='save_pending_entry')
+        with col2:
+            discard = st.button("Discard", key='discard_pending_entry')
+    if save or discard:
+        del st.session_state['pending_entry']
+        notice.empty()
+        if save:
+            ENTRY_SAVERS[kind](db_name, project_id, purchases)
+        else:
+            st.info("The entry was discarded.")
+
+
+# ----------------------------------------------------------------------------------------------------
+# Attachments
+# ----------------------------------------------------------------------------------------------------
+
+@st.fragment
+def purchase_attachments(service, db_name, project_id):
+    """Attaches receipts and invoice photos to a purchase and lists the ones already attached."""
+    purchase_id = st.selectbox("Select the purchase:", services.list_purchase_ids(db_name, project_id), index=None,
+                               placeholder='Please choose a purchase ID', key='attachment_purchase_id')
+    if purchase_id is None:
+        return
+
+    with st.form("attachment_form", clear_on_submit=True):
+        files = st.file_uploader("Attach receipts or invoices:", accept_multiple_files=True, key='attachment_files')
+        submitted = st.form_submit_button("Attach")
+
+    if submitted and files:
+        for file in files:
+            try:
+                attachments.add_attachment(db_name, purchase_id, file.name, file.getvalue(), file.type)
+                st.success(f"{file.name} attached.")
+            except ValueError as e:
+                st.error(f"{file.name} not attached. {e}")
+
+    for attachment in attachments.list_attachments(db_name, purchase_id):
+        col1, col2, col3 = st.columns([1, 3, 1])
+        with col1:
+            try:
+                preview = attachments.thumbnail(service, db_name, attachment)
+            except SyncError as e:
+                preview = None
+                print(f'Error log: {e}')
+            if preview:
+                st.image(preview)
+        with col2:
+            st.write(f"**{attachment.file_name}** ({attachment.size / 1024:,.0f} KB)")
+            # Blobs added on another device are only fetched from Drive when asked for
+            if os.path.exists(attachments.blob_path(db_name, attachment.sha256)):
+                st.download_button("Download", attachments.read_attachment(service, db_name, attachment.sha256),
+                                   file_name=attachment.file_name, mime=attachment.mime_type,
+                                   key=f'download_attachment_{attachment.attachment_id}')
+            elif st.button("Fetch from Google Drive", key=f'fetch_attachment_{attachment.attachment_id}'):
+                try:
+                    attachments.read_attachment(service, db_name, attachment.sha256)
+                    st.rerun(scope='fragment')
+                except SyncError as e:
+                    st.error(str(e))
+        with col3:
+            if st.button("Remove", key=f'remove_attachment_{attachment.attachment_id}'):
+                attachments.remove_attachment(db_name, attachment.attachment_id)
+                st.rerun(scope='fragment')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+"""Picks the engine that computes the heavy report aggregations.
+
+The pivot and expenditure reports have the same definition (same function names, same tables)
+in three engines:
+
+    'duckdb'    vectorized in DuckDB, over an in-memory mirror of the purchases (duckdb_reports.py)
+    'columnar'  NumPy arrays cached in the process (columnar.py)
+    'sqlite'    the SQL statements run against the database file (services.py)
+
+All of them read the SQLite file through read-only connections; writes never go anywhere else.
+The engine is set with the CONSMAN_ANALYTICS_ENGINE environment variable. The default ('auto')
+uses DuckDB when it is installed and otherwise falls back to the columnar cache over SQLite (the
+plain SQL reports are 100x slower on large databases; compare with the analytics_* benchmarks).
+
+DuckDB answers per-project reports from one mirror of the whole database, where the columnar
+cache builds one copy per project; the columnar cache is faster on whole-database pivots.
+"""
+import os
+import services
+import columnar
+
+try:
+    import duckdb_reports
+except ImportError:  # DuckDB is an optional dependency
+    duckdb_reports = None
+
+ENGINES = {
+    'duckdb': duckdb_reports,
+    'columnar': columnar,
+    'sqlite': services,
+}
+ANALYTICS_ENGINE = os.environ.get('CONSMAN_ANALYTICS_ENGINE', 'auto')
+FALLBACK_ENGINE = 'columnar'
+
+
+def engine_name(name=None):
+    """Name of the engine that runs the reports: the one asked for (or configured) if it is available."""
+    name = name or ANALYTICS_ENGINE
+    if name == 'auto':
+        name = 'duckdb'
+    if name not in ENGINES:
+        raise ValueError(f"Unknown analytics engine {name!r}; expected one of {', '.join(ENGINES)} or 'auto'.")
+    return name if ENGINES[name] is not None else FALLBACK_ENGINE
+
+
+def engine(name=None):
+    return ENGINES[engine_name(name)]
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reports
+# ----------------------------------------------------------------------------------------------------
+
+def expenses_pivot_table(database_name, using=None):
+    return engine(using).expenses_pivot_table(database_name)
+
+
+def purchase_amounts_table(database_name, using=None, project_id=None):
+    return engine(using).purchase_amounts_table(database_name, project_id)
+
+
+def expenditure_by_category(database_name, project_id, using=None):
+    return engine(using).expenditure_by_category(database_name, project_id)
+
+
+def expenditure_by_stage(database_name, project_id, using=None):
+    return engine(using).expenditure_by_stage(database_name, project_id)
@@ -1,50 +1,52 @@
 import streamlit as st
-from connection_utils import (download_db_from_drive, upload_db_to_drive, share_file_with_user,
-                              check_existing_file, establish_gdrive_connections)
-from utils import (cursor_conn, create_tables_in_db)
+from utils import cursor_conn, start_replayer, download_progress
 import Data_Entry
-
-
-from authlib.integrations.requests_client import OAuth2Session
-
+import auth
+import services
+import outbox
+import tenants
+import shards
+from services import SyncError
+
+# Drive (googleapiclient) and OAuth (authlib) clients are imported lazily, so the login
+# screen is painted without loading either of them
 st.set_page_config(page_title="Construction Expenses Tracking App", page_icon="📚", layout="wide")
 st.title("📚 Construction Expenses Tracking App")
 st.sidebar.success("Navigate yourself")
 
-# Define client ID and client secret from Google OAuth
-client_id = st.secrets['gdrive']['client_id_key']
-client_secret = st.secrets['gdrive']['client_secret_key']
-redirect_uri = st.secrets['gdrive']['redirect_uri']  # Ensure this matches the Google Cloud Console settings
 
-# Google OAuth 2.0 configuration
-authorize_url = st.secrets['gdrive']['auth_uri']
-token_url = st.secrets['gdrive']['token_uri']
-userinfo_url = st.secrets['gdrive']['userinfo_uri']
-scope = st.secrets['gdrive']['scope']
-
-oauth = OAuth2Session(client_id, client_secret, redirect_uri=redirect_uri, scope=scope)
+def drive_service():
+    """Returns the session's Google Drive service, building it on first use."""
+    if st.session_state.get('service') is None:
+        from connection_utils import establish_gdrive_connections
+        try:
+            st.session_state.service = establish_gdrive_connections()
+        except Exception as e:
+            st.error(f"Failed to connect to Google Drive: {e}")
+            print(f'Error log: {e}')
+            return None
+    return st.session_state.service
 
 
 def main():
-    # Establish connection with Google Drive
-    service = establish_gdrive_connections()
-
     # Check for existing token in session state
     if "token" not in st.session_state:
         # Redirect to Google OAuth login
-        authorization_url, state = oauth.create_authorization_url(authorize_url)
+        authorization_url = auth.authorization_url()
         st.info('Please login with Google to access the application')
         st.link_button("Login with Google", url=authorization_url)
     else:
         # Load the token
         token = st.session_state["token"]
-        oauth.token = token
 
-        # Fetch user info from Google
-        response = oauth.get(userinfo_url)
+        # Fetch user info from Google, once per session rather than on every rerun
+        if 'userinfo' not in st.session_state:
+            response = auth.fetch_userinfo(token)
+            if response.status_code == 200:
+                st.session_state['userinfo'] = response.json()
 
-        if response.status_code == 200:
-            userinfo = response.json()
+        userinfo = st.session_state.get('userinfo')
+        if userinfo:
             user_email = userinfo.get("email")
             user_name = userinfo.get("name")
             # st.success(f"Logged in as: {user_email}")
@@ -54,7 +56,9 @@ def main():
                 # st.write(f'{st.session_state['user_email']}')
             # st.write(f"{userinfo}")
             # Continue to the main functionality
-            setup(service)
+            service = drive_service()
+            if service is not None:
+                setup(service)
         else:
             st.error("Failed to recognize the user 😥!!")
             # st.error("Failed to fetch user information. Status Code: " + str(response.status_code))
@@ -64,7 +68,7 @@ def main():
     if code and "token" not in st.session_state:
         try:
             # Fetch the token using the code
-            token = oauth.fetch_token(token_url, code=code, grant_type="authorization_code")
+            token = auth.fetch_token(code)
             st.session_state["token"] = token
             st.success("Authentication completed successfully.")
             st.rerun()  # Refresh the app to show user info
@@ -85,22 +89,47 @@ def database_setup(service):
     if 'db_created' not in st.session_state:
         st.session_state.db_created = False  # Initialize the session state variable
 
-    existing_file_id = check_existing_file(service, db_name)
-    if existing_file_id:
-        if not st.session_state.db_downloaded:  # Download the DB only if not done yet
-            download_db_from_drive(service, existing_file_id, db_name)
-            st.session_state.db_downloaded = True
-            print(f"Updated existing file with ID: {existing_file_id}, File Name: {db_name}")
-        # st.write(f"File ID: {existing_file_id}")
-    else:
-        if not st.session_state.db_created:  # Create the DB file
-            # st.write('No file ID')
-            create_tables_in_db(db_name)
-            result_id = upload_db_to_drive(service, db_name, None)
-            st.write(f"Created new file with name: {db_name}")
-            share_file_with_user(service, result_id, st.session_state['user_email'])
-            st.info('Please check your google drive in Shared With Me folder !!')
-            st.session_state.db_created = True
+    if services.has_schema(db_name):
+        services.upgrade_schema(db_name)
+
+    try:
+        existing_file_id = services.find_remote_database(service, db_name, st.session_state['user_email'])
+        if existing_file_id:
+            if not st.session_state.db_downloaded:  # Download the DB only if not done yet
+                pulled = outbox.pull(service, db_name, st.session_state['user_email'], existing_file_id,
+                                     download_progress())
+                if pulled == outbox.PULL_LOCAL_CHANGES:
+                    # Changes saved locally that never reached Drive are not overwritten by the download
+                    st.warning(f"{outbox.read_state(db_name).pending} changes saved on this device are not synced "
+                               f"yet, continuing with the local copy.")
+                elif pulled == outbox.PULL_DOWNLOADED:
+                    st.success("Data refreshed")
+                    print(f"Updated existing file with ID: {existing_file_id}, File Name: {db_name}")
+                st.session_state.db_downloaded = True
+            # st.write(f"File ID: {existing_file_id}")
+        else:
+            if not st.session_state.db_created:  # Create the DB file
+                # st.write('No file ID')
+                with tenants.drive_transfer():
+                    services.create_remote_database(service, db_name, st.session_state['user_email'])
+                outbox.mark_in_sync(db_name)
+                st.write(f"Created new file with name: {db_name}")
+                st.info('Please check your google drive in Shared With Me folder !!')
+                st.session_state.db_created = True
+        if shards.enabled():
+            # Projects kept in the user's database so far move to databases of their own; the split
+            # database is uploaded after them, so other devices never find a project without its file
+            split = shards.split_database(db_name)
+            shards.upload_new_shards(service, db_name, st.session_state['user_email'])
+            if split:
+                outbox.replay(service, db_name, st.session_state['user_email'], force=True)
+    except SyncError as e:
+        if not services.has_schema(db_name):
+            st.error(str(e))
+            return
+        # Offline: keep working on the local copy, the outbox ships the changes once Drive is back
+        st.warning(f"Google Drive is unreachable, working offline on the local copy. ({e})")
+        st.session_state.db_downloaded = True
 
     # Log to track which state the function is in
     if st.session_state['db_downloaded']:
@@ -123,6 +152,7 @@ def setup(service):
 
     # Check which page to show based on the session state
     if st.session_state.page == "show_main_functionality":
+        start_replayer(st.session_state.db_name)
         # Pass service and db_name
         Data_Entry.show_main_functionality(st.session_state.service, st.session_state.db_name)
     else:
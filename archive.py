@@ -0,0 +1,166 @@
+"""Finished projects moved out of the working database.
+
+A finished project still costs on every download and upload of the database, in the vendor
+dropdown and in every report scan. Archiving moves all of its rows (purchases, attachment links,
+budgets, tombstones included) and their audit history into a database of its own, which is
+compressed and stored like an attachment: in the blob store and on Drive as `blob-<hash>`,
+uploaded by the outbox before the database that refers to it. The working database keeps one row
+per archived project (archived_projects) and its totals per stage, category and vendor
+(archive_totals), so listing the archived projects or adding them to the portfolio never needs the
+archive itself.
+
+An archive is fetched (from Drive if this device does not have it) and decompressed the first
+time it is opened, under `<db dir>/archives`. It has the schema of the app, so the reports of
+services.py read it as they read the working database; nothing writes to it again.
+"""
+import os
+import gzip
+import tempfile
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import services
+import shards
+from services import Table, transaction, reading, query_table
+from attachments import store_dir, store_blob, read_attachment, write_atomically
+from queries import statement
+
+ARCHIVE_MIME_TYPE = 'application/gzip'
+COMPRESSION_LEVEL = 9
+
+
+@dataclass
+class ArchivedProject:
+    project_id: int
+    project_name: str
+    project_location: str
+    archived_at: str
+    sha256: str
+    purchases: int
+    purchased: float
+    paid: float
+
+    @property
+    def label(self):
+        return f'{self.project_id} - {self.project_name}'
+
+
+# ----------------------------------------------------------------------------------------------------
+# Archiving
+# ----------------------------------------------------------------------------------------------------
+
+def archive_path(database_name, sha256):
+    # Not *.db, so the portfolio does not take an archive for a database of its own
+    return os.path.join(store_dir(database_name, 'archives'), f'{sha256}.sqlite')
+
+
+def archive_project(database_name, project_id):
+    """Moves a project and everything recorded for it into a compressed archive.
+
+    The rows are taken from the project's shard when it has one (see shards.py); the shard is then
+    removed from this device.
+
+    Returns:
+        ArchivedProject: The project as it is now listed, with its totals.
+
+    Raises:
+        ValueError: If the project does not exist or is deleted.
+    """
+    source = shards.project_database(database_name, project_id)
+    archived_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with transaction(database_name) as conn, ExitStack() as stack:
+        # Taken before the copy, so nothing is added to the project between the copy and the purge
+        conn.execute('BEGIN IMMEDIATE')
+        if not conn.execute(statement('projects.get'), (project_id,)).fetchone():
+            raise ValueError(f"Project {project_id} does not exist.")
+        source_conn = conn
+        if source != database_name:
+            source_conn = stack.enter_context(transaction(source))
+            source_conn.execute('BEGIN IMMEDIATE')
+
+        data = build_archive(source, project_id)
+        sha256 = store_blob(database_name, data)
+        conn.execute(statement('attachments.insert_blob'), (sha256, len(data), ARCHIVE_MIME_TYPE))
+        conn.execute(statement('archive.insert_project'), (archived_at, sha256, project_id))
+        conn.executemany(statement('archive.insert_total'),
+                         source_conn.execute(statement('archive.project_totals'), (project_id,)).fetchall())
+        if source == database_name:
+            services.purge_project_rows(conn, project_id)
+        else:
+            conn.execute(statement('shards.delete'), (project_id,))
+        conn.execute(statement('archive.purge_project'), (project_id,))
+    if source != database_name:
+        shards.remove_local(source)
+    services.compact(database_name)
+    return get_archived_project(database_name, project_id)
+
+
+def build_archive(database_name, project_id):
+    """The rows of the project as a complete database file, compressed."""
+    directory = store_dir(database_name, 'archives')
+    os.makedirs(directory, exist_ok=True)
+    handle, path = tempfile.mkstemp(dir=directory, suffix='.part')
+    os.close(handle)
+    try:
+        services.create_schema(path)
+        services.copy_project(database_name, path, project_id)
+        conn = services.connect_db(path)
+        try:
+            # One self-contained file, opened read-only later without a write-ahead log
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        with open(path, 'rb') as file:
+            return gzip.compress(file.read(), COMPRESSION_LEVEL)
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            try:
+                os.remove(f'{path}{suffix}')
+            except FileNotFoundError:
+                pass
+
+
+# ----------------------------------------------------------------------------------------------------
+# Archived projects
+# ----------------------------------------------------------------------------------------------------
+
+def list_archived_projects(database_name):
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('archive.list')).fetchall()
+    return [ArchivedProject(*row) for row in rows]
+
+
+def get_archived_project(database_name, project_id):
+    with reading(database_name) as conn:
+        row = conn.execute(statement('archive.get'), (project_id,)).fetchone()
+    return ArchivedProject(*row) if row else None
+
+
+def archive_summary(database_name):
+    """The archived projects and their totals as a report table, read from the working database only."""
+    return Table(['Project', 'Location', 'Archived At', 'Purchases', 'Purchase Amount', 'Paid Amount', 'Difference'],
+                 [(project.label, project.project_location, project.archived_at, project.purchases,
+                   project.purchased, project.paid, project.purchased - project.paid)
+                  for project in list_archived_projects(database_name)])
+
+
+def archived_totals(database_name, project_id):
+    """Stage and category totals of an archived project, from the summary kept in the working database."""
+    return query_table(database_name, statement('archive.totals'), (project_id,))
+
+
+def open_archive(service, database_name, project_id):
+    """Path of the archive database of the project, fetched and decompressed the first time it is opened.
+
+    Raises:
+        ValueError: If the project is not archived.
+        SyncError: If the archive has to be downloaded and Drive cannot be reached.
+    """
+    project = get_archived_project(database_name, project_id)
+    if project is None:
+        raise ValueError(f"Project {project_id} is not archived.")
+    path = archive_path(database_name, project.sha256)
+    if not os.path.exists(path):
+        write_atomically(path, gzip.decompress(read_attachment(service, database_name, project.sha256)))
+    return path
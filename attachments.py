@@ -0,0 +1,212 @@
+"""Receipts, invoice photos and other files attached to purchases.
+
+Files are stored by content: the SHA-256 of their bytes names the blob, both in the local blob
+store next to the database (`<db dir>/blobs/<first two hex digits>/<hash>`) and on Drive
+(`blob-<hash>`). The database only holds the links (attachments) and one row per distinct blob
+(blobs), so attaching a photo never grows the file that is synced, and a receipt attached twice
+(or on two devices) is stored and uploaded once.
+
+Blobs are uploaded by the outbox replay before the database itself, so the copy of the database
+on Drive never links to a blob that is not there. Thumbnails are made on first view with Pillow
+(if installed) and cached under `<db dir>/thumbnails`.
+"""
+import io
+import os
+import hashlib
+import mimetypes
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from services import SyncError, transaction, reading
+from queries import statement
+
+try:
+    from PIL import Image
+except ImportError:  # Attachments still work, they are just listed without a preview
+    Image = None
+
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 80
+
+
+@dataclass
+class Attachment:
+    attachment_id: int
+    purchase_id: int
+    sha256: str
+    file_name: str
+    size: int
+    mime_type: str
+    added_at: str
+
+    @property
+    def is_image(self):
+        return bool(self.mime_type) and self.mime_type.startswith('image/')
+
+
+# ----------------------------------------------------------------------------------------------------
+# Blob store
+# ----------------------------------------------------------------------------------------------------
+
+def store_dir(database_name, kind):
+    return os.path.join(os.path.dirname(os.path.abspath(database_name)), kind)
+
+
+def blob_path(database_name, sha256):
+    return os.path.join(store_dir(database_name, 'blobs'), sha256[:2], sha256)
+
+
+def drive_name(sha256):
+    return f'blob-{sha256}'
+
+
+def write_atomically(path, data):
+    """Writes the file under a temporary name first, so a reader never sees half of it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def store_blob(database_name, data):
+    """Puts the bytes in the blob store (unless they are already there) and returns their SHA-256."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = blob_path(database_name, sha256)
+    if not os.path.exists(path):
+        write_atomically(path, data)
+    return sha256
+
+
+# ----------------------------------------------------------------------------------------------------
+# Attachments
+# ----------------------------------------------------------------------------------------------------
+
+def add_attachment(database_name, purchase_id, file_name, data, mime_type=None):
+    """Attaches a file to a purchase and returns the new attachment id.
+
+    Args:
+        data: The file content, e.g. UploadedFile.getvalue().
+        mime_type: Guessed from the file name if not given.
+    """
+    if not data:
+        raise ValueError("The file is empty.")
+    mime_type = mime_type or mimetypes.guess_type(file_name)[0]
+    added_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with transaction(database_name) as conn:
+        # Checked before the blob is stored, so an unknown purchase leaves no file behind
+        if not conn.execute(statement('purchases.get'), (purchase_id,)).fetchone():
+            raise ValueError(f"Purchase {purchase_id} does not exist.")
+        sha256 = store_blob(database_name, data)
+        conn.execute(statement('attachments.insert_blob'), (sha256, len(data), mime_type))
+        return conn.execute(statement('attachments.insert'), (purchase_id, sha256, file_name, added_at)).lastrowid
+
+
+def list_attachments(database_name, purchase_id):
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('attachments.by_purchase'), (purchase_id,)).fetchall()
+    return [Attachment(*row) for row in rows]
+
+
+def remove_attachment(database_name, attachment_id):
+    """Unlinks an attachment; the blob stays, since other attachments may share it."""
+    deleted_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with transaction(database_name) as conn:
+        return conn.execute(statement('attachments.soft_delete'), (deleted_at, attachment_id)).rowcount
+
+
+def read_attachment(service, database_name, sha256):
+    """Content of a blob, downloaded from Drive first if this device does not have it yet.
+
+    Raises:
+        SyncError: If the blob is neither here nor on Drive, or Drive cannot be reached.
+    """
+    path = blob_path(database_name, sha256)
+    if not os.path.exists(path):
+        fetch_blob(service, database_name, sha256)
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def fetch_blob(service, database_name, sha256):
+    from connection_utils import check_existing_file, download_db_from_drive, DRIVE_ERRORS
+    with reading(database_name) as conn:
+        row = conn.execute(statement('attachments.blob'), (sha256,)).fetchone()
+    try:
+        file_id = row[3] if row and row[3] else check_existing_file(service, drive_name(sha256))
+        if not file_id:
+            raise SyncError(f"The attachment {sha256[:12]} was never uploaded from the device it was added on.")
+        path = blob_path(database_name, sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        download_db_from_drive(service, file_id, f'{path}.download')
+    except DRIVE_ERRORS as e:
+        raise SyncError(f"An error occurred while downloading the attachment: {e}") from e
+    os.replace(f'{path}.download', path)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Upload
+# ----------------------------------------------------------------------------------------------------
+
+def upload_pending_blobs(service, database_name):
+    """Uploads the blobs that are not on Drive yet; returns how many were uploaded.
+
+    A blob already on Drive under its hash (e.g. uploaded from another device) is only linked.
+
+    Raises:
+        SyncError: If Drive cannot be reached; the blobs uploaded so far stay recorded.
+    """
+    from connection_utils import check_existing_file, upload_blob_to_drive, DRIVE_ERRORS
+    with reading(database_name) as conn:
+        pending = conn.execute(statement('attachments.not_uploaded')).fetchall()
+
+    uploaded = 0
+    for sha256, mime_type in pending:
+        path = blob_path(database_name, sha256)
+        try:
+            file_id = check_existing_file(service, drive_name(sha256))
+            if not file_id:
+                if not os.path.exists(path):
+                    # Added on another device that has not uploaded it yet
+                    continue
+                file_id = upload_blob_to_drive(service, drive_name(sha256), path, mime_type)
+                uploaded += 1
+        except DRIVE_ERRORS as e:
+            raise SyncError(f"An error occurred while uploading an attachment: {e}") from e
+        with transaction(database_name) as conn:
+            conn.execute(statement('attachments.uploaded'), (file_id, sha256))
+    return uploaded
+
+
+# ----------------------------------------------------------------------------------------------------
+# Thumbnails
+# ----------------------------------------------------------------------------------------------------
+
+def thumbnail(service, database_name, attachment, size=THUMBNAIL_SIZE):
+    """Path of a JPEG preview of an image attachment, made on first use; None if there is no preview.
+
+    Raises:
+        SyncError: If the image has to be downloaded and Drive cannot be reached.
+    """
+    if Image is None or not attachment.is_image:
+        return None
+    path = os.path.join(store_dir(database_name, 'thumbnails'), f'{attachment.sha256}-{size}.jpg')
+    if os.path.exists(path):
+        return path
+
+    data = read_attachment(service, database_name, attachment.sha256)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.thumbnail((size, size))
+            preview = io.BytesIO()
+            image.convert('RGB').save(preview, 'JPEG', quality=THUMBNAIL_QUALITY)
+    except (OSError, ValueError) as e:
+        # Not an image Pillow can read, despite its type
+        print(f'Error log: {e}')
+        return None
+    write_atomically(path, preview.getvalue())
+    return path
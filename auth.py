@@ -0,0 +1,53 @@
+import secrets
+from urllib.parse import urlencode
+import streamlit as st
+from instrumentation import timed
+
+
+# ----------------------------------------------------------------------------------------------------
+# Google OAuth 2.0
+# ----------------------------------------------------------------------------------------------------
+
+def oauth_scope():
+    scope = st.secrets['gdrive']['scope']
+    return ' '.join(scope) if isinstance(scope, (list, tuple)) else scope
+
+
+def authorization_url():
+    """Builds the Google login URL.
+
+    The login screen is the first thing every visitor sees, so the URL is assembled with the
+    standard library instead of importing the OAuth client just to format a query string.
+    """
+    settings = st.secrets['gdrive']
+    params = {
+        'response_type': 'code',
+        'client_id': settings['client_id_key'],
+        'redirect_uri': settings['redirect_uri'],  # Ensure this matches the Google Cloud Console settings
+        'scope': oauth_scope(),
+        'state': secrets.token_urlsafe(30),
+    }
+    separator = '&' if '?' in settings['auth_uri'] else '?'
+    return f"{settings['auth_uri']}{separator}{urlencode(params)}"
+
+
+def oauth_session(token=None):
+    """Creates an OAuth2 session; authlib is only imported once the user is coming back from Google."""
+    from authlib.integrations.requests_client import OAuth2Session
+
+    settings = st.secrets['gdrive']
+    return OAuth2Session(settings['client_id_key'], settings['client_secret_key'],
+                         redirect_uri=settings['redirect_uri'], scope=oauth_scope(), token=token)
+
+
+def fetch_token(code):
+    """Exchanges the authorization code returned by Google for a token."""
+    with timed('oauth', 'fetch_token'):
+        return oauth_session().fetch_token(st.secrets['gdrive']['token_uri'], code=code,
+                                           grant_type="authorization_code")
+
+
+def fetch_userinfo(token):
+    """Fetches the logged-in user's profile; returns the HTTP response."""
+    with timed('oauth', 'userinfo'):
+        return oauth_session(token).get(st.secrets['gdrive']['userinfo_uri'])
@@ -0,0 +1,392 @@
+"""Synthetic purchase data generator and benchmark suite for the report and data entry paths.
+
+Run headlessly (no `streamlit run` needed), e.g.:
+
+    python benchmark.py --rows 1000 100000 --projects 20 --output results.json
+    python benchmark.py --rows 100000 --compare results.json
+    python benchmark.py --imports --output imports.json
+"""
+import os
+import sys
+import json
+import random
+import sqlite3
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from itertools import accumulate
+from contextlib import closing
+from time import perf_counter
+from datetime import date, timedelta
+
+import services
+import columnar
+import analytics
+from services import connect_db, create_schema, Purchase, INSERT_PURCHASE
+from reports import expenses_pivot, purchase_amounts, fetch_concurrently
+
+# Realistic item mix: (item name, unit, low unit price, high unit price)
+ITEMS = [
+    ('Cement', 'MT', 6000, 9000),
+    ('Steel Rods', 'MT', 55000, 70000),
+    ('River Sand', 'MT', 1200, 2500),
+    ('Bricks', 'Nos', 6, 12),
+    ('Paint', 'Liters', 180, 650),
+    ('Tiles', 'Nos', 40, 350),
+    ('PVC Pipes', 'Nos', 150, 900),
+    ('Electrical Wire', 'Units', 900, 4000),
+    ('Teak Wood', 'Kg', 250, 600),
+    ('Labour Charges', None, 500, 1500),
+]
+
+PAYMENT_MODES = ["No Payment", "UPI", "Credit Card", "Debit Card", "Cash", "Bank Transfer"]
+
+# Operations that write: they run on a copy of the generated database, so that every run (--reuse
+# included) measures the same data
+MUTATING_OPERATIONS = {'insert_purchase', 'insert_invoice'}
+
+
+# ----------------------------------------------------------------------------------------------------
+# Synthetic data generation
+# ----------------------------------------------------------------------------------------------------
+
+def vendor_weights(vendors, skew):
+    """Zipf-like weights so a handful of vendors get most of the purchases."""
+    return [1 / (rank ** skew) for rank in range(1, vendors + 1)]
+
+
+def generate_purchases(rows, projects, vendors, skew=1.1, seed=42, start=date(2021, 1, 1), days=1095):
+    """Yields purchase rows shaped like the data entry form produces them."""
+    rng = random.Random(seed)
+    names = [f'Vendor {i:04d}' for i in range(1, vendors + 1)]
+    cum_weights = list(accumulate(vendor_weights(vendors, skew)))
+    stages = ['Basement', 'Roof', 'Masonry', 'Finishes', 'Site Work and Fixtures']
+    categories = ["General", "Material", "MEP Labour", "Mason Labour", "Misc Civil Labour",
+                  "Paint Labour", "Tiling Labour", "Joinery"]
+
+    for _ in range(rows):
+        item_name, unit, low, high = rng.choice(ITEMS)
+        item_qty = round(rng.uniform(1, 50), 2) if unit else None
+        purchase_amount = round((item_qty or 1) * rng.uniform(low, high), 2)
+        mode_of_payment = rng.choice(PAYMENT_MODES)
+        paid_amount = 0 if mode_of_payment == "No Payment" else round(purchase_amount * rng.choice((0.5, 1, 1)), 2)
+        yield (rng.randint(1, projects), item_name, item_qty, unit, rng.choices(names, cum_weights=cum_weights)[0],
+               rng.choice(stages), rng.choice(categories),
+               (start + timedelta(days=rng.randrange(days))).isoformat(), purchase_amount, mode_of_payment,
+               paid_amount, None if mode_of_payment == "No Payment" else 'Site Engineer', None)
+
+
+def generate_database(database_name, rows, projects=10, vendors=200, skew=1.1, seed=42, batch_size=50000):
+    """Creates a fresh purchase database using the app schema and fills it with synthetic rows.
+
+    Args:
+        database_name: Path of the database file to (re)create.
+        rows: Number of purchases to generate.
+        projects: Number of projects the purchases are spread across.
+        vendors: Number of distinct vendors.
+        skew: Zipf exponent of the vendor distribution (0 = uniform).
+        seed: Random seed so runs are reproducible.
+        batch_size: Rows per executemany batch.
+    """
+    remove_database(database_name)
+    create_schema(database_name)
+
+    conn = connect_db(database_name)
+    try:
+        # Bulk load only: the file is throw-away until the load completes
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executemany('INSERT INTO projects (project_name, project_location) VALUES (?, ?)',
+                         [(f'Project {i}', f'Site {i}') for i in range(1, projects + 1)])
+        batch = []
+        for row in generate_purchases(rows, projects, vendors, skew, seed):
+            batch.append(row)
+            if len(batch) == batch_size:
+                conn.executemany(INSERT_PURCHASE, batch)
+                batch = []
+        if batch:
+            conn.executemany(INSERT_PURCHASE, batch)
+        conn.commit()
+    finally:
+        conn.close()
+    # Turning the journal off left WAL mode; measure in the mode the app runs in
+    services.enable_wal(database_name)
+
+
+def remove_database(database_name):
+    """Deletes a database file together with its write-ahead log and shared memory files."""
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(f'{database_name}{suffix}')
+        except FileNotFoundError:
+            pass
+    services.database_replaced(database_name)
+
+
+def working_copy(database_name):
+    """A fresh copy of the database for the mutating operations; returns its path."""
+    copy_name = f'{os.path.splitext(database_name)[0]}.work.db'
+    remove_database(copy_name)
+    with closing(sqlite3.connect(database_name)) as source, closing(sqlite3.connect(copy_name)) as target:
+        source.backup(target)
+    services.enable_wal(copy_name)
+    return copy_name
+
+
+# ----------------------------------------------------------------------------------------------------
+# Timed operations
+# ----------------------------------------------------------------------------------------------------
+
+def insert_one_purchase(database_name):
+    """Mirrors the data entry submit path: one insert and one commit per submitted item."""
+    services.add_purchase(database_name, Purchase(1, 'Cement', 10, 'MT', 'Vendor 0001', 'Roof', 'Material',
+                                                  date.today(), 75000, 'UPI', 75000, 'Site Engineer'))
+
+
+def insert_invoice(database_name, line_items=20):
+    """Mirrors the invoice entry submit path: all line items of one invoice in one transaction."""
+    services.add_purchases(database_name, [
+        Purchase(1, f'Item {i}', 10, 'MT', 'Vendor 0001', 'Roof', 'Material', date.today(), 75000, 'UPI', 75000,
+                 'Site Engineer') for i in range(line_items)])
+
+
+def reference_queries(database_name):
+    """The lookups the data entry page runs on every rerun."""
+    services.list_projects(database_name)
+    services.reference_data(database_name)
+
+
+def columnar_slice(database_name, project_id):
+    """An interactive drill-down on the columnar cache: one vendor's spend per stage within a project."""
+    columns = columnar.purchase_columns(database_name)
+    return columns.group_sum('stage', mask=columns.mask(project_id=project_id, vendor='vendor 0001'))
+
+
+def report_panels(database_name, project_id):
+    """The independent queries of the reports page, in their SQL versions so that the pool is what is measured."""
+    return [
+        lambda: services.purchase_amounts_table(database_name, project_id),
+        lambda: services.distinct_column_values(database_name, 'vendor'),
+        lambda: services.expenditure_by_category(database_name, project_id),
+        lambda: services.expenditure_by_stage(database_name, project_id),
+        lambda: services.budget_variance(database_name, project_id),
+        lambda: services.vendor_payables(database_name, project_id),
+        lambda: services.vendor_aging(database_name, project_id),
+    ]
+
+
+def cold_pivot(database_name, engine_name):
+    """The first pivot after a restart, which loads the engine's cache from the database."""
+    analytics.engine(engine_name).clear_cache()
+    return analytics.expenses_pivot_table(database_name, engine_name)
+
+
+def analytics_operations(database_name, project_id):
+    """The heavy reports on every installed analytics engine, to compare the engines."""
+    operations = {}
+    for name in analytics.ENGINES:
+        if analytics.engine_name(name) != name:
+            continue  # Not installed
+        operations[f'analytics_pivot_{name}'] = lambda name=name: analytics.expenses_pivot_table(database_name, name)
+        operations[f'analytics_amounts_{name}'] = lambda name=name: analytics.purchase_amounts_table(database_name,
+                                                                                                     name)
+        operations[f'analytics_category_{name}'] = lambda name=name: analytics.expenditure_by_category(
+            database_name, project_id, name)
+        if hasattr(analytics.engine(name), 'clear_cache'):
+            operations[f'analytics_cold_{name}'] = lambda name=name: cold_pivot(database_name, name)
+    return operations
+
+
+def operations(database_name, project_id=1):
+    """Named benchmark operations, each a zero-argument callable."""
+    return {
+        'expenses_pivot': lambda: expenses_pivot(database_name),
+        'purchase_amounts': lambda: purchase_amounts(database_name),
+        'expenses_pivot_sql': lambda: services.expenses_pivot_table(database_name),
+        'expenses_pivot_columnar': lambda: columnar.expenses_pivot_table(database_name),
+        'columnar_slice': lambda: columnar_slice(database_name, project_id),
+        'report_panels_sequential': lambda: [fetch() for fetch in report_panels(database_name, project_id)],
+        'report_panels_concurrent': lambda: fetch_concurrently(report_panels(database_name, project_id)),
+        'reference_queries': lambda: reference_queries(database_name),
+        'view_purchases': lambda: services.view_purchases(database_name, project_id),
+        'distinct_vendor': lambda: services.distinct_column_values(database_name, 'vendor'),
+        'purchase_data_by_vendor': lambda: services.purchase_data_by_column(database_name, 'vendor', 'vendor 0001',
+                                                                            project_id),
+        'expenditure_by_category': lambda: services.expenditure_by_category(database_name, project_id),
+        'expenditure_by_stage': lambda: services.expenditure_by_stage(database_name, project_id),
+        'insert_purchase': lambda: insert_one_purchase(database_name),
+        'insert_invoice': lambda: insert_invoice(database_name),
+        'vendor_payables': lambda: services.vendor_payables(database_name, project_id),
+        'vendor_aging': lambda: services.vendor_aging(database_name, project_id),
+        **analytics_operations(database_name, project_id),
+    }
+
+
+def time_operation(operation, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        operation()
+        samples.append(perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_s': min(samples),
+        'median_s': statistics.median(samples),
+        'mean_s': statistics.fmean(samples),
+        'max_s': max(samples),
+    }
+
+
+def run_benchmarks(database_name, rows, repeat=5, only=None):
+    """Times every operation against one generated database and returns result records.
+
+    The mutating operations write to a copy of the database, made for this run and deleted after it.
+    """
+    selected = {name: operation for name, operation in operations(database_name).items()
+                if not only or name in only}
+    copy_name = working_copy(database_name) if MUTATING_OPERATIONS & selected.keys() else None
+    try:
+        if copy_name:
+            selected.update({name: operation for name, operation in operations(copy_name).items()
+                             if name in MUTATING_OPERATIONS and name in selected})
+        return time_operations(selected, rows, repeat)
+    finally:
+        if copy_name:
+            remove_database(copy_name)
+
+
+def time_operations(selected, rows, repeat):
+    results = []
+    for name, operation in selected.items():
+        record = {'operation': name, 'rows': rows}
+        record.update(time_operation(operation, repeat))
+        results.append(record)
+        print(f"{rows:>10} rows  {name:<26} median {record['median_s'] * 1000:10.2f} ms", file=sys.stderr)
+    return results
+
+
+# ----------------------------------------------------------------------------------------------------
+# Import time
+# ----------------------------------------------------------------------------------------------------
+
+IMPORT_TARGETS = ['streamlit', 'utils', 'auth', 'Data_Entry', 'reports', 'connection_utils']
+HEAVY_MODULES = ['pandas', 'googleapiclient', 'authlib']
+
+IMPORT_PROBE = '''
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def time_import(module, repeat=5):
+    """Times a cold import of one app module, each sample in a fresh interpreter."""
+    samples, loaded = [], []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                   capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        probe = json.loads(completed.stdout.strip().splitlines()[-1])
+        samples.append(probe['seconds'])
+        loaded = probe['loaded']
+    return {
+        'operation': f'import:{module}',
+        'rows': 0,
+        'repeat': repeat,
+        'min_s': min(samples),
+        'median_s': statistics.median(samples),
+        'mean_s': statistics.fmean(samples),
+        'max_s': max(samples),
+        'heavy_modules_loaded': loaded,
+    }
+
+
+def run_import_benchmarks(repeat=5):
+    results = []
+    for module in IMPORT_TARGETS:
+        record = time_import(module, repeat)
+        results.append(record)
+        print(f"import {module:<20} median {record['median_s'] * 1000:10.2f} ms  "
+              f"loads {', '.join(record['heavy_modules_loaded']) or '-'}", file=sys.stderr)
+    return results
+
+
+# ----------------------------------------------------------------------------------------------------
+# Comparing runs
+# ----------------------------------------------------------------------------------------------------
+
+def compare_results(baseline, current, threshold=0.2):
+    """Lists operations whose median got slower than the baseline by more than the threshold."""
+    baseline_medians = {(r['operation'], r['rows']): r['median_s'] for r in baseline['results']}
+    regressions = []
+    for record in current['results']:
+        before = baseline_medians.get((record['operation'], record['rows']))
+        if before and record['median_s'] > before * (1 + threshold):
+            regressions.append({'operation': record['operation'], 'rows': record['rows'],
+                                'baseline_s': before, 'current_s': record['median_s'],
+                                'ratio': record['median_s'] / before})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--projects', type=int, default=10)
+    parser.add_argument('--vendors', type=int, default=200)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of the vendor distribution')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help='Run only these operations')
+    parser.add_argument('--imports', action='store_true', help='Benchmark cold import time of the app modules')
+    parser.add_argument('--directory', default='bench_data', help='Where the generated databases are kept')
+    parser.add_argument('--reuse', action='store_true', help='Reuse previously generated databases')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='Baseline JSON results to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before flagging')
+    args = parser.parse_args(argv)
+
+    # The report builders render through Streamlit; outside `streamlit run` that only logs bare-mode warnings
+    logging.disable(logging.WARNING)
+    os.makedirs(args.directory, exist_ok=True)
+
+    results = run_import_benchmarks(args.repeat) if args.imports else []
+    for rows in ([] if args.imports else args.rows):
+        database_name = os.path.join(args.directory, f'bench_{rows}_{args.projects}_{args.vendors}.db')
+        if not (args.reuse and os.path.exists(database_name)):
+            start = perf_counter()
+            generate_database(database_name, rows, args.projects, args.vendors, args.skew, args.seed)
+            results.append({'operation': 'generate', 'rows': rows, 'repeat': 1,
+                            'median_s': perf_counter() - start})
+        results.extend(run_benchmarks(database_name, rows, args.repeat, args.only))
+
+    report = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'parameters': {'projects': args.projects, 'vendors': args.vendors, 'skew': args.skew,
+                       'seed': args.seed, 'repeat': args.repeat},
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = compare_results(json.load(fh), report, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['operation']} @ {regression['rows']} rows: "
+                  f"{regression['ratio']:.2f}x slower", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,404 @@
+"""Columnar in-memory copy of the purchases for fast reports.
+
+The live purchases of a database (or of one project) are loaded once into NumPy arrays: stage,
+category, vendor and mode of payment as dictionary codes, amounts as float64 and dates as day
+numbers. Pivots, filters and group-bys then run as vectorized operations instead of a query, a
+list of tuples and a DataFrame per view.
+
+The copy is kept current incrementally: every change to purchases is in audit_log (see
+services.MIGRATIONS), so each access applies the entries recorded since the last one. A database
+file replaced wholesale (downloaded from Drive) is reloaded.
+
+Reports are computed on a ColumnsSnapshot, which never changes once handed out, so sessions and the
+report pool can query it while another access applies newer changes. Appends go past the end of the
+snapshot's views; a change to a row a snapshot can see copies the arrays first.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+import services
+import shards
+import tenants
+from services import Table, reading
+from queries import statement
+
+DIMENSIONS = ('stage', 'category', 'vendor', 'mode_of_payment')
+COLUMN_TYPES = {
+    'purchase_id': np.int64,
+    'project_id': np.int64,
+    'day': np.int32,
+    'purchase_amount': np.float64,
+    'paid_amount': np.float64,
+    'paid_known': bool,
+    'live': bool,
+    **{dimension: np.int32 for dimension in DIMENSIONS},
+}
+FETCH_BATCH = 10000
+
+
+class Dictionary:
+    """Maps each distinct value of a column to a small integer code."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def copy(self):
+        dictionary = Dictionary()
+        dictionary.values = list(self.values)
+        dictionary.codes = dict(self.codes)
+        return dictionary
+
+
+def day_number(value):
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return 0
+
+
+class PurchaseColumns:
+    """Columns of the live purchases of a database, or of one project when project_id is given.
+
+    Only used under the lock of its cache entry; readers get a snapshot() of it.
+    """
+
+    def __init__(self, database_name, project_id=None):
+        self.database_name = database_name
+        self.project = int(project_id) if project_id is not None else None
+        self.generation = services.database_generation(database_name)
+        self.dictionaries = {dimension: Dictionary() for dimension in DIMENSIONS}
+        self.index = {}  # purchase id -> row
+        self.size = 0
+        self._snapshot = None
+        # Whether a snapshot holds views of the arrays, which must then be copied before a row changes
+        self._shared = False
+        self._allocate(FETCH_BATCH)
+        self._load()
+
+    # ------------------------------------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------------------------------------
+
+    def _allocate(self, capacity):
+        """Moves the columns into new arrays of the given capacity; snapshots keep the old ones."""
+        old_size = self.size
+        for name, dtype in COLUMN_TYPES.items():
+            array = np.zeros(capacity, dtype=dtype)
+            if old_size:
+                array[:old_size] = getattr(self, name)[:old_size]
+            setattr(self, name, array)
+        self.capacity = capacity
+        self._shared = False
+
+    def _change_row(self):
+        """Called before an existing row is changed in place."""
+        if self._shared:
+            self._allocate(self.capacity)
+        self._snapshot = None
+
+    def _set_row(self, row, values):
+        purchase_id, project_id, stage, category, vendor, mode_of_payment, day, purchase_amount, paid_amount = values
+        self.purchase_id[row] = purchase_id
+        self.project_id[row] = project_id
+        self.stage[row] = self.dictionaries['stage'].encode(stage)
+        self.category[row] = self.dictionaries['category'].encode(category)
+        self.vendor[row] = self.dictionaries['vendor'].encode(vendor)
+        self.mode_of_payment[row] = self.dictionaries['mode_of_payment'].encode(mode_of_payment)
+        self.day[row] = day_number(day)
+        self.purchase_amount[row] = purchase_amount or 0
+        self.paid_amount[row] = paid_amount or 0
+        self.paid_known[row] = paid_amount is not None
+        self.live[row] = True
+
+    def _append(self, values):
+        if self.size == self.capacity:
+            self._allocate(self.capacity * 2)
+        self.index[values[0]] = self.size
+        # Past the end of every snapshot, so written in place
+        self._set_row(self.size, values)
+        self.size += 1
+        self._snapshot = None
+
+    def _load(self):
+        with reading(self.database_name) as conn:
+            # One read transaction, so the rows and the audit position match
+            conn.execute('BEGIN')
+            self.audit_id = conn.execute(statement('audit.latest_id')).fetchone()[0]
+            if self.project is None:
+                cursor = conn.execute(statement('columnar.load_all'))
+            else:
+                cursor = conn.execute(statement('columnar.load_project'), (self.project,))
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    self._append(row)
+
+    # ------------------------------------------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------------------------------------------
+
+    def refresh(self):
+        """Applies the purchases changes recorded in audit_log since the last refresh."""
+        while True:
+            entries = services.audit_entries(self.database_name, self.audit_id, FETCH_BATCH)
+            for entry in entries:
+                if entry.table_name == 'purchases':
+                    self._apply(entry)
+                self.audit_id = entry.audit_id
+            if len(entries) < FETCH_BATCH:
+                return
+
+    def _apply(self, entry):
+        row = self.index.get(entry.row_id)
+        if entry.action == 'purge':
+            if row is not None:
+                self._change_row()
+                self.live[row] = False
+            return
+
+        payload = json.loads(entry.payload)
+        belongs = payload['deleted_at'] is None and (self.project is None or int(payload['project_id']) == self.project)
+        if not belongs:
+            if row is not None:
+                self._change_row()
+                self.live[row] = False
+            return
+
+        values = (payload['purchase_id'], payload['project_id'], payload['stage'], payload['category'],
+                  str(payload['vendor']).strip().lower(), str(payload['mode_of_payment']).strip().lower(),
+                  payload['date'], payload['purchase_amount'], payload['paid_amount'])
+        if row is None:
+            self._append(values)
+        else:
+            self._change_row()
+            self._set_row(row, values)
+
+    def snapshot(self):
+        """The columns as they are now, unchanged by later refreshes; the same object until something changes."""
+        if self._snapshot is None:
+            self._snapshot = ColumnsSnapshot(self)
+            self._shared = True
+        return self._snapshot
+
+
+class ColumnsSnapshot:
+    """Read-only columns of the purchases as of one refresh, safe to query from any number of threads."""
+
+    def __init__(self, columns):
+        self.size = columns.size
+        self.dictionaries = {dimension: dictionary.copy() for dimension, dictionary in columns.dictionaries.items()}
+        for name in COLUMN_TYPES:
+            view = getattr(columns, name)[:self.size]
+            view.flags.writeable = False
+            setattr(self, name, view)
+
+    # ------------------------------------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------------------------------------
+
+    def mask(self, **filters):
+        """Boolean mask of the live rows matching every filter, e.g. mask(stage='Roof', vendor='abc traders').
+
+        Day filters take ordinals: mask(day_from=..., day_to=...).
+        """
+        mask = self.live[:self.size].copy()
+        for name, value in filters.items():
+            if name == 'day_from':
+                mask &= self.day[:self.size] >= value
+            elif name == 'day_to':
+                mask &= self.day[:self.size] <= value
+            elif name == 'project_id':
+                mask &= self.project_id[:self.size] == int(value)
+            else:
+                code = self.dictionaries[name].codes.get(value)
+                if code is None:
+                    return np.zeros(self.size, dtype=bool)
+                mask &= getattr(self, name)[:self.size] == code
+        return mask
+
+    def group_sum(self, dimension, values='purchase_amount', mask=None):
+        """Sum of a value column per code of the dimension (indexed by code)."""
+        mask = self.live[:self.size] if mask is None else mask
+        codes = getattr(self, dimension)[:self.size]
+        weights = getattr(self, values)[:self.size]
+        return np.bincount(codes[mask], weights=weights[mask], minlength=len(self.dictionaries[dimension].values))
+
+    def group_count(self, dimension, mask=None):
+        mask = self.live[:self.size] if mask is None else mask
+        codes = getattr(self, dimension)[:self.size]
+        return np.bincount(codes[mask], minlength=len(self.dictionaries[dimension].values))
+
+    def pivot(self, rows, columns, values='purchase_amount', mask=None):
+        """Sum of a value column per (row code, column code), as a 2-d array indexed by the two codes."""
+        mask = self.live[:self.size] if mask is None else mask
+        row_count = len(self.dictionaries[rows].values)
+        column_count = len(self.dictionaries[columns].values)
+        combined = getattr(self, rows)[:self.size][mask].astype(np.int64) * column_count \
+            + getattr(self, columns)[:self.size][mask]
+        sums = np.bincount(combined, weights=getattr(self, values)[:self.size][mask],
+                           minlength=row_count * column_count)
+        return sums.reshape(row_count, column_count)
+
+    def aligned(self, dimension, labels, per_code):
+        """Reorders a per-code array to follow the given labels (0 for labels that never occur)."""
+        codes = self.dictionaries[dimension].codes
+        return np.array([per_code[codes[label]] if label in codes else 0 for label in labels], dtype=per_code.dtype)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Cache
+# ----------------------------------------------------------------------------------------------------
+
+MAX_CACHED_COLUMNS = int(os.environ.get('CONSMAN_COLUMNAR_CACHE_SIZE', 64))
+
+_cache = OrderedDict()  # (database path, project id) -> (lock, columns), least recently used first
+_cache_guard = threading.Lock()
+
+
+def purchase_columns(database_name, project_id=None):
+    """Snapshot of the cached columns of the database (or of one project), with the latest changes applied.
+
+    At most MAX_CACHED_COLUMNS column sets are kept; the least recently used one is dropped first.
+    """
+    key = (os.path.abspath(database_name), None if project_id is None else int(project_id))
+    with _cache_guard:
+        lock, columns = _cache.setdefault(key, (threading.Lock(), None))
+    with lock:
+        if columns is None or columns.generation != services.database_generation(database_name):
+            columns = PurchaseColumns(database_name, project_id)
+        else:
+            columns.refresh()
+        with _cache_guard:
+            _cache[key] = (lock, columns)
+            _cache.move_to_end(key)
+            while len(_cache) > MAX_CACHED_COLUMNS:
+                _cache.popitem(last=False)
+        return columns.snapshot()
+
+
+def clear_cache():
+    with _cache_guard:
+        _cache.clear()
+
+
+def evict(database_name):
+    """Eviction hook: drops the cached columns of an idle tenant's database and of its shards."""
+    paths = {os.path.abspath(path) for path in [database_name, *shards.local_shards(database_name)]}
+    with _cache_guard:
+        for key in [key for key in _cache if key[0] in paths]:
+            del _cache[key]
+
+
+tenants.register_eviction_hook(evict)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reports
+# ----------------------------------------------------------------------------------------------------
+
+def percentages(values, total):
+    return [round(100.0 * float(value) / total, 2) if total > 0 else 0 for value in values]
+
+
+def expenses_pivot_table(database_name):
+    """Same table as services.expenses_pivot_table, computed on the columnar cache."""
+    categories = services.query_column(database_name, statement('reference.categories'))
+    if not categories:
+        raise ValueError("No categories found.")
+    columns = purchase_columns(database_name)
+
+    stage_labels = columns.dictionaries['stage'].values
+    matrix = columns.pivot('stage', 'category')
+    counts = columns.group_count('stage')
+    category_codes = columns.dictionaries['category'].codes
+
+    rows = []
+    # Stages with purchases, in the order GROUP BY stage would list them
+    for stage in sorted(label for label in stage_labels if counts[columns.dictionaries['stage'].codes[label]]):
+        stage_row = matrix[columns.dictionaries['stage'].codes[stage]]
+        amounts = [float(stage_row[category_codes[category]]) if category in category_codes else 0
+                   for category in categories]
+        rows.append((stage, *amounts, float(stage_row.sum())))
+
+    totals = columns.aligned('category', categories, columns.group_sum('category'))
+    grand_total = float(columns.group_sum('category').sum())
+    rows.append(('Total', *[float(total) for total in totals], grand_total))
+    rows.append(('Percentage', *percentages(totals, grand_total), 100 if grand_total > 0 else 0))
+    return Table(['Stage'] + categories + ['Purchase Amount'], rows)
+
+
+def purchase_amounts_table(database_name, project_id=None):
+    """Same table as services.purchase_amounts_table, computed on the columnar cache."""
+    categories_list = services.query_column(database_name, statement('reference.categories'))
+    stages_list = services.query_column(database_name, statement('reference.stages'))
+    if not categories_list or not stages_list:
+        raise ValueError("No categories or stages found.")
+    columns = purchase_columns(database_name, project_id)
+
+    matrix = columns.pivot('category', 'stage')
+    category_codes = columns.dictionaries['category'].codes
+    stage_codes = columns.dictionaries['stage'].codes
+
+    rows = []
+    for category in categories_list:
+        if category in category_codes:
+            category_row = matrix[category_codes[category]]
+            amounts = [float(category_row[stage_codes[stage]]) if stage in stage_codes else 0 for stage in stages_list]
+            rows.append([category] + amounts + [float(category_row.sum())])
+        else:
+            rows.append([category] + [0] * (len(stages_list) + 1))
+
+    grand_total_row = ['Grand Total'] + [sum(row[i] for row in rows) for i in range(1, len(stages_list) + 2)]
+    rows.append(grand_total_row)
+    grand_total = grand_total_row[-1]
+    for row in rows:
+        row.append(round(row[-1] / grand_total * 100, 2) if grand_total > 0 else 0)
+    rows.append(['Percentage'] + [
+        round(grand_total_row[i] / grand_total * 100, 2) if grand_total > 0 else 0
+        for i in range(1, len(stages_list) + 1)
+    ] + [100, None])
+    return Table(['Category'] + stages_list + ['Total', 'Percentage'], [tuple(row) for row in rows])
+
+
+def expenditure_table(database_name, project_id, dimension, labels, label_column):
+    # Listed like the SQL reports list them: one row per reference value, in GROUP BY order
+    labels = sorted(set(labels))
+    columns = purchase_columns(database_name, project_id)
+    purchased = columns.aligned(dimension, labels, columns.group_sum(dimension, 'purchase_amount'))
+    paid = columns.aligned(dimension, labels, columns.group_sum(dimension, 'paid_amount'))
+    counts = columns.aligned(dimension, labels, columns.group_count(dimension))
+    paid_counts = columns.aligned(dimension, labels,
+                                  columns.group_count(dimension, columns.mask() & columns.paid_known[:columns.size]))
+    rows = []
+    for label, purchase_sum, paid_sum, count, paid_count in zip(labels, purchased, paid, counts, paid_counts):
+        if not count:
+            rows.append((label, 'Not Yet Started', 'Not Yet Started', 'Not Yet Started'))
+        else:
+            rows.append((label, float(purchase_sum), float(paid_sum) if paid_count else 'Not Yet Started',
+                         float(purchase_sum - paid_sum)))
+    return Table([label_column, 'Purchase Amount', 'Paid Amount', 'Difference'], rows)
+
+
+def expenditure_by_category(database_name, project_id):
+    """Same table as services.expenditure_by_category, computed on the columnar cache."""
+    categories = services.query_column(database_name, statement('reference.categories'))
+    return expenditure_table(database_name, project_id, 'category', categories, 'Category')
+
+
+def expenditure_by_stage(database_name, project_id):
+    """Same table as services.expenditure_by_stage, computed on the columnar cache."""
+    stages = services.query_column(database_name, statement('reference.stages'))
+    return expenditure_table(database_name, project_id, 'stage', stages, 'Stage')
@@ -1,43 +1,55 @@
 import io
-import streamlit as st
+import os
+import httplib2
+from datetime import datetime, timezone
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from time import sleep
+from instrumentation import timed
+from drive_client import execute, lookup, call
 
-SCOPES = st.secrets['gdrive']['scopes']
+# Seconds before a Drive request is abandoned, so a stalled connection fails instead of hanging
+DRIVE_TIMEOUT = 60
+
+# Everything a Drive call raises when the API refuses it or the network is down (timeouts included)
+DRIVE_ERRORS = (HttpError, httplib2.HttpLib2Error, OSError)
+
+# The functions in this module only talk to Drive: they return results and raise HttpError,
+# and leave it to the caller (a Streamlit page or a headless job) to report progress. Every
+# request goes through drive_client, which rate limits and retries it.
 
 
 # ----------------------------------------------------------------------------------------------------
 # Google Drive Connection
 # ----------------------------------------------------------------------------------------------------
 
-def authenticate_gdrive():
+def authenticate_gdrive(service_account_info=None):
+    """Builds service account credentials, read from st.secrets['gdrive'] unless given explicitly."""
+    if service_account_info is None:
+        # Secrets are read on use rather than at import time
+        import streamlit as st
+        service_account_info = st.secrets["gdrive"]
     creds = service_account.Credentials.from_service_account_info(
-        st.secrets["gdrive"],
-        scopes=SCOPES
+        service_account_info,
+        scopes=service_account_info['scopes']
     )
     return creds
 
 
-def establish_gdrive_connections():
+def establish_gdrive_connections(service_account_info=None):
     """
     Establishes a connection to Google Drive.
 
     Returns:
-        tuple: A tuple containing the Google Drive service.
+        The Google Drive service.
     """
-    try:
-        # Authenticate and create Google Drive service
-        creds = authenticate_gdrive()  # Replace with your actual authentication function
-        service = build('drive', 'v3', credentials=creds)
-        return service
-
-    except Exception as e:
-        # Handle exceptions and provide feedback
-        st.error(f"Error establishing connections: {e}")
-        return None, None, None
+    # Authenticate and create Google Drive service
+    creds = authenticate_gdrive(service_account_info)
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=DRIVE_TIMEOUT))
+    service = build('drive', 'v3', http=http)
+    return service
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -46,146 +58,165 @@ def establish_gdrive_connections():
 
 def list_files(service):
     """Lists the files in Google Drive to help verify file IDs."""
-    try:
-        results = service.files().list(pageSize=10, fields="nextPageToken, files(id, name, parents)").execute()
-        items = results.get('files', [])
-        if not items:
-            st.write("No files found.")
-        else:
-            st.write("Files:")
-            for item in items:
-                st.write(f"{item['name']} ({item['id']}) {item['parents']}")
-    except HttpError as error:
-        st.error(f"An error occurred while listing files: {error}")
-
-
-def upload_db_to_drive(service, db_name, file_id=None):
+    with timed('drive', 'files.list') as span:
+        results = lookup(service.files().list(pageSize=10, fields="nextPageToken, files(id, name, parents)"))
+        span['rows'] = len(results.get('files', []))
+    return results.get('files', [])
+
+
+def upload_db_to_drive(service, db_name, file_id=None, source_path=None):
     """Uploads or updates the SQLite database file to Google Drive.
 
     Args:
         service: Authenticated Google Drive service instance.
         db_name: Name of the database file to upload.
         file_id: Optional; ID of the file to update. If None, a new file will be created.
+        source_path: Optional; file whose content is uploaded under db_name (e.g. a snapshot of it).
 
     Returns:
         The ID of the uploaded or updated file.
     """
-    try:
-        # Define the metadata for the file (with correct MIME type for SQLite)
-        file_metadata = {
-            'name': db_name,
-            'mimeType': 'application/x-sqlite3'  # SQLite file MIME type
-        }
-
-        # Create media file upload
-        media = MediaFileUpload(db_name, mimetype='application/x-sqlite3')
-
-        if file_id:  # If updating an existing file
-            try:
-                # Attempt to retrieve the file to ensure it exists
-                service.files().get(fileId=file_id).execute()
-                # st.write("Updating the existing file...")
-
-                # Proceed to update the file
-                file = service.files().update(
-                    fileId=file_id,
-                    body=file_metadata,
-                    media_body=media
-                ).execute()
-
-                st.success("Data saved")
-                # st.success("Database updated successfully!")
-                # st.write(f"File ID: {file.get('id')}")
-                # st.write(f"File metadata after update: {file}")
-
-            except HttpError as e:
-                if e.resp.status == 404:
-                    st.error("File not found. Please check the file ID.")
-                    return None
-                else:
-                    st.error(f"An error occurred: {e}")
-                    return None
-        else:  # If creating a new file
-            # Create the file on Google Drive
-            st.write("Creating a new file...")
-            file = service.files().create(
+    # Define the metadata for the file (with correct MIME type for SQLite)
+    file_metadata = {
+        'name': db_name,
+        'mimeType': 'application/x-sqlite3'  # SQLite file MIME type
+    }
+
+    # Create media file upload
+    source_path = source_path or db_name
+    media = MediaFileUpload(source_path, mimetype='application/x-sqlite3')
+
+    if file_id:  # If updating an existing file (a missing file fails the update itself with a 404)
+        with timed('drive', 'files.update') as span:
+            span['bytes'] = os.path.getsize(source_path)
+            file = execute(service.files().update(
+                fileId=file_id,
+                body=file_metadata,
+                media_body=media
+            ))
+    else:  # If creating a new file
+        with timed('drive', 'files.create') as span:
+            span['bytes'] = os.path.getsize(source_path)
+            file = execute(service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
-            st.success(f"Database uploaded successfully! File ID: {file.get('id')}")
-            st.write(f"File metadata after creation: {file}{db_name}")
+            ), recover=lambda: created_file(service, db_name))
 
-        return file.get('id')  # Return the file ID
+    return file.get('id')  # Return the file ID
 
-    except HttpError as error:
-        st.error(f"An error occurred during upload: {error}")
-        return None
+
+def upload_blob_to_drive(service, blob_name, source_path, mime_type=None):
+    """Uploads an attachment blob as a new Drive file and returns its ID."""
+    mime_type = mime_type or 'application/octet-stream'
+    media = MediaFileUpload(source_path, mimetype=mime_type)
+    with timed('drive', 'files.create') as span:
+        span['bytes'] = os.path.getsize(source_path)
+        file = execute(service.files().create(
+            body={'name': blob_name, 'mimeType': mime_type},
+            media_body=media,
+            fields='id'
+        ), recover=lambda: created_file(service, blob_name))
+    return file.get('id')
+
+
+def created_file(service, file_name):
+    """The file a create that failed without a response may have made, looked up by name before it is retried."""
+    file_id = check_existing_file(service, file_name)
+    return {'id': file_id} if file_id else None
 
 
 def share_file_with_user(service, file_id, user_email):
     """Shares the uploaded file with a specified user."""
-    try:
-        # Permission settings: granting view access to your email
-        permission = {
-            'type': 'user',
-            'role': 'reader',  # Can change to 'reader' for read-only
-            'emailAddress': user_email
-        }
-        service.permissions().create(fileId=file_id, body=permission).execute()
-        st.success(f"File shared successfully with {user_email}")
-    except HttpError as error:
-        st.error(f"An error occurred while sharing the file: {error}")
+    # Permission settings: granting view access to your email
+    permission = {
+        'type': 'user',
+        'role': 'reader',  # Can change to 'reader' for read-only
+        'emailAddress': user_email
+    }
+    with timed('drive', 'permissions.create'):
+        execute(service.permissions().create(fileId=file_id, body=permission),
+                recover=lambda: granted_permission(service, file_id, user_email))
+
+
+def granted_permission(service, file_id, user_email):
+    """The permission of the user on the file, looked up before a failed share is retried, or None."""
+    with timed('drive', 'permissions.list'):
+        results = execute(service.permissions().list(fileId=file_id, fields='permissions(id, emailAddress)'))
+    for permission in results.get('permissions', []):
+        if str(permission.get('emailAddress', '')).lower() == user_email.lower():
+            return permission
+    return None
 
 
 def check_existing_file(service, file_name):
-    """Check if a file with the given name already exists in Google Drive."""
-    try:
-        results = service.files().list(q=f"name='{file_name}'", fields="files(id, name)").execute()
-        items = results.get('files', [])
-        if items:
-            return items[0]['id']  # Return the ID of the first match
-        return None
-    except HttpError as error:
-        st.error(f"An error occurred while checking for existing files: {error}")
-        return None
-
-
-def download_db_from_drive(service, file_id, file_name):
-    """Download a file from Google Drive."""
+    """Check if a file with the given name already exists in Google Drive.
+
+    Returns:
+        The ID of the first match, or None.
+    """
+    items = find_files(service, file_name)
+    if items:
+        return items[0]  # Return the ID of the first match
+    return None
+
+
+def find_files(service, file_name):
+    """IDs of every Drive file with the given name."""
+    with timed('drive', 'files.list') as span:
+        results = lookup(service.files().list(q=f"name='{file_name}'", fields="files(id, name)"))
+        span['rows'] = len(results.get('files', []))
+    return [item['id'] for item in results.get('files', [])]
+
+
+def copy_file(service, file_id, file_name):
+    """Copies a Drive file under a new name and returns the ID of the copy."""
+    with timed('drive', 'files.copy'):
+        file = execute(service.files().copy(fileId=file_id, body={'name': file_name}, fields='id'),
+                       recover=lambda: created_file(service, file_name))
+    return file.get('id')
+
+
+def get_modified_time(service, file_id):
+    """Returns when the Drive file was last changed, in seconds since the epoch."""
+    with timed('drive', 'files.get'):
+        file = lookup(service.files().get(fileId=file_id, fields='modifiedTime'))
+    modified = datetime.strptime(file['modifiedTime'], '%Y-%m-%dT%H:%M:%S.%fZ')
+    return modified.replace(tzinfo=timezone.utc).timestamp()
+
+
+def download_db_from_drive(service, file_id, file_name, progress_callback=None):
+    """Download a file from Google Drive.
+
+    Args:
+        progress_callback: Optional; called with the completed fraction (0-1) after every chunk.
+    """
     request = service.files().get_media(fileId=file_id)
-    fh = io.FileIO(file_name, 'wb')  # Create a file handle for writing
-    downloader = MediaIoBaseDownload(fh, request)
-
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()  # Download in chunks
-        # st.write(f"Download progress: {int(status.progress() * 100)}%")
-        progress_bar = st.progress(0)
-        st.info('Download in progress...')
-        for i in range(1, 101):  # Simulate progress from 0% to 100%
-            sleep(0.01)  # Simulate time taken to download
-            progress_bar.progress(i / 100)  # Update the progress bar
-            # st.write(f"Download progress: {i}%")  # Update the status text
-    st.success(f"Data refreshed")
+    with io.FileIO(file_name, 'wb') as fh:  # Create a file handle for writing
+        downloader = MediaIoBaseDownload(fh, request)
+
+        done = False
+        while not done:
+            with timed('drive', 'files.get_media') as span:
+                position = fh.tell()
+                status, done = call(downloader.next_chunk)  # Download in chunks
+                span['bytes'] = fh.tell() - position
+            if progress_callback:
+                progress_callback(status.progress() if status else 1.0)
 
 
 def delete_files_with_db_name(service, db_name):
-    try:
-        # Search for files with the specific database name in Google Drive
-        query = f"name = '{db_name}'"
-        response = service.files().list(q=query, fields="files(id, name)").execute()
-
-        files = response.get('files', [])
-        if not files:
-            st.write(f"No files found with the name '{db_name}'.")
-            return
-
-        # Iterate over files and delete them
-        for file in files:
-            file_id = file['id']
-            service.files().delete(fileId=file_id).execute()
-            st.write(f"Deleted file: {file['name']} (ID: {file_id})")
-
-    except Exception as e:
-        st.error(f"An error occurred while deleting files: {e}")
+    """Deletes every Drive file with the given name and returns the deleted files."""
+    # Search for files with the specific database name in Google Drive
+    query = f"name = '{db_name}'"
+    with timed('drive', 'files.list') as span:
+        response = lookup(service.files().list(q=query, fields="files(id, name)"))
+        span['rows'] = len(response.get('files', []))
+
+    files = response.get('files', [])
+
+    # Iterate over files and delete them
+    for file in files:
+        with timed('drive', 'files.delete'):
+            execute(service.files().delete(fileId=file['id']))
+    return files
@@ -0,0 +1,188 @@
+"""Runs Drive API requests under a process-wide rate limit, with retries and request coalescing.
+
+Every session of the server shares one token bucket, so a burst of saves is smoothed out before it
+reaches Drive instead of coming back as `userRateLimitExceeded`. Rate limit errors, 5xx responses
+and network errors are retried with exponential backoff and full jitter, and identical metadata
+lookups that are already in flight are answered by the running request instead of a new one.
+
+A request that creates something (POST) may have been carried out by Drive although its response
+never arrived, so after a 5xx or network error it is only sent again once a lookup (`recover`)
+has found nothing it created; without a lookup it is not retried. Rate limit errors are refusals,
+so every request is retried after them.
+"""
+import os
+import time
+import random
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Sustained Drive requests per second for the whole process, and the burst allowed on top
+REQUESTS_PER_SECOND = float(os.environ.get('CONSMAN_DRIVE_RPS', 10))
+BURST = int(os.environ.get('CONSMAN_DRIVE_BURST', 20))
+
+# Retries after the first attempt; delays grow as BASE_DELAY * 2 ** attempt, capped at MAX_DELAY
+NUM_RETRIES = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 32
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_REASONS = {'userRateLimitExceeded', 'rateLimitExceeded', 'backendError'}
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, sleeping until one is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+RATE_LIMITER = TokenBucket(REQUESTS_PER_SECOND, BURST)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Retries
+# ----------------------------------------------------------------------------------------------------
+
+def is_retryable(error):
+    """Whether a failed Drive call may succeed if it is simply tried again later."""
+    if isinstance(error, HttpError):
+        if error.resp.status in RETRYABLE_STATUSES:
+            return True
+        # Quota errors come back as 403, like permission errors, which must not be retried
+        if error.resp.status == 403:
+            details = getattr(error, 'error_details', None)
+            details = details if isinstance(details, list) else []
+            return any(isinstance(detail, dict) and detail.get('reason') in RETRYABLE_REASONS for detail in details)
+        return False
+    return isinstance(error, (httplib2.HttpLib2Error, OSError))
+
+
+def is_rejected(error):
+    """Whether Drive refused the request without carrying it out (rate limits), as opposed to a failure
+    that may have happened after it was carried out (5xx, timeouts, dropped connections)."""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    details = getattr(error, 'error_details', None)
+    details = details if isinstance(details, list) else []
+    return error.resp.status == 403 and any(isinstance(detail, dict) and detail.get('reason') in RETRYABLE_REASONS
+                                            for detail in details)
+
+
+def is_idempotent(request):
+    """Whether sending the request twice has the effect of sending it once: everything but creates (POST)."""
+    return getattr(request, 'method', 'GET').upper() != 'POST'
+
+
+def backoff_delay(attempt):
+    """Full jitter: a random delay between 0 and the exponential bound of the attempt."""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+def call(func, num_retries=None, sleep=time.sleep, idempotent=True, recover=None):
+    """Calls func() under the rate limit, retrying retryable errors up to num_retries (default NUM_RETRIES) times.
+
+    Args:
+        idempotent: False if func() must not run twice, e.g. it creates a file.
+        recover: Optional; for a func() that is not idempotent, looks up what it would have created
+            and returns it, or None if there is nothing. Runs before every retry after a failure that
+            may have happened once the request was carried out; its result is returned if it found one.
+    """
+    num_retries = NUM_RETRIES if num_retries is None else num_retries
+    for attempt in range(num_retries + 1):
+        RATE_LIMITER.acquire()
+        try:
+            return func()
+        except Exception as e:
+            if attempt == num_retries or not is_retryable(e):
+                raise
+            uncertain = not idempotent and not is_rejected(e)
+            if uncertain and recover is None:
+                raise
+        sleep(backoff_delay(attempt))
+        if uncertain:
+            found = recover()
+            if found is not None:
+                return found
+
+
+def execute(request, num_retries=None, recover=None):
+    """Executes a googleapiclient request under the rate limit, with retries.
+
+    Args:
+        recover: Optional; see call(). A create (POST) without it is only retried after rate limit errors.
+    """
+    return call(request.execute, num_retries, idempotent=is_idempotent(request), recover=recover)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Coalescing
+# ----------------------------------------------------------------------------------------------------
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_in_flight = {}
+_in_flight_guard = threading.Lock()
+
+
+def coalesce(key, func):
+    """Runs func() once for all callers asking for the same key at the same time.
+
+    Only meant for read-only lookups: the callers that arrive while the request is running share its
+    result (or its exception); later callers start a new request.
+    """
+    with _in_flight_guard:
+        flight = _in_flight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _in_flight[key] = _InFlight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = func()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _in_flight_guard:
+            del _in_flight[key]
+        flight.done.set()
+
+
+def lookup(request, num_retries=None):
+    """Executes a read-only request, sharing the response with identical requests in flight.
+
+    Requests are identified by their URI (method, path and query), which is the same for every
+    session since they all use the app's service account.
+    """
+    return coalesce(request.uri, lambda: execute(request, num_retries))
@@ -0,0 +1,160 @@
+"""In-memory stand-in for the Google Drive v3 service, for exercising sync without a network.
+
+It implements the calls made by connection_utils (files list/get/create/copy/update/get_media/delete
+and permissions create/list) and can be switched offline or slowed down to simulate a site office with bad
+connectivity:
+
+    drive = FakeDrive()
+    drive.online = False       # every call now raises HttpError 503
+    drive.latency = 2.0        # every call now takes two seconds
+"""
+import re
+import time
+import itertools
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+
+class FakeDrive:
+    def __init__(self, online=True, latency=0.0):
+        self.online = online
+        self.latency = latency
+        self.files_by_id = {}
+        self.calls = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def files(self):
+        return _Files(self)
+
+    def permissions(self):
+        return _Permissions(self)
+
+    def file_named(self, name):
+        """Content of the first file with the given name, or None."""
+        for file in self.files_by_id.values():
+            if file['name'] == name:
+                return file['content']
+        return None
+
+    def _call(self, name, func, key='', method='GET'):
+        return _Request(self, name, func, key, method)
+
+    def _run(self, name, func):
+        with self._lock:
+            self.calls.append(name)
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.online:
+            raise HttpError(httplib2.Response({'status': 503}), b'Drive is offline', uri=f'fake://{name}')
+        with self._lock:
+            return func()
+
+    def _file(self, file_id):
+        if file_id not in self.files_by_id:
+            raise HttpError(httplib2.Response({'status': 404}), b'File not found', uri=f'fake://files/{file_id}')
+        return self.files_by_id[file_id]
+
+
+class _Request:
+    def __init__(self, drive, name, func, key='', method='GET'):
+        self.drive = drive
+        self.name = name
+        self.func = func
+        self.method = method
+        self.uri = f'fake://{id(drive)}/{name}?{key}'
+
+    def execute(self, **kwargs):
+        return self.drive._run(self.name, self.func)
+
+
+def _media_content(media_body):
+    return media_body.getbytes(0, media_body.size()) if media_body is not None else b''
+
+
+class _Files:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q=None, fields=None, pageSize=None, **kwargs):
+        def run():
+            match = re.search(r"name\s*=\s*'([^']*)'", q or '')
+            files = [{'id': file['id'], 'name': file['name']} for file in self.drive.files_by_id.values()
+                     if match is None or file['name'] == match.group(1)]
+            return {'files': files[:pageSize] if pageSize else files}
+        return self.drive._call('files.list', run, f'q={q}&pageSize={pageSize}')
+
+    def get(self, fileId, fields=None, **kwargs):
+        def run():
+            file = self.drive._file(fileId)
+            return {'id': file['id'], 'name': file['name'], 'modifiedTime': file['modifiedTime']}
+        return self.drive._call('files.get', run, f'fileId={fileId}')
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        content = _media_content(media_body)
+
+        def run():
+            file_id = f'fake-{next(self.drive._ids)}'
+            self.drive.files_by_id[file_id] = {'id': file_id, 'name': body['name'], 'content': content,
+                                               'modifiedTime': _now()}
+            return {'id': file_id}
+        return self.drive._call('files.create', run, method='POST')
+
+    def copy(self, fileId, body=None, fields=None, **kwargs):
+        def run():
+            file_id = f'fake-{next(self.drive._ids)}'
+            self.drive.files_by_id[file_id] = {'id': file_id, 'name': body['name'],
+                                               'content': self.drive._file(fileId)['content'], 'modifiedTime': _now()}
+            return {'id': file_id}
+        return self.drive._call('files.copy', run, method='POST')
+
+    def update(self, fileId, body=None, media_body=None, **kwargs):
+        content = _media_content(media_body)
+
+        def run():
+            file = self.drive._file(fileId)
+            file.update(content=content, modifiedTime=_now())
+            if body and 'name' in body:
+                file['name'] = body['name']
+            return {'id': fileId}
+        return self.drive._call('files.update', run, method='PATCH')
+
+    def delete(self, fileId, **kwargs):
+        return self.drive._call('files.delete', lambda: self.drive.files_by_id.pop(fileId) and None, method='DELETE')
+
+    def get_media(self, fileId, **kwargs):
+        # MediaIoBaseDownload drives the request through request.http, so hand it a fake transport
+        return HttpRequest(_MediaHttp(self.drive, fileId), None, f'fake://files/{fileId}?alt=media')
+
+
+class _Permissions:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def create(self, fileId, body=None, **kwargs):
+        def run():
+            self.drive._file(fileId).setdefault('permissions', []).append(body)
+            return {'id': f'permission-{fileId}'}
+        return self.drive._call('permissions.create', run, method='POST')
+
+    def list(self, fileId, fields=None, **kwargs):
+        def run():
+            return {'permissions': [{'id': f'permission-{fileId}', 'emailAddress': permission.get('emailAddress')}
+                                    for permission in self.drive._file(fileId).get('permissions', [])]}
+        return self.drive._call('permissions.list', run, f'fileId={fileId}')
+
+
+class _MediaHttp:
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        content = self.drive._run('files.get_media', lambda: self.drive._file(self.file_id)['content'])
+        return httplib2.Response({'status': 200, 'content-length': str(len(content))}), content
+
+
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
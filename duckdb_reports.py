@@ -0,0 +1,243 @@
+"""The pivot and expenditure reports computed by DuckDB.
+
+The live purchases of a database are mirrored into an in-memory DuckDB table and the reports run
+there as vectorized group-bys; the SQLite file stays the only thing that is written to. Like the
+columnar cache, the mirror is loaded once through a read-only connection and then kept current
+from audit_log, and a database file replaced wholesale is reloaded.
+
+DuckDB is optional (see analytics.py); import this module only when it is installed.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+import duckdb
+import pandas as pd
+import services
+import shards
+import tenants
+from services import Table, reading
+from queries import statement
+from columnar import percentages
+
+FETCH_BATCH = 10000
+
+# The columns of columnar.load_all, so both caches hold the same normalized values
+MIRROR_COLUMNS = ('purchase_id', 'project_id', 'stage', 'category', 'vendor', 'mode_of_payment', 'date',
+                  'purchase_amount', 'paid_amount')
+
+CREATE_MIRROR = '''CREATE TABLE purchases (purchase_id BIGINT, project_id BIGINT, stage VARCHAR, category VARCHAR,
+                                           vendor VARCHAR, mode_of_payment VARCHAR, date VARCHAR,
+                                           purchase_amount DOUBLE, paid_amount DOUBLE)'''
+INSERT_BATCH = 'INSERT INTO purchases SELECT * FROM batch'
+DELETE_IDS = 'DELETE FROM purchases WHERE purchase_id IN (SELECT UNNEST(?))'
+
+# Dimensions are only ever one of these names, never user input
+PIVOT = 'SELECT {rows}, {columns}, COALESCE(SUM(purchase_amount), 0) FROM purchases GROUP BY {rows}, {columns}'
+PROJECT_PIVOT = '''SELECT {rows}, {columns}, COALESCE(SUM(purchase_amount), 0) FROM purchases
+                   WHERE project_id = ? GROUP BY {rows}, {columns}'''
+EXPENDITURE = '''SELECT {dimension}, SUM(purchase_amount), SUM(paid_amount) FROM purchases
+                 WHERE project_id = ? GROUP BY {dimension}'''
+
+
+class PurchaseMirror:
+    """In-memory DuckDB copy of the live purchases of a database."""
+
+    def __init__(self, database_name):
+        self.database_name = database_name
+        self.generation = services.database_generation(database_name)
+        self.conn = duckdb.connect()
+        self.conn.execute(CREATE_MIRROR)
+        self._load()
+
+    def _insert(self, rows):
+        batch = pd.DataFrame.from_records(rows, columns=MIRROR_COLUMNS)
+        self.conn.register('batch', batch)
+        try:
+            self.conn.execute(INSERT_BATCH)
+        finally:
+            self.conn.unregister('batch')
+
+    def _load(self):
+        with reading(self.database_name) as conn:
+            # One read transaction, so the rows and the audit position match
+            conn.execute('BEGIN')
+            self.audit_id = conn.execute(statement('audit.latest_id')).fetchone()[0]
+            cursor = conn.execute(statement('columnar.load_all'))
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH)
+                if not rows:
+                    break
+                self._insert(rows)
+
+    def refresh(self):
+        """Applies the purchases changes recorded in audit_log since the last refresh."""
+        while True:
+            entries = services.audit_entries(self.database_name, self.audit_id, FETCH_BATCH)
+            changed = {}  # purchase id -> its live values, or None once it is gone
+            for entry in entries:
+                if entry.table_name == 'purchases':
+                    changed[entry.row_id] = self._values(entry)
+                self.audit_id = entry.audit_id
+            if changed:
+                self.conn.execute(DELETE_IDS, [list(changed)])
+                rows = [values for values in changed.values() if values is not None]
+                if rows:
+                    self._insert(rows)
+            if len(entries) < FETCH_BATCH:
+                return
+
+    @staticmethod
+    def _values(entry):
+        if entry.action == 'purge':
+            return None
+        payload = json.loads(entry.payload)
+        if payload['deleted_at'] is not None:
+            return None
+        return (payload['purchase_id'], payload['project_id'], payload['stage'], payload['category'],
+                str(payload['vendor']).strip().lower(), str(payload['mode_of_payment']).strip().lower(),
+                payload['date'], payload['purchase_amount'], payload['paid_amount'])
+
+    def query(self, sql, params=()):
+        # A cursor per query, so reports fetched concurrently do not share one connection
+        with self.conn.cursor() as cursor:
+            return cursor.execute(sql, params).fetchall()
+
+
+# ----------------------------------------------------------------------------------------------------
+# Cache
+# ----------------------------------------------------------------------------------------------------
+
+MAX_MIRRORS = int(os.environ.get('CONSMAN_DUCKDB_CACHE_SIZE', 16))
+
+_cache = OrderedDict()  # database path -> (lock, mirror), least recently used first
+_cache_guard = threading.Lock()
+
+
+def purchase_mirror(database_name):
+    """Cached mirror of the database, brought up to date with the latest changes.
+
+    At most MAX_MIRRORS mirrors are kept; the least recently used one is dropped first (a report
+    still running on it finishes, its memory is freed afterwards).
+    """
+    key = os.path.abspath(database_name)
+    with _cache_guard:
+        lock, mirror = _cache.setdefault(key, (threading.Lock(), None))
+    with lock:
+        if mirror is None or mirror.generation != services.database_generation(database_name):
+            mirror = PurchaseMirror(database_name)
+        else:
+            mirror.refresh()
+        with _cache_guard:
+            _cache[key] = (lock, mirror)
+            _cache.move_to_end(key)
+            while len(_cache) > MAX_MIRRORS:
+                _cache.popitem(last=False)
+        return mirror
+
+
+def clear_cache():
+    with _cache_guard:
+        _cache.clear()
+
+
+def evict(database_name):
+    """Eviction hook: drops the mirrors of an idle tenant's database and of its shards."""
+    paths = {os.path.abspath(path) for path in [database_name, *shards.local_shards(database_name)]}
+    with _cache_guard:
+        for key in paths:
+            _cache.pop(key, None)
+
+
+tenants.register_eviction_hook(evict)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reports
+# ----------------------------------------------------------------------------------------------------
+
+def pivot(database_name, rows, columns, project_id=None):
+    """Purchase amounts per (row value, column value) as {row value: {column value: amount}}."""
+    if project_id is None:
+        sql, params = PIVOT.format(rows=rows, columns=columns), ()
+    else:
+        sql, params = PROJECT_PIVOT.format(rows=rows, columns=columns), (project_id,)
+    sums = {}
+    for row, column, amount in purchase_mirror(database_name).query(sql, params):
+        sums.setdefault(row, {})[column] = amount
+    return sums
+
+
+def expenses_pivot_table(database_name):
+    """Same table as services.expenses_pivot_table, computed by DuckDB."""
+    categories = services.query_column(database_name, statement('reference.categories'))
+    if not categories:
+        raise ValueError("No categories found.")
+    sums = pivot(database_name, 'stage', 'category')
+
+    rows = []
+    # In the order GROUP BY stage lists them in SQLite
+    for stage in sorted(sums):
+        amounts = [sums[stage].get(category, 0) for category in categories]
+        rows.append((stage, *amounts, sum(sums[stage].values())))
+
+    totals = [sum(amounts.get(category, 0) for amounts in sums.values()) for category in categories]
+    grand_total = sum(sum(amounts.values()) for amounts in sums.values())
+    rows.append(('Total', *totals, grand_total))
+    rows.append(('Percentage', *percentages(totals, grand_total), 100 if grand_total > 0 else 0))
+    return Table(['Stage'] + categories + ['Purchase Amount'], rows)
+
+
+def purchase_amounts_table(database_name, project_id=None):
+    """Same table as services.purchase_amounts_table, computed by DuckDB."""
+    categories_list = services.query_column(database_name, statement('reference.categories'))
+    stages_list = services.query_column(database_name, statement('reference.stages'))
+    if not categories_list or not stages_list:
+        raise ValueError("No categories or stages found.")
+    sums = pivot(database_name, 'category', 'stage', project_id)
+
+    rows = []
+    for category in categories_list:
+        if category in sums:
+            amounts = [sums[category].get(stage, 0) for stage in stages_list]
+            rows.append([category] + amounts + [sum(sums[category].values())])
+        else:
+            rows.append([category] + [0] * (len(stages_list) + 1))
+
+    grand_total_row = ['Grand Total'] + [sum(row[i] for row in rows) for i in range(1, len(stages_list) + 2)]
+    rows.append(grand_total_row)
+    grand_total = grand_total_row[-1]
+    for row in rows:
+        row.append(round(row[-1] / grand_total * 100, 2) if grand_total > 0 else 0)
+    rows.append(['Percentage'] + [
+        round(grand_total_row[i] / grand_total * 100, 2) if grand_total > 0 else 0
+        for i in range(1, len(stages_list) + 1)
+    ] + [100, None])
+    return Table(['Category'] + stages_list + ['Total', 'Percentage'], [tuple(row) for row in rows])
+
+
+def expenditure_table(database_name, project_id, dimension, labels, label_column):
+    # Listed like the SQL reports list them: one row per reference value, in GROUP BY order
+    groups = {row[0]: row[1:] for row in purchase_mirror(database_name).query(
+        EXPENDITURE.format(dimension=dimension), (int(project_id),))}
+    rows = []
+    for label in sorted(set(labels)):
+        purchase_sum, paid_sum = groups.get(label, (None, None))
+        if purchase_sum is None and paid_sum is None:
+            rows.append((label, 'Not Yet Started', 'Not Yet Started', 'Not Yet Started'))
+            continue
+        rows.append((label, 'Not Yet Started' if purchase_sum is None else purchase_sum,
+                     'Not Yet Started' if paid_sum is None else paid_sum, (purchase_sum or 0) - (paid_sum or 0)))
+    return Table([label_column, 'Purchase Amount', 'Paid Amount', 'Difference'], rows)
+
+
+def expenditure_by_category(database_name, project_id):
+    """Same table as services.expenditure_by_category, computed by DuckDB."""
+    categories = services.query_column(database_name, statement('reference.categories'))
+    return expenditure_table(database_name, project_id, 'category', categories, 'Category')
+
+
+def expenditure_by_stage(database_name, project_id):
+    """Same table as services.expenditure_by_stage, computed by DuckDB."""
+    stages = services.query_column(database_name, statement('reference.stages'))
+    return expenditure_table(database_name, project_id, 'stage', stages, 'Stage')
@@ -0,0 +1,115 @@
+"""Purchases that look like an invoice line entered twice.
+
+A purchase is a likely duplicate of another purchase of the same project when:
+
+- their vendors are equal, trimmed and in lower case;
+- their purchase amounts are equal;
+- their dates are at most DATE_WINDOW_DAYS apart;
+- their item names are similar, with a difflib ratio of at least SIMILARITY_THRESHOLD.
+
+The first three are the blocking key and are looked up in the purchases_duplicate_key index
+(migration 7). A check therefore reads only the few purchases with that vendor and amount around
+that date, however many purchases the project has, and compares only their item names.
+
+Data entry checks the submitted purchases before writing them, and asks before saving a likely
+duplicate. scan_duplicates() lists the likely duplicates among the purchases already saved.
+"""
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from services import Table, reading, purchase_values
+from queries import statement
+
+DATE_WINDOW_DAYS = 7
+SIMILARITY_THRESHOLD = 0.8
+
+
+@dataclass
+class DuplicateCandidate:
+    purchase_id: int
+    item_name: str
+    item_qty: float
+    unit: str
+    vendor: str
+    date: str
+    purchase_amount: float
+    similarity: float
+
+
+def normalize_name(name):
+    """Lower case words only, so that 'Cement  (OPC)' and 'cement opc' are the same item."""
+    return ' '.join(re.findall(r'\w+', str(name or '').lower()))
+
+
+def name_similarity(first, second):
+    first, second = normalize_name(first), normalize_name(second)
+    if first == second:
+        return 1.0
+    return SequenceMatcher(None, first, second).ratio()
+
+
+def date_window(window_days):
+    return f'-{window_days} days', f'+{window_days} days'
+
+
+# ----------------------------------------------------------------------------------------------------
+# Checking new purchases
+# ----------------------------------------------------------------------------------------------------
+
+def candidates(conn, purchase, window_days=DATE_WINDOW_DAYS):
+    """Likely duplicates of a purchase among the saved ones, most similar first, read on an open connection."""
+    day = purchase_values(purchase)[7]
+    before, after = date_window(window_days)
+    rows = conn.execute(statement('duplicates.candidates'),
+                        (purchase.project_id, purchase.vendor, purchase.purchase_amount, day, before, day,
+                         after)).fetchall()
+    found = [DuplicateCandidate(*row, name_similarity(purchase.item_name, row[1])) for row in rows]
+    return sorted((candidate for candidate in found if candidate.similarity >= SIMILARITY_THRESHOLD),
+                  key=lambda candidate: -candidate.similarity)
+
+
+def find_duplicates(database_name, purchases, window_days=DATE_WINDOW_DAYS):
+    """Likely duplicates of the purchases about to be saved (e.g. the line items of an invoice).
+
+    Returns:
+        dict: {position in the batch: [DuplicateCandidate]} for the purchases that have any.
+    """
+    with reading(database_name) as conn:
+        found = {index: candidates(conn, purchase, window_days) for index, purchase in enumerate(purchases)}
+    return {index: matches for index, matches in found.items() if matches}
+
+
+def candidates_table(found):
+    """The likely duplicates found for a batch, one row per saved purchase, for display."""
+    return Table(['Row', 'Purchase ID', 'Item Name', 'Item Qty', 'Unit', 'Vendor', 'Date', 'Purchase Amount',
+                  'Similarity'],
+                 [(index + 1, candidate.purchase_id, candidate.item_name, candidate.item_qty, candidate.unit,
+                   candidate.vendor, candidate.date, candidate.purchase_amount, f'{candidate.similarity:.0%}')
+                  for index, matches in sorted(found.items()) for candidate in matches])
+
+
+# ----------------------------------------------------------------------------------------------------
+# Scanning saved purchases
+# ----------------------------------------------------------------------------------------------------
+
+def scan_duplicates(database_name, project_id, window_days=DATE_WINDOW_DAYS):
+    """Pairs of saved purchases of the project that look like the same line entered twice.
+
+    Every purchase is joined through the index to the ones sharing its blocking key, so the scan
+    grows with the number of purchases, not with its square.
+
+    Returns:
+        Table: One row per later purchase and the earlier one it duplicates, most similar first.
+    """
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('duplicates.pairs'), (*date_window(window_days), project_id)).fetchall()
+    pairs = []
+    for purchase_id, earlier_id, item_name, earlier_item_name, vendor, date, earlier_date, amount in rows:
+        similarity = name_similarity(item_name, earlier_item_name)
+        if similarity >= SIMILARITY_THRESHOLD:
+            pairs.append((purchase_id, earlier_id, item_name, earlier_item_name, vendor, date, earlier_date,
+                          amount, similarity))
+    pairs.sort(key=lambda pair: -pair[-1])
+    return Table(['Purchase ID', 'Duplicate Of', 'Item Name', 'Earlier Item Name', 'Vendor', 'Date',
+                  'Earlier Date', 'Purchase Amount', 'Similarity'],
+                 [pair[:-1] + (f'{pair[-1]:.0%}',) for pair in pairs])
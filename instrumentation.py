@@ -0,0 +1,261 @@
+import os
+import json
+import sqlite3
+import threading
+from time import perf_counter, time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket catches everything slower
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+# Keep memory bounded no matter how long the server runs
+MAX_METRICS = 500
+RECENT_SAMPLES = 1000
+MAX_TRACE_EVENTS = 5000
+
+# Optional structured log: one JSON object per recorded call
+METRICS_LOG_PATH = os.environ.get('CONSMAN_METRICS_LOG')
+
+_lock = threading.Lock()
+_metrics = {}
+_trace_events = deque(maxlen=MAX_TRACE_EVENTS)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Recording
+# ----------------------------------------------------------------------------------------------------
+
+def _new_metric(kind, name):
+    return {
+        'kind': kind,
+        'name': name,
+        'count': 0,
+        'errors': 0,
+        'total_ms': 0.0,
+        'max_ms': 0.0,
+        'rows': 0,
+        'bytes': 0,
+        'histogram': [0] * len(HISTOGRAM_BOUNDS_MS),
+        'recent_ms': deque(maxlen=RECENT_SAMPLES),
+    }
+
+
+def record(kind, name, seconds, rows=None, nbytes=None, error=None, started_at=None):
+    """Adds one timed call to the process-wide metrics.
+
+    Args:
+        kind: Layer the call belongs to ('sqlite', 'drive', 'oauth', 'report', ...).
+        name: Operation name within the layer.
+        seconds: Wall time of the call.
+        rows: Optional; rows returned or changed.
+        nbytes: Optional; bytes transferred.
+        error: Optional; error message if the call failed.
+        started_at: Optional; epoch seconds the call started, used for the trace export.
+    """
+    elapsed_ms = seconds * 1000
+    started_at = started_at if started_at is not None else time() - seconds
+    with _lock:
+        key = (kind, name)
+        if key not in _metrics and len(_metrics) >= MAX_METRICS:
+            key = (kind, 'other')
+        metric = _metrics.get(key)
+        if metric is None:
+            metric = _metrics[key] = _new_metric(*key)
+        metric['count'] += 1
+        metric['total_ms'] += elapsed_ms
+        metric['max_ms'] = max(metric['max_ms'], elapsed_ms)
+        metric['rows'] += rows or 0
+        metric['bytes'] += nbytes or 0
+        metric['errors'] += 1 if error else 0
+        metric['recent_ms'].append(elapsed_ms)
+        for i, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if elapsed_ms <= bound:
+                metric['histogram'][i] += 1
+                break
+        _trace_events.append({
+            'name': name, 'cat': kind, 'ph': 'X',
+            'ts': int(started_at * 1e6), 'dur': int(elapsed_ms * 1000),
+            'pid': os.getpid(), 'tid': threading.get_ident(),
+            'args': {'rows': rows, 'bytes': nbytes, 'error': error},
+        })
+
+    if METRICS_LOG_PATH:
+        entry = {'ts': started_at, 'kind': kind, 'name': name, 'ms': round(elapsed_ms, 3),
+                 'rows': rows, 'bytes': nbytes, 'error': error}
+        try:
+            with open(METRICS_LOG_PATH, 'a') as fh:
+                fh.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            print(f'Error log: {e}')
+
+
+@contextmanager
+def timed(kind, name):
+    """Times the enclosed block. Set span['rows'] / span['bytes'] inside the block to record them."""
+    span = {'rows': None, 'bytes': None}
+    started_at, start = time(), perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        record(kind, name, perf_counter() - start, span['rows'], span['bytes'], repr(e), started_at)
+        raise
+    record(kind, name, perf_counter() - start, span['rows'], span['bytes'], None, started_at)
+
+
+def instrument(kind, name=None):
+    """Decorator form of timed(); the metric name defaults to the function name."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(kind, name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ----------------------------------------------------------------------------------------------------
+# SQLite connection and cursor wrappers
+# ----------------------------------------------------------------------------------------------------
+
+def statement_label(sql):
+    """Short, whitespace-normalised label used as the metric name of an SQL statement."""
+    label = ' '.join(str(sql).split())
+    return label if len(label) <= 80 else label[:77] + '...'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that records the latency and row count of every statement.
+
+    SQLite produces result rows lazily, so a SELECT is only recorded once its rows have been
+    fetched (or the cursor moves on), and the time spent fetching is counted with the statement.
+    """
+
+    def _flush(self):
+        pending = getattr(self, '_pending', None)
+        if pending:
+            self._pending = None
+            record('sqlite', pending['label'], pending['seconds'], pending['rows'], started_at=pending['started_at'])
+
+    def _run(self, method, sql, *args):
+        self._flush()
+        started_at, start = time(), perf_counter()
+        try:
+            result = method(self, sql, *args)
+        except sqlite3.Error as e:
+            record('sqlite', statement_label(sql), perf_counter() - start, error=repr(e), started_at=started_at)
+            raise
+        elapsed = perf_counter() - start
+        if self.description is None:
+            record('sqlite', statement_label(sql), elapsed, max(self.rowcount, 0), started_at=started_at)
+        else:
+            self._pending = {'label': statement_label(sql), 'seconds': elapsed, 'rows': 0, 'started_at': started_at}
+        return result
+
+    def _fetched(self, start, rows, done):
+        pending = getattr(self, '_pending', None)
+        if pending:
+            pending['seconds'] += perf_counter() - start
+            pending['rows'] += rows
+            if done:
+                self._flush()
+
+    def execute(self, sql, parameters=()):
+        return self._run(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._run(sqlite3.Cursor.executescript, sql_script)
+
+    def fetchone(self):
+        start = perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def __del__(self):
+        # Covers cursors that were only partially fetched (e.g. a single fetchone) and then dropped
+        self._flush()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors (including the execute() shortcuts) are instrumented."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reading and exporting metrics
+# ----------------------------------------------------------------------------------------------------
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def snapshot():
+    """Returns a list of metric summaries, slowest total time first."""
+    with _lock:
+        metrics = [dict(metric, recent_ms=list(metric['recent_ms']), histogram=list(metric['histogram']))
+                   for metric in _metrics.values()]
+    summaries = []
+    for metric in metrics:
+        summaries.append({
+            'kind': metric['kind'],
+            'name': metric['name'],
+            'count': metric['count'],
+            'errors': metric['errors'],
+            'total_ms': round(metric['total_ms'], 3),
+            'mean_ms': round(metric['total_ms'] / metric['count'], 3) if metric['count'] else 0.0,
+            'p50_ms': round(percentile(metric['recent_ms'], 0.50), 3),
+            'p95_ms': round(percentile(metric['recent_ms'], 0.95), 3),
+            'max_ms': round(metric['max_ms'], 3),
+            'rows': metric['rows'],
+            'bytes': metric['bytes'],
+            'histogram': dict(zip([str(bound) for bound in HISTOGRAM_BOUNDS_MS], metric['histogram'])),
+        })
+    return sorted(summaries, key=lambda s: s['total_ms'], reverse=True)
+
+
+def export_trace():
+    """Recent calls in Chrome trace event format (open with chrome://tracing or Perfetto)."""
+    with _lock:
+        events = list(_trace_events)
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+        _trace_events.clear()
@@ -0,0 +1,414 @@
+"""Load test: many simulated users driving the app at the same time, headlessly.
+
+Every session is a streamlit.testing.v1.AppTest of app.py (switching to the reports page) running in its
+own thread, the way the sessions of one Streamlit server do. Google login is replaced by StubOAuth
+and Drive by drive_stub.FakeDrive, so nothing leaves the machine. Each user starts with a database
+on the fake Drive, which the first run downloads like a real login does.
+
+After logging in, every session replays a random mix of scripted steps (entering a purchase,
+opening the reports, saving to Drive) and the latency of every step is recorded, e.g. fifty site
+engineers entering their purchases at 6pm:
+
+    python load_test.py --sessions 50 --users 50 --iterations 10 --output load.json
+    python load_test.py --sessions 20 --users 2 --mix entry=1 save=1 --drive-latency 0.5
+
+Sessions of the same user share one database, so the summary also counts the acknowledged entries
+missing from it afterwards. The exit status is 1 when any step hit a locked database or an entry
+was lost.
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import sqlite3
+import logging
+import argparse
+import platform
+import statistics
+import threading
+from time import perf_counter, sleep
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest, app_test, local_script_runner
+from streamlit.testing.v1.util import patch_config_options
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.pages_manager import PagesManager
+from streamlit.runtime.secrets import Secrets
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+import auth
+import outbox
+import tenants
+import services
+import benchmark
+import connection_utils
+from drive_stub import FakeDrive
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+# Pages as a session moves between them, relative to app.py
+APP_PAGE = 'app.py'
+REPORTS_PAGE = 'pages/2_📊_Reports.py'
+
+# Enough of st.secrets['gdrive'] for the login screen; no request ever reaches Google
+STUB_SECRETS = {
+    'client_id_key': 'load-test',
+    'client_secret_key': 'load-test',
+    'redirect_uri': 'http://localhost:8501',
+    'scope': 'openid email profile',
+    'scopes': [],
+    'auth_uri': 'https://accounts.example/auth',
+    'token_uri': 'https://accounts.example/token',
+    'userinfo_uri': 'https://accounts.example/userinfo',
+}
+
+DEFAULT_MIX = {'entry': 6, 'report': 2, 'save': 1}
+
+
+# ----------------------------------------------------------------------------------------------------
+# Stubs
+# ----------------------------------------------------------------------------------------------------
+
+class StubOAuth:
+    """Stands in for Google's OAuth endpoints: the authorization code is the email of the user logging in."""
+
+    class Response:
+        status_code = 200
+
+        def __init__(self, email):
+            self.email = email
+
+        def json(self):
+            return {'email': self.email, 'name': self.email.split('@')[0]}
+
+    @staticmethod
+    def fetch_token(code):
+        return {'access_token': code, 'token_type': 'Bearer'}
+
+    @classmethod
+    def fetch_userinfo(cls, token):
+        return cls.Response(token['access_token'])
+
+
+@contextmanager
+def stubbed(drive):
+    """Routes the app's OAuth calls to StubOAuth and its Drive connections to the fake Drive.
+
+    AppTest is written for one test at a time: every run installs a runtime of its own as the
+    process-wide Runtime, turns on the global.appTest option, swaps in its secrets and forgets
+    whether the app has a pages directory, and undoes all of it when done; it also compiles the
+    script again. Sessions running in parallel would undo each other's, so the first runtime set up
+    serves all sessions (like the one Runtime of a server), the option, the secrets and the pages
+    directory flag stay in place for the whole test, and one script cache is shared.
+    """
+    shared = {}
+    script_cache = ScriptCache()
+    secrets = Secrets()
+    secrets._secrets = {'gdrive': STUB_SECRETS}
+
+    def instance(cls):
+        if 'runtime' not in shared and cls._instance is not None:
+            shared['runtime'] = cls._instance
+        if 'runtime' not in shared:
+            raise RuntimeError("Runtime hasn't been created!")
+        return shared['runtime']
+
+    class SessionPagesManager(PagesManager):
+        pass  # AppTest's reset of uses_pages_directory lands here; PagesManager keeps the flag
+
+    patches = [(Runtime, 'instance', classmethod(instance)),
+               (Runtime, 'exists', classmethod(lambda cls: 'runtime' in shared or cls._instance is not None)),
+               (app_test, 'PagesManager', SessionPagesManager),
+               (st, 'secrets', secrets),
+               (app_test, 'ScriptCache', lambda: script_cache),
+               (local_script_runner, 'ScriptCache', lambda: script_cache),
+               (auth, 'fetch_token', StubOAuth.fetch_token),
+               (auth, 'fetch_userinfo', StubOAuth.fetch_userinfo),
+               (connection_utils, 'establish_gdrive_connections', lambda service_account_info=None: drive)]
+    originals = [(owner, name, vars(owner)[name]) for owner, name, _ in patches]
+    for owner, name, replacement in patches:
+        setattr(owner, name, replacement)
+    try:
+        with patch_config_options({'global.appTest': True}):
+            yield
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+def user_email(number):
+    return f'engineer{number:03d}@site.example'
+
+
+def seed_users(drive, users, rows, projects, directory):
+    """Puts a database with `rows` purchases on the fake Drive for every user, and nothing on this device.
+
+    Returns:
+        The number of live purchases in each of the databases.
+    """
+    template = os.path.join(directory, 'template.db')
+    benchmark.generate_database(template, rows, projects)
+    services.checkpoint(template)
+    seeded = stored_purchases(template)
+    for number in range(users):
+        email = user_email(number)
+        database_name = tenants.database_path(email)
+        shutil.copyfile(template, database_name)
+        services.create_remote_database(drive, database_name, email)
+        # The login downloads it, like on a new device
+        shutil.rmtree(tenants.tenant_dir(email))
+    os.remove(template)
+    return seeded
+
+
+def stored_purchases(database_name):
+    with services.reading(database_name) as conn:
+        return conn.execute('SELECT COUNT(*) FROM purchases WHERE deleted_at IS NULL').fetchone()[0]
+
+
+# ----------------------------------------------------------------------------------------------------
+# Sessions
+# ----------------------------------------------------------------------------------------------------
+
+class LockError(Exception):
+    """The step failed because SQLite reported the database locked or busy."""
+
+
+class Session:
+    """One browser tab of one user, driven through AppTest."""
+
+    def __init__(self, email, seed, timeout):
+        self.email = email
+        self.random = random.Random(seed)
+        self.app = AppTest.from_file(APP_SCRIPT, default_timeout=timeout)
+        self.page = APP_PAGE
+
+    def run(self):
+        self.app.run()
+        messages = [element.value for element in self.app.exception] + [element.value for element in self.app.error]
+        if any('locked' in str(message) or 'busy' in str(message) for message in messages):
+            raise LockError(messages[0])
+        if messages:
+            raise RuntimeError(messages[0])
+
+    def open(self, page):
+        if self.page != page:
+            self.app.switch_page(page)
+            self.page = page
+            self.run()
+
+    def open_entry_form(self):
+        """Goes back to the data entry page and picks the project, unless the form is already there."""
+        self.open(APP_PAGE)
+        if any(element.key == 'item_name' for element in self.app.text_input):
+            return
+        project = next(element for element in self.app.selectbox if element.label == 'Select the project:')
+        project.select_index(1)
+        self.run()
+        # A payment mode that asks for the paid amount, so the whole form is filled in
+        self.app.selectbox(key='mode_of_payment').select_index(1)
+        self.run()
+
+    def login(self):
+        """Comes back from the Google login and lands on the data entry form (downloading the database)."""
+        self.app.query_params['code'] = self.email
+        self.run()
+        self.open_entry_form()
+
+    def entry(self):
+        """Enters one purchase through the single item form."""
+        self.open_entry_form()
+        app = self.app
+        item_name, unit, low, high = self.random.choice(benchmark.ITEMS)
+        quantity = self.random.randint(1, 50)
+        amount = min(quantity * self.random.randint(low, high), 1000000)
+        app.text_input(key='item_name').input(item_name)
+        app.selectbox(key='unit').select(unit)
+        app.number_input(key='item_qty').set_value(float(quantity))
+        for key in ('stage', 'category', 'vendor'):
+            selectbox = app.selectbox(key=key)
+            selectbox.select_index(self.random.randrange(len(selectbox.options)))
+        app.number_input(key='purchase_amount').set_value(amount)
+        app.number_input(key='paid_amount').set_value(self.random.choice([0, amount]))
+        app.text_input(key='paid_by').input(self.email.split('@')[0])
+        next(button for button in app.button if button.label == 'Submit').click()
+        self.run()
+
+    def report(self):
+        """Opens the reports page and the expenditure by category of the selected project."""
+        self.open(REPORTS_PAGE)
+        next(button for button in self.app.button if button.label == 'Show Expenditure for each category').click()
+        self.run()
+
+    def save(self):
+        """Presses Save, which hands the changes to the background replayer."""
+        self.open_entry_form()
+        next(button for button in self.app.button if button.label == 'Save').click()
+        self.run()
+
+
+def run_session(session, steps, think, start, results):
+    """Logs in, then runs the steps, recording (step, seconds, error) for every one of them."""
+    start.wait()
+    for step in ['login'] + steps:
+        if think and step != 'login':
+            sleep(session.random.uniform(0, 2 * think))
+        began = perf_counter()
+        error = None
+        try:
+            getattr(session, step)()
+        except LockError as e:
+            error = ('lock', str(e))
+        except Exception as e:
+            error = ('error', f'{type(e).__name__}: {e}')
+        results.append((step, perf_counter() - began, error))
+        if error and step == 'login':
+            return
+
+
+# ----------------------------------------------------------------------------------------------------
+# Results
+# ----------------------------------------------------------------------------------------------------
+
+def percentile(samples, p):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[p - 1]
+
+
+def summarize(results, elapsed):
+    steps = {}
+    for step in sorted({step for step, _, _ in results}):
+        samples = [seconds for name, seconds, error in results if name == step and error is None]
+        errors = [error for name, _, error in results if name == step and error is not None]
+        record = {'count': len(samples), 'errors': len(errors),
+                  'lock_errors': sum(1 for kind, _ in errors if kind == 'lock')}
+        if samples:
+            record.update({'p50_s': percentile(samples, 50), 'p95_s': percentile(samples, 95),
+                           'p99_s': percentile(samples, 99), 'max_s': max(samples)})
+        steps[step] = record
+    completed = sum(1 for _, _, error in results if error is None)
+    return {
+        'elapsed_s': elapsed,
+        'steps': steps,
+        'throughput_steps_per_s': completed / elapsed if elapsed else 0,
+        'purchases_per_s': steps.get('entry', {}).get('count', 0) / elapsed if elapsed else 0,
+        'lock_errors': sum(record['lock_errors'] for record in steps.values()),
+        'errors': sorted({error[1] for _, _, error in results if error})[:20],
+    }
+
+
+def drain(emails, drive):
+    """Stops the replayers and ships what they left behind; returns the changes still not on Drive."""
+    pending = 0
+    for email in emails:
+        database_name = tenants.database_path(email)
+        outbox.stop_replayer(database_name)
+        if services.has_schema(database_name):
+            pending += outbox.replay(drive, database_name, email, force=True).pending
+    return pending
+
+
+def run_load_test(sessions, users, iterations, mix, think=0.0, rows=2000, projects=3, drive_latency=0.0,
+                  directory='load_data', seed=42, timeout=120):
+    """Runs the sessions in parallel and returns the summary of their step latencies."""
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    tenants.TENANT_ROOT = directory
+    drive = FakeDrive()
+    seeded = seed_users(drive, users, rows, projects, directory)
+    drive.latency = drive_latency
+
+    rng = random.Random(seed)
+    names, weights = zip(*mix.items())
+    plans = [(user_email(number % users), [rng.choices(names, weights)[0] for _ in range(iterations)])
+             for number in range(sessions)]
+
+    results = []
+    start = threading.Event()
+    with stubbed(drive):
+        session_objects = [Session(email, seed + number, timeout) for number, (email, _) in enumerate(plans)]
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            futures = [pool.submit(run_session, session, steps, think, start, results)
+                       for session, (_, steps) in zip(session_objects, plans)]
+            began = perf_counter()
+            start.set()
+            for future in futures:
+                future.result()
+            elapsed = perf_counter() - began
+        emails = {email for email, _ in plans}
+        pending = drain(emails, drive)
+
+    summary = summarize(results, elapsed)
+    summary['pending_after_drain'] = pending
+    # Every acknowledged entry must be in its user's database once the sessions are done
+    added = sum(stored_purchases(tenants.database_path(email)) - seeded for email in emails)
+    summary['lost_purchases'] = summary['steps'].get('entry', {}).get('count', 0) - added
+    summary['drive_calls'] = len(drive.calls)
+    return summary
+
+
+# ----------------------------------------------------------------------------------------------------
+# Command line
+# ----------------------------------------------------------------------------------------------------
+
+def parse_mix(pairs):
+    mix = {}
+    for pair in pairs:
+        step, _, weight = pair.partition('=')
+        if step not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown step {step!r}; expected one of {', '.join(DEFAULT_MIX)}.")
+        mix[step] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20, help='Simulated browser sessions running at once')
+    parser.add_argument('--users', type=int, default=20, help='Distinct users; sessions beyond it share a database')
+    parser.add_argument('--iterations', type=int, default=5, help='Steps per session after logging in')
+    parser.add_argument('--mix', nargs='+', default=[f'{step}={weight}' for step, weight in DEFAULT_MIX.items()],
+                        help='Relative weights of the steps, e.g. entry=6 report=2 save=1')
+    parser.add_argument('--think', type=float, default=0.0, help='Mean pause between steps, in seconds')
+    parser.add_argument('--rows', type=int, default=2000, help='Purchases in every user\'s database')
+    parser.add_argument('--projects', type=int, default=3)
+    parser.add_argument('--drive-latency', type=float, default=0.0, help='Seconds every fake Drive call takes')
+    parser.add_argument('--directory', default='load_data', help='Tenant root of the test (wiped first)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds before a script run is abandoned')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    # Outside `streamlit run` every session logs bare-mode warnings
+    logging.disable(logging.WARNING)
+    summary = run_load_test(args.sessions, args.users, args.iterations, parse_mix(args.mix), args.think,
+                            args.rows, args.projects, args.drive_latency, args.directory, args.seed, args.timeout)
+
+    for step, record in summary['steps'].items():
+        latencies = (f"p50 {record['p50_s'] * 1000:8.1f} ms  p95 {record['p95_s'] * 1000:8.1f} ms  "
+                     f"p99 {record['p99_s'] * 1000:8.1f} ms" if record['count'] else 'no successful runs')
+        print(f"{step:<8} {record['count']:>6} ok {record['errors']:>4} failed  {latencies}", file=sys.stderr)
+    print(f"{summary['throughput_steps_per_s']:.1f} steps/s, {summary['purchases_per_s']:.1f} purchases/s, "
+          f"{summary['lock_errors']} lock errors, {summary['pending_after_drain']} changes not synced, "
+          f"{summary['lost_purchases']} purchases lost",
+          file=sys.stderr)
+
+    report = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        **summary,
+    }
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return 1 if summary['lock_errors'] or summary['lost_purchases'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
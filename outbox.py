@@ -0,0 +1,294 @@
+"""Local-first sync: data entry writes the local database at disk speed and Drive catches up later.
+
+The committed-but-unsynced changes are the audit_log entries (see services.MIGRATIONS) newer than
+the last audit id that reached Drive. That high-water mark, the retry attempts and the last error
+are kept in a small sidecar SQLite file next to the database (`<db_name>.outbox`), which is never
+uploaded itself. The replay engine uploads a consistent snapshot of the database whenever there are
+pending changes, backing off exponentially while Drive is unreachable.
+"""
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+import services
+import tenants
+import attachments
+from services import SyncError
+
+# Retry delays: BASE_DELAY, 2 * BASE_DELAY, 4 * BASE_DELAY, ... capped at MAX_DELAY seconds
+BASE_DELAY = 5
+MAX_DELAY = 300
+
+# Seconds between two checks of the background replayer
+REPLAY_INTERVAL = 15
+
+
+@dataclass
+class OutboxState:
+    pending: int
+    synced_audit_id: int = 0
+    attempts: int = 0
+    next_attempt_at: float = 0
+    last_error: str = None
+    last_synced_at: float = None
+    syncing: bool = False
+
+
+# ----------------------------------------------------------------------------------------------------
+# Sidecar state
+# ----------------------------------------------------------------------------------------------------
+
+def outbox_path(database_name):
+    return f'{database_name}.outbox'
+
+
+def connect_outbox(database_name):
+    conn = sqlite3.connect(outbox_path(database_name))
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS "sync_state" (
+            "id"	INTEGER PRIMARY KEY CHECK ("id" = 1),
+            "synced_audit_id"	INTEGER NOT NULL DEFAULT 0,
+            "attempts"	INTEGER NOT NULL DEFAULT 0,
+            "next_attempt_at"	REAL NOT NULL DEFAULT 0,
+            "last_error"	TEXT,
+            "last_synced_at"	REAL
+        );
+    ''')
+    conn.execute('INSERT OR IGNORE INTO sync_state (id) VALUES (1)')
+    conn.commit()
+    return conn
+
+
+def read_state(database_name):
+    """Pending change count and retry state of the database."""
+    with closing(connect_outbox(database_name)) as conn:
+        synced_audit_id, attempts, next_attempt_at, last_error, last_synced_at = conn.execute(
+            'SELECT synced_audit_id, attempts, next_attempt_at, last_error, last_synced_at FROM sync_state'
+        ).fetchone()
+    pending = services.count_audit_entries(database_name, synced_audit_id) if os.path.exists(database_name) else 0
+    return OutboxState(pending, synced_audit_id, attempts, next_attempt_at, last_error, last_synced_at,
+                       syncing=lock_for(database_name).locked())
+
+
+def mark_synced(database_name, audit_id, now=None):
+    """Records that every change up to audit_id is on Drive."""
+    with closing(connect_outbox(database_name)) as conn, conn:
+        conn.execute('''UPDATE sync_state
+                        SET synced_audit_id = MAX(synced_audit_id, ?), attempts = 0, next_attempt_at = 0,
+                            last_error = NULL, last_synced_at = ?''',
+                     (audit_id, now if now is not None else time.time()))
+
+
+def mark_failed(database_name, error, now=None):
+    """Records a failed upload and schedules the next attempt with exponential backoff."""
+    now = now if now is not None else time.time()
+    with closing(connect_outbox(database_name)) as conn, conn:
+        attempts = conn.execute('SELECT attempts FROM sync_state').fetchone()[0] + 1
+        conn.execute('UPDATE sync_state SET attempts = ?, next_attempt_at = ?, last_error = ?',
+                     (attempts, now + backoff_delay(attempts), str(error)))
+
+
+def mark_in_sync(database_name):
+    """The local file and its Drive copy are identical (just downloaded or created), so nothing is pending."""
+    mark_synced(database_name, services.latest_audit_id(database_name))
+    # The live file is the synced state now; an older snapshot would only mislead its readers
+    try:
+        os.remove(synced_snapshot_path(database_name))
+    except FileNotFoundError:
+        pass
+
+
+def backoff_delay(attempts, jitter=True):
+    """Seconds to wait after the given number of consecutive failures."""
+    delay = min(MAX_DELAY, BASE_DELAY * 2 ** max(attempts - 1, 0))
+    # Jitter keeps many offline sites from retrying in lockstep once the network is back
+    return delay * random.uniform(0.5, 1) if jitter else delay
+
+
+# ----------------------------------------------------------------------------------------------------
+# Replay
+# ----------------------------------------------------------------------------------------------------
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def lock_for(database_name):
+    with _locks_guard:
+        return _locks.setdefault(os.path.abspath(database_name), threading.Lock())
+
+
+def synced_snapshot_path(database_name):
+    """The last snapshot uploaded to Drive, kept as an immutable copy for readers of other tenants' data."""
+    return f'{database_name}.synced'
+
+
+def snapshot_database(database_name):
+    """Copies the database with the SQLite backup API, so the upload never sees a half written commit."""
+    handle, snapshot_path = tempfile.mkstemp(suffix='.snapshot', dir=os.path.dirname(os.path.abspath(database_name)))
+    os.close(handle)
+    with closing(sqlite3.connect(database_name)) as source, closing(sqlite3.connect(snapshot_path)) as target:
+        source.backup(target)
+    return snapshot_path
+
+
+def replay(service, database_name, user_email, force=False, now=None):
+    """Uploads the database if it has pending changes and its backoff delay has passed.
+
+    Args:
+        force: Ignore the backoff delay (e.g. the user pressed Save).
+
+    Returns:
+        OutboxState: The state after the attempt. Nothing is attempted while another replay of the
+        same database is still running.
+    """
+    lock = lock_for(database_name)
+    if not lock.acquire(blocking=False):
+        return read_state(database_name)
+    try:
+        state = read_state(database_name)
+        now = now if now is not None else time.time()
+        if not state.pending or (not force and now < state.next_attempt_at):
+            return state
+
+        try:
+            with tenants.drive_transfer():
+                # Attachment blobs go first, so the database on Drive never links to a missing blob
+                attachments.upload_pending_blobs(service, database_name)
+        except SyncError as e:
+            mark_failed(database_name, e, now)
+            return read_state(database_name)
+
+        # Changes committed while the upload runs are above the high-water mark and stay pending
+        high_water = services.latest_audit_id(database_name)
+        snapshot_path = snapshot_database(database_name)
+        try:
+            with tenants.drive_transfer():
+                services.save_database(service, database_name, user_email, source_path=snapshot_path)
+        except SyncError as e:
+            mark_failed(database_name, e, now)
+            os.remove(snapshot_path)
+        else:
+            mark_synced(database_name, high_water)
+            os.replace(snapshot_path, synced_snapshot_path(database_name))
+    finally:
+        lock.release()
+    return read_state(database_name)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Download
+# ----------------------------------------------------------------------------------------------------
+
+# What pull() did with the local copy
+PULL_DOWNLOADED = 'downloaded'
+PULL_CURRENT = 'current'
+PULL_LOCAL_CHANGES = 'local changes'
+
+
+def pull(service, database_name, user_email, file_id, progress_callback=None):
+    """Replaces the local copy with the Drive copy, unless that would lose something.
+
+    The local copy is kept when it has changes not synced yet, and when it was synced after the
+    Drive copy last changed: it is then the Drive copy already, and other sessions of the user may
+    be writing to it. Decided under the tenant lock, so two sessions never both download.
+
+    Returns:
+        str: PULL_DOWNLOADED, PULL_CURRENT or PULL_LOCAL_CHANGES.
+
+    Raises:
+        SyncError: If Drive cannot be reached.
+    """
+    with tenants.tenant_lock(user_email):
+        state = read_state(database_name) if services.has_schema(database_name) else None
+        if state and state.pending:
+            return PULL_LOCAL_CHANGES
+        if state and state.last_synced_at and \
+                services.remote_modified_at(service, file_id) <= state.last_synced_at:
+            return PULL_CURRENT
+        with tenants.drive_transfer():
+            services.download_database(service, file_id, database_name, progress_callback)
+        mark_in_sync(database_name)
+        return PULL_DOWNLOADED
+
+
+# ----------------------------------------------------------------------------------------------------
+# Background replayer
+# ----------------------------------------------------------------------------------------------------
+
+_replayers = {}
+
+
+def start_replayer(service_factory, database_name, user_email, interval=REPLAY_INTERVAL):
+    """Starts (once per database and process) a daemon thread replaying the outbox every interval seconds.
+
+    Args:
+        service_factory: Builds the Drive service used by the thread; the Streamlit session's service is
+            not shared with it because the HTTP client is not thread-safe.
+    """
+    key = os.path.abspath(database_name)
+    with _locks_guard:
+        if key in _replayers and _replayers[key][0].is_alive():
+            return _replayers[key][0]
+        stop = threading.Event()
+        wake = threading.Event()
+
+        def run():
+            service = None
+            while True:
+                wake.wait(interval)
+                wake.clear()
+                if stop.is_set():
+                    break
+                try:
+                    if service is None:
+                        service = service_factory()
+                    replay(service, database_name, user_email)
+                except Exception as e:
+                    service = None
+                    print(f'Error log: {e}')
+
+        thread = threading.Thread(target=run, name=f'outbox-replayer-{os.path.basename(database_name)}',
+                                  daemon=True)
+        _replayers[key] = (thread, stop, wake)
+        thread.start()
+        return thread
+
+
+def request_sync(database_name):
+    """Asks the background replayer to sync now, skipping any backoff delay; never blocks on Drive.
+
+    Returns:
+        bool: False if no replayer is running for the database.
+    """
+    with closing(connect_outbox(database_name)) as conn, conn:
+        conn.execute('UPDATE sync_state SET next_attempt_at = 0')
+    with _locks_guard:
+        replayer = _replayers.get(os.path.abspath(database_name))
+    if not replayer or not replayer[0].is_alive():
+        return False
+    replayer[2].set()
+    return True
+
+
+def stop_replayer(database_name, wait=True):
+    with _locks_guard:
+        thread, stop, wake = _replayers.pop(os.path.abspath(database_name), (None, None, None))
+    if thread:
+        stop.set()
+        wake.set()
+        if wait:
+            thread.join()
+
+
+def evict(database_name):
+    """Eviction hook: an idle tenant's replayer is stopped, unless it still has changes to ship."""
+    if not read_state(database_name).pending:
+        stop_replayer(database_name, wait=False)
+
+
+tenants.register_eviction_hook(evict)
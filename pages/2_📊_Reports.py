@@ -1,6 +1,10 @@
 import streamlit as st
-from utils import (to_title_case, fetch_data_from_db, to_lower_case,
-                   fetch_and_display_data, purchase_amounts, cursor_conn)
+from utils import (to_title_case, to_lower_case, cursor_conn, cached_distinct_column_values, archived_projects)
+import services
+import shards
+import analytics
+import prices
+from reports import display_table, show_purchase_amounts, purchase_amounts_table, ReportPanels
 
 
 def main():
@@ -23,100 +27,122 @@ def main():
 def reports():
     try:
         conn, cursor, db_name = cursor_conn()
+        project_id = st.session_state['project_id_selected']
+        # The project's own database when the projects are sharded (see shards.py)
+        project_db = shards.project_database(db_name, project_id)
         st.success(f"You're now able to access the project: {st.session_state['project_selection']}")
+        # The panels without widgets fetch their data concurrently and are drawn as it arrives
+        panels = ReportPanels()
         st.header("Construction Expenses")
-        purchase_amounts(db_name)
+        # The selected project only, whether it has a file of its own or shares the user's database
+        panels.add(lambda: purchase_amounts_table(project_db, project_id=project_id), show_purchase_amounts)
 
+        # Each panel with widgets is a fragment: using it reruns that panel only, so the pivot above
+        # is not rebuilt when a column or a vendor is picked
         st.subheader('Purchase Data by Column', divider=True)
-
-        # Requested column names
-        column_names = ['category', 'vendor', 'stage', 'mode_of_payment']
-
-        # Converting column names to title case
-        column_names_title_case = to_title_case(column_names)
-
-        # Dropdown to select the column in title case
-        selected_column = st.selectbox("Select the column:", column_names_title_case)
-        formatted_column = str(selected_column).replace(" ", "_")
-
-        column_data = fetch_data_from_db(
-            f'''select distinct trim(lower({formatted_column})) as columns from purchases''', db_name)
-        column_data_title_case = to_title_case(column_data)
-
-        # Convert each value to title case
-        item_name = st.selectbox("Select the item name:", column_data_title_case)
-        selected_item = to_lower_case(item_name)
-
-        if st.button("Show Purchase Data for selected column"):
-            purchase_data = f"""
-                SELECT purchase_id as 'Purchase ID', 
-                        item_name as 'Item Name', 
-                        item_qty as 'Item Quantity', 
-                        vendor as Vendor, 
-                        stage as Stage, 
-                        category as Category,
-                        date as Date, 
-                        purchase_amount as 'Purchase Amount', 
-                        mode_of_payment as 'Mode of Payment',
-                        paid_amount as 'Paid Amount',
-                        notes as Notes,
-                        pr.project_name as 'Project Name'
-                FROM purchases p
-                join projects pr on pr.project_id = p.project_id
-                WHERE trim(lower({selected_column})) = '{selected_item}'
-                and p.project_id = {st.session_state['project_id_selected']}
-            """
-
-            fetch_and_display_data(purchase_data, db_name)
+        purchase_data_by_column(project_db, project_id)
 
         st.subheader('Other Reports', divider=True)
+        other_reports(project_db, project_id)
+
+        st.subheader('Budget vs Actual', divider=True)
+        # Actuals are kept by triggers, so this reads one row per budget
+        panels.add(lambda: services.budget_variance(project_db, project_id), display_table)
+
+        st.subheader('Vendor Payables', divider=True)
+        # Balances come from the vendor ledger, so this costs one row per vendor however many purchases there are
+        panels.add(lambda: services.vendor_payables(project_db, project_id), display_table)
+        st.write("Outstanding amount by age of purchase")
+        panels.add(lambda: services.vendor_aging(project_db, project_id), display_table)
+        vendor_statement(project_db, project_id)
 
-        if st.button("Show Expenditure for each category"):
-            expenditure_on_each_category = f"""
-                SELECT 
-                    c.category AS Category, 
-                    COALESCE(SUM(p.purchase_amount), "Not Yet Started") AS 'Purchase Amount',
-                    COALESCE(SUM(p.paid_amount), "Not Yet Started") AS 'Paid Amount',
-                    CASE
-                    WHEN SUM(p.purchase_amount) IS NULL AND SUM(p.paid_amount) IS NULL THEN 'Not Yet Started'
-                    ELSE COALESCE(SUM(p.purchase_amount), 0) - COALESCE(SUM(p.paid_amount), 0)
-                    END AS "Difference"
-                FROM 
-                    category c
-                LEFT JOIN 
-                    purchases p ON p.category = c.category 
-                    AND p.project_id = {st.session_state['project_id_selected']}
-                GROUP BY 
-                    c.category;
-            """
-
-            fetch_and_display_data(expenditure_on_each_category, db_name)
-
-        if st.button("Show Expenditure for each stage"):
-            expenditure_on_each_stage = F"""
-                SELECT 
-                    s.stage as Stage, 
-                    COALESCE(SUM(p.purchase_amount),"Not Yet Started") as 'Purchase Amount',
-                    COALESCE(SUM(p.paid_amount), "Not Yet Started") AS 'Paid Amount',
-                    CASE
-                    WHEN SUM(p.purchase_amount) IS NULL AND SUM(p.paid_amount) IS NULL THEN 'Not Yet Started'
-                    ELSE COALESCE(SUM(p.purchase_amount), 0) - COALESCE(SUM(p.paid_amount), 0)
-                    END AS "Difference"
-                FROM 
-                    stages s
-                LEFT JOIN 
-                    purchases p ON p.stage = s.stage 
-                    AND p.project_id = {st.session_state['project_id_selected']}
-                GROUP BY 
-                    s.stage;
-            """
-
-            fetch_and_display_data(expenditure_on_each_stage, db_name)
+        st.subheader('Unit Prices', divider=True)
+        unit_prices(project_db, project_id)
+
+        panels.render()
+
+        st.subheader('Archived Projects', divider=True)
+        archived_projects(st.session_state.get('service'), db_name)
 
     except Exception as e:
         st.warning("Please select the project in Home Page !!")
         print(f'Error log: {e}')
 
 
+@st.fragment
+def purchase_data_by_column(db_name, project_id):
+    # Requested column names
+    column_names = ['category', 'vendor', 'stage', 'mode_of_payment']
+
+    # Converting column names to title case
+    column_names_title_case = to_title_case(column_names)
+
+    # Dropdown to select the column in title case
+    selected_column = st.selectbox("Select the column:", column_names_title_case)
+    formatted_column = str(selected_column).replace(" ", "_")
+
+    column_data = cached_distinct_column_values(db_name, formatted_column)
+    column_data_title_case = to_title_case(column_data)
+
+    # Convert each value to title case
+    item_name = st.selectbox("Select the item name:", column_data_title_case)
+    selected_item = to_lower_case(item_name)
+
+    if st.button("Show Purchase Data for selected column"):
+        purchase_data = services.purchase_data_by_column(db_name, formatted_column, selected_item, project_id)
+
+        display_table(purchase_data)
+
+
+@st.fragment
+def other_reports(db_name, project_id):
+    if st.button("Show Expenditure for each category"):
+        expenditure_on_each_category = analytics.expenditure_by_category(db_name, project_id)
+
+        display_table(expenditure_on_each_category)
+
+    if st.button("Show Expenditure for each stage"):
+        expenditure_on_each_stage = analytics.expenditure_by_stage(db_name, project_id)
+
+        display_table(expenditure_on_each_stage)
+
+
+@st.fragment
+def vendor_statement(db_name, project_id):
+    vendors = [balance.vendor for balance in services.vendor_balances(db_name, project_id)]
+    if vendors:
+        vendor = st.selectbox("Select the vendor for the statement:", vendors)
+        display_table(services.vendor_statement(db_name, project_id, vendor))
+
+
+@st.fragment
+def unit_prices(db_name, project_id):
+    items = prices.priced_items(db_name, project_id)
+    if not items:
+        st.write("No purchases with a quantity in a known unit yet.")
+        return
+    col1, col2 = st.columns(2)
+    item_name, base_unit = col1.selectbox("Select the item:", items,
+                                          format_func=lambda item: f'{item[0]} ({item[1]})')
+    period = col2.selectbox("Select the period:", prices.PERIODS)
+    start_month, end_month = prices.period_months(period)
+
+    # Read from the unit price table kept by triggers: the rows of this item and period only
+    vendors = prices.best_vendors(db_name, item_name, base_unit, start_month, end_month, project_id)
+    if vendors.rows:
+        vendor, price = vendors.rows[0][0], vendors.rows[0][-1]
+        st.write(f"Cheapest vendor of {item_name}: **{vendor}** at {price:,.2f} per {base_unit}")
+        display_table(vendors)
+    else:
+        st.write(f"No purchases of {item_name} in this period.")
+
+    trend = prices.price_trend(db_name, item_name, base_unit, project_id)
+    if trend.rows:
+        st.write(f"Price per {base_unit} by month")
+        months, *_, lowest, highest, average = zip(*trend.rows)
+        st.line_chart({'Month': months, 'Lowest Price': lowest, 'Highest Price': highest, 'Average Price': average},
+                      x='Month')
+
+
 if __name__ == "__main__":
     main()
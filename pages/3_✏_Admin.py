@@ -1,5 +1,7 @@
 import streamlit as st
-from utils import delete_the_last_project, edit_project, delete_purchase_record, cursor_conn
+import shards
+from utils import (delete_project, edit_project, delete_purchase_records, restore_purchase_records, cursor_conn,
+                   sync_status_sidebar, edit_budgets, archive_project, duplicate_purchases)
 
 st.set_page_config(
     page_title='Admin',
@@ -13,14 +15,26 @@ def main():
         conn, cursor, db_name = cursor_conn()
         try:
             if st.session_state["token"]:
+                sync_status_sidebar(db_name)
                 st.subheader("Edit Project Details", divider=True)
                 edit_project(db_name)
-                st.subheader("Delete the Last Project", divider=True)
-                delete_the_last_project(db_name)
+                st.subheader("Delete a Project", divider=True)
+                delete_project(db_name)
+                st.subheader("Archive a Finished Project", divider=True)
+                archive_project(db_name)
             try:
                 if st.session_state['project_id_selected']:
-                    st.subheader("Delete the Unwanted Purchase Entry", divider=True)
-                    delete_purchase_record(db_name)
+                    project_id = st.session_state['project_id_selected']
+                    # The project's own database when the projects are sharded (see shards.py)
+                    project_db = shards.project_database(db_name, project_id)
+                    st.subheader("Delete the Unwanted Purchase Entries", divider=True)
+                    delete_purchase_records(project_db, project_id)
+                    with st.expander("Restore Deleted Purchases"):
+                        restore_purchase_records(project_db, project_id)
+                    with st.expander("Likely Duplicate Purchases"):
+                        duplicate_purchases(project_db, project_id)
+                    st.subheader("Project Budgets", divider=True)
+                    edit_budgets(project_db, project_id)
             except Exception as e:
                 st.warning(f"Please select the project in Home Page !!")
                 print(f'Error log: {e}')
@@ -0,0 +1,69 @@
+import streamlit as st
+from utils import format_currency, is_admin
+from portfolio import (find_portfolio_databases, database_label, load_portfolio, portfolio_stage_category,
+                       portfolio_summary)
+
+
+def main():
+    st.set_page_config(
+        page_title='Portfolio',
+        page_icon='🗂',
+        layout="wide"
+    )
+
+    st.title("🗂 Portfolio")
+
+    try:
+        if st.session_state["token"]:
+            portfolio()
+    except Exception as e:
+        st.warning("Please login with Google in Home Page!!")
+        print(f'Error log: {e}')
+
+
+def format_amounts(df):
+    """Formats every amount column of a report frame as currency for display."""
+    formatted_df = df.copy()
+    for col in formatted_df.columns:
+        if col not in ('Stage', 'Project', 'Vendor', 'Category', 'Database', 'Purchases'):
+            formatted_df[col] = formatted_df[col].apply(format_currency)
+    return formatted_df
+
+
+def portfolio():
+    # Portfolio mode reads other accounts' databases, so only configured office admins may use it
+    if not is_admin():
+        st.warning("Portfolio reports are only available to office administrators")
+        return
+
+    directory = st.secrets.get('portfolio', {}).get('directory', '.')
+    databases = find_portfolio_databases(directory)
+    if not databases:
+        st.warning("No databases found for the portfolio.")
+        return
+
+    selected = st.multiselect("Select the databases:", databases, default=databases,
+                              format_func=lambda database_name: database_label(database_name, directory))
+    if not st.button("Build Portfolio Report"):
+        return
+
+    portfolio_df, errors, timings = load_portfolio(selected, root=directory)
+    for database, error in errors.items():
+        st.error(f"Skipped {database}: {error}")
+    if timings:
+        st.caption(f"Aggregated {len(timings)} databases, slowest took {max(timings.values()):.3f}s")
+    if portfolio_df.empty:
+        st.warning("No data found for the selected criteria.")
+        return
+
+    st.subheader('Expenses by Stage and Category', divider=True)
+    st.dataframe(format_amounts(portfolio_stage_category(portfolio_df)), use_container_width=True)
+
+    # Project ids restart in every database, so projects are keyed by their database as well
+    for title, columns in (('Project', ['Database', 'Project']), ('Vendor', 'Vendor')):
+        st.subheader(f'Expenses by {title}', divider=True)
+        st.dataframe(format_amounts(portfolio_summary(portfolio_df, columns)), use_container_width=True)
+
+
+if __name__ == "__main__":
+    main()
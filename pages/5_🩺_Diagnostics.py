@@ -0,0 +1,70 @@
+import json
+import streamlit as st
+from instrumentation import snapshot, export_trace, reset, METRICS_LOG_PATH
+from utils import is_admin
+
+st.set_page_config(
+    page_title='Diagnostics',
+    layout="wide"
+)
+
+
+def main():
+    st.header("Diagnostics")
+    try:
+        if st.session_state["token"]:
+            diagnostics()
+    except Exception as e:
+        st.warning("Please login with Google in Home Page!!")
+        print(f'Error log: {e}')
+
+
+def diagnostics():
+    # The metrics are those of the whole process, every user's calls included
+    if not is_admin():
+        st.warning("Diagnostics are only available to office administrators")
+        return
+
+    metrics = snapshot()
+    if METRICS_LOG_PATH:
+        st.caption(f"Structured log: {METRICS_LOG_PATH}")
+
+    if not metrics:
+        st.info("No calls recorded yet. Use the app and come back to this page.")
+        return
+
+    kinds = sorted({metric['kind'] for metric in metrics})
+    selected_kinds = st.multiselect("Layers:", kinds, default=kinds)
+    shown = [metric for metric in metrics if metric['kind'] in selected_kinds]
+
+    # Where the time goes per layer (SQLite, Drive, OAuth, report building)
+    st.subheader("Time by layer", divider=True)
+    totals = {}
+    for metric in shown:
+        totals[metric['kind']] = totals.get(metric['kind'], 0) + metric['total_ms']
+    st.bar_chart(totals)
+
+    st.subheader("Calls", divider=True)
+    st.dataframe([{key: value for key, value in metric.items() if key != 'histogram'} for metric in shown],
+                 use_container_width=True)
+
+    st.subheader("Latency histogram", divider=True)
+    labels = [f"{metric['kind']} | {metric['name']}" for metric in shown]
+    if labels:
+        selected = st.selectbox("Select the call:", labels)
+        st.bar_chart(shown[labels.index(selected)]['histogram'])
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("Download metrics (JSON)", json.dumps(metrics, indent=2), file_name='metrics.json',
+                           mime='application/json')
+    with col2:
+        st.download_button("Download trace", export_trace(), file_name='trace.json', mime='application/json')
+    with col3:
+        if st.button("Reset metrics"):
+            reset()
+            st.rerun()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import glob
+import sqlite3
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import outbox
+import shards
+from services import connect_readonly
+from queries import statement
+
+PORTFOLIO_COLUMNS = ['Database', 'Project', 'Stage', 'Category', 'Vendor',
+                     'Purchase Amount', 'Paid Amount', 'Purchases']
+
+PROJECT_AGGREGATE_QUERY = statement('portfolio.project_aggregate')
+LEGACY_PROJECT_AGGREGATE_QUERY = statement('portfolio.project_aggregate_legacy')
+ARCHIVED_AGGREGATE_QUERY = statement('portfolio.archived_aggregate')
+
+
+# ----------------------------------------------------------------------------------------------------
+# Locating databases
+# ----------------------------------------------------------------------------------------------------
+
+def find_portfolio_databases(directory):
+    """Lists the SQLite database files (*.db) found in the given directory and its tenant subdirectories.
+
+    Project shards (see shards.py) are not listed: they are aggregated with the database of their user.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(path for path in glob.glob(os.path.join(directory, '**', '*.db'), recursive=True)
+                  if not shards.is_shard(path))
+
+
+def database_label(database_name, root=None):
+    """Name of a database in the portfolio: its path under the root, as users in different tenant
+    directories can have databases with the same file name."""
+    if root is None:
+        return database_name
+    return os.path.relpath(database_name, root).replace(os.sep, '/')
+
+
+# ----------------------------------------------------------------------------------------------------
+# Parallel aggregation
+# ----------------------------------------------------------------------------------------------------
+
+def aggregate_file(path):
+    """Runs the per-project aggregate query against a single database file.
+
+    Other users' databases are read from their last synced snapshot when there is one: it never
+    changes, so it is read without any locking and the owner's data entry is never slowed down.
+    Otherwise the live file is read through a read-only connection, as it is: a file the app has
+    not opened since an upgrade is read in its older schema.
+    """
+    snapshot = outbox.synced_snapshot_path(path)
+    if os.path.exists(snapshot):
+        conn = connect_readonly(snapshot, immutable=True)
+    else:
+        conn = connect_readonly(path)
+    try:
+        # Soft deletes came with the first migration
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        rows = conn.execute(PROJECT_AGGREGATE_QUERY if version >= 1 else LEGACY_PROJECT_AGGREGATE_QUERY).fetchall()
+        # Archived projects are counted from the totals kept for them (files older than the archive have none)
+        if conn.execute(statement('schema.has_table'), ('archive_totals',)).fetchone():
+            rows += conn.execute(ARCHIVED_AGGREGATE_QUERY).fetchall()
+    finally:
+        conn.close()
+    return rows
+
+
+def aggregate_database(database_name, root=None):
+    """Runs the per-project aggregate query against a user's database and the shards of its projects.
+
+    In the sharded layout the purchases of a project are in a file of their own, so its shards on
+    this device are read with the database and reported under its name.
+
+    Args:
+        database_name: Path of the SQLite database file.
+        root: Optional; directory the database is labelled relative to (see database_label).
+
+    Returns:
+        tuple: (rows, elapsed seconds) where every row is prefixed with the database label.
+    """
+    start = perf_counter()
+    rows = aggregate_file(database_name)
+    for path in shards.local_shards(database_name):
+        rows += aggregate_file(path)
+    label = database_label(database_name, root)
+    return [(label,) + row for row in rows], perf_counter() - start
+
+
+def load_portfolio(database_names, max_workers=None, root=None):
+    """Aggregates many databases concurrently and merges them into one frame.
+
+    SQLite releases the GIL while a statement runs, so a thread pool lets every file be scanned
+    at the same time and the total time follows the slowest database rather than the sum.
+
+    Args:
+        database_names: Paths of the database files to include.
+        max_workers: Optional; size of the thread pool. Defaults to one thread per database (max 16).
+        root: Optional; directory the databases are labelled relative to (see database_label).
+
+    Returns:
+        tuple: (DataFrame with PORTFOLIO_COLUMNS, {database: error message}, {database: seconds})
+    """
+    rows, errors, timings = [], {}, {}
+    if not database_names:
+        return pd.DataFrame(columns=PORTFOLIO_COLUMNS), errors, timings
+
+    workers = max_workers or min(16, len(database_names))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(aggregate_database, name, root): name for name in database_names}
+        for future in as_completed(futures):
+            label = database_label(futures[future], root)
+            try:
+                database_rows, elapsed = future.result()
+                rows.extend(database_rows)
+                timings[label] = elapsed
+            except sqlite3.Error as e:
+                # A broken or foreign file must not take the whole portfolio down
+                errors[label] = str(e)
+
+    return pd.DataFrame(rows, columns=PORTFOLIO_COLUMNS), errors, timings
+
+
+# ----------------------------------------------------------------------------------------------------
+# Consolidated views
+# ----------------------------------------------------------------------------------------------------
+
+def portfolio_stage_category(portfolio_df):
+    """Stage x Category pivot of purchase amounts across the whole portfolio."""
+    pivot = pd.pivot_table(portfolio_df, values='Purchase Amount', index='Stage', columns='Category',
+                           aggfunc='sum', fill_value=0, margins=True, margins_name='Total')
+    return pivot.reset_index()
+
+
+def portfolio_summary(portfolio_df, columns):
+    """Purchase, paid and outstanding amounts grouped by the given portfolio column(s)."""
+    summary = (portfolio_df.groupby(columns, as_index=False)[['Purchase Amount', 'Paid Amount', 'Purchases']]
+               .sum()
+               .sort_values('Purchase Amount', ascending=False, ignore_index=True))
+    summary['Difference'] = summary['Purchase Amount'] - summary['Paid Amount']
+    return summary
@@ -0,0 +1,93 @@
+"""Price per unit of the items purchased, per vendor and month.
+
+A purchase has a price per unit when its quantity is entered in a known unit (services.UNIT_CONVERSIONS)
+and its quantity and amount are positive. Quantities are converted to the base unit of their unit
+(Kg to MT, ml to Liters...), so purchases of the same item compare whatever unit they were entered in.
+
+unit_prices (migration 8) keeps the quantity, amount and number of live purchases per item, base unit,
+month, vendor and project, maintained by triggers like the vendor ledger. Its key starts with the
+item, unit and month, so "which vendor gave us the cheapest cement per MT this quarter" reads the
+few rows of cement in the three months of the quarter, however many purchases there are.
+
+Items are compared by name, trimmed and in lower case.
+"""
+from datetime import date
+from services import UNIT_CONVERSIONS, reading, query_table
+from queries import statement
+
+PERIODS = ['This Quarter', 'Last Quarter', 'This Year', 'All Time']
+
+
+def normalize_unit(unit):
+    """The base unit of a unit and the factor converting to it, or (None, None) for an unknown unit."""
+    return UNIT_CONVERSIONS.get(str(unit or '').strip().lower(), (None, None))
+
+
+def unit_price(purchase_amount, item_qty, unit):
+    """Price per base unit of a purchase, or None when it has none."""
+    base_unit, factor = normalize_unit(unit)
+    if base_unit is None or not item_qty or item_qty <= 0 or not purchase_amount or purchase_amount <= 0:
+        return None
+    return purchase_amount / (item_qty * factor)
+
+
+def period_months(period, today=None):
+    """First and last month ('YYYY-MM') of one of PERIODS.
+
+    Raises:
+        ValueError: If the period is not one of PERIODS.
+    """
+    today = today or date.today()
+    quarter_start = (today.month - 1) // 3 * 3 + 1
+    if period == 'This Quarter':
+        year, first = today.year, quarter_start
+    elif period == 'Last Quarter':
+        year, first = (today.year, quarter_start - 3) if quarter_start > 1 else (today.year - 1, 10)
+    elif period == 'This Year':
+        return f'{today.year}-01', f'{today.year}-12'
+    elif period == 'All Time':
+        return '0000-00', '9999-99'
+    else:
+        raise ValueError(f"Unknown period {period}.")
+    return f'{year}-{first:02d}', f'{year}-{first + 2:02d}'
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reports
+# ----------------------------------------------------------------------------------------------------
+
+def priced_items(database_name, project_id=None):
+    """The items with a unit price as (item name, base unit) pairs, most purchased first."""
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('prices.items'), (project_id, project_id)).fetchall()
+    return [(item_name, base_unit) for item_name, base_unit, _ in rows]
+
+
+def best_vendors(database_name, item_name, base_unit, start_month, end_month, project_id=None):
+    """Vendors of an item between two months, cheapest price per unit first.
+
+    Returns:
+        Table: One row per vendor with its purchases, quantity, amount and price per base unit.
+    """
+    table = query_table(database_name, statement('prices.by_vendor'),
+                        (item_name, base_unit, start_month, end_month, project_id, project_id))
+    table.columns = ['Vendor', 'Purchases', f'Quantity ({base_unit})', 'Purchase Amount', f'Price per {base_unit}']
+    return table
+
+
+def cheapest_vendor(database_name, item_name, base_unit, start_month, end_month, project_id=None):
+    """(vendor, price per base unit) of the cheapest vendor of an item between two months, or None."""
+    vendors = best_vendors(database_name, item_name, base_unit, start_month, end_month, project_id)
+    return (vendors.rows[0][0], vendors.rows[0][-1]) if vendors.rows else None
+
+
+def price_trend(database_name, item_name, base_unit, project_id=None):
+    """Price per base unit of an item per month: the lowest and highest price of a vendor and the average paid.
+
+    Returns:
+        Table: One row per month with a purchase of the item, oldest first.
+    """
+    table = query_table(database_name, statement('prices.trend'), (item_name, base_unit, project_id, project_id))
+    table.columns = ['Month', 'Purchases', f'Quantity ({base_unit})', 'Purchase Amount', 'Lowest Price',
+                     'Highest Price', 'Average Price']
+    return table
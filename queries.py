@@ -0,0 +1,488 @@
+"""Catalog of the SQL statements run by the app.
+
+Every statement is a fixed, parameterized string: values are always bound with `?`, so the
+SQL text does not change between calls and SQLite's per-connection statement cache can reuse
+the compiled statement. The only dynamic SQL left is the column picked on the reports page,
+which is checked against REPORT_COLUMNS, and the pivot reports, whose shape follows the
+category and stage lists.
+
+Deleted projects and purchases are kept as tombstones (deleted_at is set), so every read
+statement only looks at rows where deleted_at IS NULL.
+"""
+
+# Compiled statements kept per connection (the sqlite3 default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Columns of the purchases table the reports page may filter on
+REPORT_COLUMNS = ('category', 'vendor', 'stage', 'mode_of_payment')
+
+
+# ----------------------------------------------------------------------------------------------------
+# Statements
+# ----------------------------------------------------------------------------------------------------
+
+STATEMENTS = {
+    # Projects
+    'projects.list': "SELECT project_id, project_name, project_location FROM projects WHERE deleted_at IS NULL",
+    'projects.get': '''SELECT project_id, project_name, project_location FROM projects
+                       WHERE project_id = ? AND deleted_at IS NULL''',
+    'projects.insert': '''INSERT INTO projects
+                          (project_name, project_location)
+                          VALUES (?, ?)''',
+    'projects.update': """
+        UPDATE projects
+        SET project_name = ?, project_location = ?
+        WHERE project_id = ?
+    """,
+    'projects.soft_delete': "UPDATE projects SET deleted_at = ? WHERE project_id = ? AND deleted_at IS NULL",
+
+    # Reference data
+    'reference.categories': 'SELECT category FROM category',
+    'reference.payment_modes': 'SELECT mode_of_payment FROM mode_of_payment',
+    'reference.stages': 'SELECT stage FROM stages',
+    'reference.vendors': 'SELECT distinct vendor FROM purchases WHERE deleted_at IS NULL',
+
+    # Purchases
+    'purchases.insert': '''INSERT INTO purchases
+                           (project_id, item_name, item_qty, unit, vendor, stage, category, date,
+                           purchase_amount, mode_of_payment, paid_amount, paid_by, notes)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+    'purchases.ids': "SELECT purchase_id FROM purchases WHERE project_id = ? AND deleted_at IS NULL",
+    'purchases.deleted_ids': "SELECT purchase_id FROM purchases WHERE project_id = ? AND deleted_at IS NOT NULL",
+    'purchases.get': "SELECT * FROM purchases WHERE purchase_id = ?",
+    'purchases.soft_delete': "UPDATE purchases SET deleted_at = ? WHERE purchase_id = ? AND deleted_at IS NULL",
+    'purchases.soft_delete_by_project': '''UPDATE purchases SET deleted_at = ?
+                                           WHERE project_id = ? AND deleted_at IS NULL''',
+    'purchases.restore': "UPDATE purchases SET deleted_at = NULL WHERE purchase_id = ? AND deleted_at IS NOT NULL",
+    'purchases.grand_total': "SELECT COALESCE(SUM(purchase_amount), 0) FROM purchases WHERE deleted_at IS NULL",
+
+    # Audit log
+    'audit.since': '''SELECT audit_id, table_name, row_id, action, changed_at, payload FROM audit_log
+                      WHERE audit_id > ? ORDER BY audit_id LIMIT ?''',
+    'audit.latest_id': "SELECT COALESCE(MAX(audit_id), 0) FROM audit_log",
+    'audit.count_since': "SELECT COUNT(*) FROM audit_log WHERE audit_id > ?",
+
+    # Reports
+    'reports.view_purchases': '''
+        SELECT
+            purchase_id as 'Purchase ID',
+            item_name as 'Item Name',
+            unit as 'Unit',
+            item_qty as 'Item Qty',
+            CASE
+            WHEN unit = 'Nos' or unit = 'Others' OR unit is null
+            THEN COALESCE(CAST(item_qty AS INTEGER),'') || ' ' || COALESCE(unit,'')
+            ELSE COALESCE(printf('%.2f', item_qty), '') || ' ' || COALESCE(unit,'')
+        END AS 'Item Quantity',
+        CASE WHEN item_qty > 0 THEN round(purchase_amount / item_qty, 2) END AS 'Unit Price',
+        vendor as Vendor,
+        stage as Stage,
+        category as Category,
+        date as Date,
+        purchase_amount as 'Purchase Amount',
+        mode_of_payment as 'Mode of Payment',
+        paid_amount as 'Paid Amount',
+        paid_by as 'Paid By',
+        notes as Notes
+        FROM purchases
+        WHERE project_id = ? AND deleted_at IS NULL
+    ''',
+    'reports.expenditure_by_category': """
+        SELECT
+            c.category AS Category,
+            COALESCE(SUM(p.purchase_amount), 'Not Yet Started') AS 'Purchase Amount',
+            COALESCE(SUM(p.paid_amount), 'Not Yet Started') AS 'Paid Amount',
+            CASE
+            WHEN SUM(p.purchase_amount) IS NULL AND SUM(p.paid_amount) IS NULL THEN 'Not Yet Started'
+            ELSE COALESCE(SUM(p.purchase_amount), 0) - COALESCE(SUM(p.paid_amount), 0)
+            END AS "Difference"
+        FROM
+            category c
+        LEFT JOIN
+            purchases p ON p.category = c.category
+            AND p.project_id = ?
+            AND p.deleted_at IS NULL
+        GROUP BY
+            c.category;
+    """,
+    'reports.expenditure_by_stage': """
+        SELECT
+            s.stage as Stage,
+            COALESCE(SUM(p.purchase_amount), 'Not Yet Started') as 'Purchase Amount',
+            COALESCE(SUM(p.paid_amount), 'Not Yet Started') AS 'Paid Amount',
+            CASE
+            WHEN SUM(p.purchase_amount) IS NULL AND SUM(p.paid_amount) IS NULL THEN 'Not Yet Started'
+            ELSE COALESCE(SUM(p.purchase_amount), 0) - COALESCE(SUM(p.paid_amount), 0)
+            END AS "Difference"
+        FROM
+            stages s
+        LEFT JOIN
+            purchases p ON p.stage = s.stage
+            AND p.project_id = ?
+            AND p.deleted_at IS NULL
+        GROUP BY
+            s.stage;
+    """,
+
+    # Vendor ledger (tables maintained by triggers, see services.ledger_triggers)
+    'ledger.balances': '''SELECT vendor, purchased, paid, purchases FROM vendor_ledger
+                          WHERE project_id = ? AND purchases > 0
+                          ORDER BY purchased - paid DESC''',
+    'ledger.aging': '''
+        SELECT l.vendor AS Vendor,
+               SUM(CASE WHEN julianday(?) - julianday(b.date) <= 30 THEN b.purchased - b.paid ELSE 0 END)
+                   AS '0-30 Days',
+               SUM(CASE WHEN julianday(?) - julianday(b.date) BETWEEN 31 AND 60 THEN b.purchased - b.paid ELSE 0 END)
+                   AS '31-60 Days',
+               SUM(CASE WHEN julianday(?) - julianday(b.date) BETWEEN 61 AND 90 THEN b.purchased - b.paid ELSE 0 END)
+                   AS '61-90 Days',
+               SUM(CASE WHEN julianday(?) - julianday(b.date) > 90 THEN b.purchased - b.paid ELSE 0 END)
+                   AS 'Over 90 Days',
+               SUM(b.purchased - b.paid) AS Outstanding
+        FROM vendor_balances b
+        JOIN vendor_ledger l ON l.project_id = b.project_id AND l.vendor_key = b.vendor_key
+        WHERE b.project_id = ? AND l.purchases > 0
+        GROUP BY b.vendor_key
+        HAVING Outstanding != 0
+        ORDER BY Outstanding DESC
+    ''',
+    'ledger.statement': '''
+        SELECT date AS Date,
+               purchased AS 'Purchase Amount',
+               paid AS 'Paid Amount',
+               SUM(purchased - paid) OVER (ORDER BY date) AS Balance
+        FROM vendor_balances
+        WHERE project_id = ? AND vendor_key = lower(trim(?)) AND (purchased != 0 OR paid != 0)
+        ORDER BY date
+    ''',
+
+    # Columnar cache loads
+    'columnar.load_all': '''SELECT purchase_id, project_id, stage, category, lower(trim(vendor)), lower(trim(mode_of_payment)),
+                                   date, purchase_amount, paid_amount
+                            FROM purchases WHERE deleted_at IS NULL''',
+    'columnar.load_project': '''SELECT purchase_id, project_id, stage, category, lower(trim(vendor)),
+                                       lower(trim(mode_of_payment)), date, purchase_amount, paid_amount
+                                FROM purchases WHERE deleted_at IS NULL AND project_id = ?''',
+
+    # Budgets (actuals maintained by triggers, see services.budget_triggers); the first two parameters
+    # are the burn rate window
+    'budgets.upsert': '''INSERT INTO budgets (project_id, stage, category, amount) VALUES (?, ?, ?, ?)
+                         ON CONFLICT (project_id, stage, category) DO UPDATE SET amount = excluded.amount''',
+    'budgets.delete': 'DELETE FROM budgets WHERE project_id = ? AND stage = ? AND category = ?',
+    'budgets.status': '''
+        SELECT b.stage, b.category, b.amount, COALESCE(a.purchased, 0), COALESCE(a.paid, 0),
+               (SELECT COALESCE(SUM(m.purchased), 0) FROM budget_burn m
+                WHERE m.project_id = b.project_id AND m.stage = b.stage AND m.category = b.category
+                  AND m.month BETWEEN ? AND ?)
+        FROM budgets b
+        LEFT JOIN budget_actuals a
+            ON a.project_id = b.project_id AND a.stage = b.stage AND a.category = b.category
+        WHERE b.project_id = ? AND b.stage = ? AND b.category = ?
+    ''',
+    'budgets.project': '''
+        SELECT b.stage, b.category, b.amount, COALESCE(a.purchased, 0), COALESCE(a.paid, 0),
+               (SELECT COALESCE(SUM(m.purchased), 0) FROM budget_burn m
+                WHERE m.project_id = b.project_id AND m.stage = b.stage AND m.category = b.category
+                  AND m.month BETWEEN ? AND ?)
+        FROM budgets b
+        LEFT JOIN budget_actuals a
+            ON a.project_id = b.project_id AND a.stage = b.stage AND a.category = b.category
+        WHERE b.project_id = ?
+        ORDER BY b.stage, b.category
+    ''',
+
+    # Attachments (file content in the blob store, see attachments.py)
+    'attachments.insert_blob': '''INSERT INTO blobs (sha256, size, mime_type) VALUES (?, ?, ?)
+                                  ON CONFLICT (sha256) DO NOTHING''',
+    'attachments.insert': '''INSERT INTO attachments (purchase_id, sha256, file_name, added_at)
+                             VALUES (?, ?, ?, ?)''',
+    'attachments.by_purchase': '''SELECT a.attachment_id, a.purchase_id, a.sha256, a.file_name, b.size, b.mime_type,
+                                         a.added_at
+                                  FROM attachments a JOIN blobs b ON b.sha256 = a.sha256
+                                  WHERE a.purchase_id = ? AND a.deleted_at IS NULL
+                                  ORDER BY a.attachment_id''',
+    'attachments.soft_delete': '''UPDATE attachments SET deleted_at = ?
+                                  WHERE attachment_id = ? AND deleted_at IS NULL''',
+    'attachments.blob': 'SELECT sha256, size, mime_type, drive_file_id FROM blobs WHERE sha256 = ?',
+    'attachments.not_uploaded': 'SELECT sha256, mime_type FROM blobs WHERE drive_file_id IS NULL',
+    'attachments.uploaded': 'UPDATE blobs SET drive_file_id = ? WHERE sha256 = ?',
+
+    # A project moved into a database of its own (services.copy_project, for archive.py and shards.py). The
+    # copy statements run on the new database, with the one the project leaves attached as "live";
+    # tombstones and the audit history go too, nothing of the project is lost
+    'project_copy.project': '''INSERT INTO projects (project_id, project_name, project_location, deleted_at)
+                               SELECT project_id, project_name, project_location, deleted_at
+                               FROM live.projects WHERE project_id = ?''',
+    'project_copy.purchases': '''INSERT INTO purchases
+                                 (purchase_id, project_id, item_name, item_qty, unit, vendor, stage, category, date,
+                                 purchase_amount, mode_of_payment, paid_amount, paid_by, notes, deleted_at)
+                                 SELECT purchase_id, project_id, item_name, item_qty, unit, vendor, stage, category,
+                                        date, purchase_amount, mode_of_payment, paid_amount, paid_by, notes, deleted_at
+                                 FROM live.purchases WHERE project_id = ?''',
+    # With their rowids, which their audit history refers to
+    'project_copy.budgets': '''INSERT INTO budgets (rowid, project_id, stage, category, amount)
+                               SELECT rowid, project_id, stage, category, amount FROM live.budgets
+                               WHERE project_id = ?''',
+    'project_copy.blobs': '''INSERT INTO blobs (sha256, size, mime_type, drive_file_id)
+                             SELECT DISTINCT b.sha256, b.size, b.mime_type, b.drive_file_id
+                             FROM live.blobs b
+                             JOIN live.attachments a ON a.sha256 = b.sha256
+                             JOIN live.purchases p ON p.purchase_id = a.purchase_id
+                             WHERE p.project_id = ?''',
+    'project_copy.attachments': '''INSERT INTO attachments (attachment_id, purchase_id, sha256, file_name, added_at,
+                                                           deleted_at)
+                                   SELECT a.attachment_id, a.purchase_id, a.sha256, a.file_name, a.added_at,
+                                          a.deleted_at
+                                   FROM live.attachments a JOIN live.purchases p ON p.purchase_id = a.purchase_id
+                                   WHERE p.project_id = ?''',
+    # ?1 is the project id throughout
+    'project_copy.audit_log': '''INSERT INTO audit_log (audit_id, table_name, row_id, action, changed_at, payload)
+                                 SELECT audit_id, table_name, row_id, action, changed_at, payload FROM live.audit_log
+                                 WHERE (table_name = 'projects' AND row_id = ?1)
+                                    OR (table_name = 'purchases' AND row_id IN
+                                        (SELECT purchase_id FROM live.purchases WHERE project_id = ?1))
+                                    OR (table_name = 'attachments' AND row_id IN
+                                        (SELECT a.attachment_id FROM live.attachments a
+                                         JOIN live.purchases p ON p.purchase_id = a.purchase_id
+                                         WHERE p.project_id = ?1))
+                                    OR (table_name = 'budgets' AND row_id IN
+                                        (SELECT rowid FROM live.budgets WHERE project_id = ?1))''',
+    # What the copy leaves behind, run in the database the project leaves; the project row and its own
+    # history stay (archive.py deletes the row, shards.py keeps it in the catalog)
+    'project_copy.purge_audit_log': '''DELETE FROM audit_log
+                                       WHERE (table_name = 'purchases' AND row_id IN
+                                              (SELECT purchase_id FROM purchases WHERE project_id = ?1))
+                                          OR (table_name = 'attachments' AND row_id IN
+                                              (SELECT a.attachment_id FROM attachments a
+                                               JOIN purchases p ON p.purchase_id = a.purchase_id
+                                               WHERE p.project_id = ?1))
+                                          OR (table_name = 'budgets' AND row_id IN
+                                              (SELECT rowid FROM budgets WHERE project_id = ?1))''',
+    'project_copy.purge_attachments': '''DELETE FROM attachments
+                                         WHERE purchase_id IN (SELECT purchase_id FROM purchases WHERE project_id = ?)''',
+    'project_copy.purge_purchases': 'DELETE FROM purchases WHERE project_id = ?',
+    'project_copy.purge_budgets': 'DELETE FROM budgets WHERE project_id = ?',
+    'project_copy.purge_vendor_ledger': 'DELETE FROM vendor_ledger WHERE project_id = ?',
+    'project_copy.purge_vendor_balances': 'DELETE FROM vendor_balances WHERE project_id = ?',
+    'project_copy.purge_budget_actuals': 'DELETE FROM budget_actuals WHERE project_id = ?',
+    'project_copy.purge_budget_burn': 'DELETE FROM budget_burn WHERE project_id = ?',
+    'project_copy.purge_unit_prices': 'DELETE FROM unit_prices WHERE project_id = ?',
+
+    # Archived projects (see archive.py)
+    'archive.insert_project': '''INSERT INTO archived_projects (project_id, project_name, project_location, archived_at,
+                                                               sha256)
+                                 SELECT project_id, project_name, project_location, ?, ? FROM projects
+                                 WHERE project_id = ?''',
+    'archive.project_totals': '''SELECT project_id, stage, category, trim(vendor), SUM(purchase_amount),
+                                        SUM(COALESCE(paid_amount, 0)), COUNT(*)
+                                 FROM purchases WHERE project_id = ? AND deleted_at IS NULL
+                                 GROUP BY stage, category, trim(vendor)''',
+    'archive.insert_total': '''INSERT INTO archive_totals (project_id, stage, category, vendor, purchased, paid,
+                                                          purchases)
+                               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+    'archive.purge_project': 'DELETE FROM projects WHERE project_id = ?',
+    'archive.list': '''SELECT a.project_id, a.project_name, a.project_location, a.archived_at, a.sha256,
+                             COALESCE(SUM(t.purchases), 0), COALESCE(SUM(t.purchased), 0), COALESCE(SUM(t.paid), 0)
+                      FROM archived_projects a LEFT JOIN archive_totals t ON t.project_id = a.project_id
+                      GROUP BY a.project_id
+                      ORDER BY a.archived_at DESC, a.project_id''',
+    'archive.get': '''SELECT a.project_id, a.project_name, a.project_location, a.archived_at, a.sha256,
+                            COALESCE(SUM(t.purchases), 0), COALESCE(SUM(t.purchased), 0), COALESCE(SUM(t.paid), 0)
+                     FROM archived_projects a LEFT JOIN archive_totals t ON t.project_id = a.project_id
+                     WHERE a.project_id = ?
+                     GROUP BY a.project_id''',
+    'archive.totals': '''SELECT stage AS Stage, category AS Category, SUM(purchases) AS Purchases,
+                               SUM(purchased) AS 'Purchase Amount', SUM(paid) AS 'Paid Amount',
+                               SUM(purchased) - SUM(paid) AS Difference
+                        FROM archive_totals WHERE project_id = ?
+                        GROUP BY stage, category
+                        ORDER BY stage, category''',
+
+    # Project shards (see shards.py), listed in the catalog
+    'shards.list': 'SELECT project_id FROM project_shards ORDER BY project_id',
+    'shards.get': 'SELECT project_id FROM project_shards WHERE project_id = ?',
+    'shards.insert': 'INSERT INTO project_shards (project_id, created_at) VALUES (?, ?)',
+    'shards.delete': 'DELETE FROM project_shards WHERE project_id = ?',
+    'shards.unsharded': '''SELECT project_id FROM projects
+                           WHERE deleted_at IS NULL AND project_id NOT IN (SELECT project_id FROM project_shards)
+                           ORDER BY project_id''',
+
+    # Duplicate detection (see duplicates.py): vendor, amount and date window are the blocking key of
+    # the purchases_duplicate_key index, the item names of the few matches are compared in Python
+    'duplicates.candidates': '''SELECT purchase_id, item_name, item_qty, unit, vendor, date, purchase_amount
+                                FROM purchases
+                                WHERE project_id = ? AND lower(trim(vendor)) = lower(trim(?))
+                                      AND purchase_amount = ? AND date BETWEEN date(?, ?) AND date(?, ?)
+                                      AND deleted_at IS NULL''',
+    # CROSS JOIN keeps a as the outer loop, so b is always looked up in the index by its blocking key
+    'duplicates.pairs': '''SELECT b.purchase_id, a.purchase_id, b.item_name, a.item_name, b.vendor, b.date, a.date,
+                                  b.purchase_amount
+                           FROM purchases a
+                           CROSS JOIN purchases b ON b.project_id = a.project_id
+                                AND lower(trim(b.vendor)) = lower(trim(a.vendor))
+                                AND b.purchase_amount = a.purchase_amount
+                                AND b.date BETWEEN date(a.date, ?) AND date(a.date, ?)
+                                AND b.deleted_at IS NULL AND b.purchase_id > a.purchase_id
+                           WHERE a.project_id = ? AND a.deleted_at IS NULL''',
+
+    # Unit prices (see prices.py): unit_prices is keyed by item, unit and month, so a comparison reads
+    # the rows of one item and period only
+    'prices.items': '''SELECT MAX(item_name), base_unit, SUM(purchases) FROM unit_prices
+                       WHERE (? IS NULL OR project_id = ?)
+                       GROUP BY item_key, base_unit HAVING SUM(purchases) > 0
+                       ORDER BY SUM(purchases) DESC, item_key''',
+    'prices.by_vendor': '''SELECT MAX(vendor), SUM(purchases), SUM(quantity), SUM(amount),
+                                  SUM(amount) / SUM(quantity) AS unit_price
+                           FROM unit_prices
+                           WHERE item_key = lower(trim(?)) AND base_unit = ? AND month BETWEEN ? AND ?
+                                 AND (? IS NULL OR project_id = ?)
+                           GROUP BY vendor_key HAVING SUM(purchases) > 0
+                           ORDER BY unit_price, vendor_key''',
+    'prices.trend': '''SELECT month, SUM(purchases), SUM(quantity), SUM(amount), MIN(amount / quantity),
+                              MAX(amount / quantity), SUM(amount) / SUM(quantity)
+                       FROM unit_prices
+                       WHERE item_key = lower(trim(?)) AND base_unit = ? AND (? IS NULL OR project_id = ?)
+                             AND purchases > 0
+                       GROUP BY month ORDER BY month''',
+
+    # Read API (see read_api.py): purchases are paged by id, so a page costs the same wherever it starts
+    'api.purchases': '''SELECT purchase_id, project_id, item_name, item_qty, unit, vendor, stage, category, date,
+                               purchase_amount, mode_of_payment, paid_amount, paid_by, notes
+                        FROM purchases
+                        WHERE project_id = ? AND deleted_at IS NULL AND purchase_id > ?
+                        ORDER BY purchase_id LIMIT ?''',
+    'api.stage_category': '''SELECT stage, category, COUNT(*) AS purchases,
+                                    COALESCE(SUM(purchase_amount), 0) AS purchase_amount,
+                                    COALESCE(SUM(paid_amount), 0) AS paid_amount
+                             FROM purchases
+                             WHERE project_id = ? AND deleted_at IS NULL
+                             GROUP BY stage, category
+                             ORDER BY stage, category''',
+
+    # Portfolio: per-project aggregate pushed down to SQLite, so each worker only ships grouped rows back
+    'portfolio.project_aggregate': """
+        SELECT pr.project_id || ' - ' || pr.project_name,
+               p.stage,
+               p.category,
+               trim(p.vendor),
+               COALESCE(SUM(p.purchase_amount), 0),
+               COALESCE(SUM(p.paid_amount), 0),
+               COUNT(*)
+        FROM purchases p
+        JOIN projects pr ON pr.project_id = p.project_id
+        WHERE p.deleted_at IS NULL AND pr.deleted_at IS NULL
+        GROUP BY pr.project_id, p.stage, p.category, trim(p.vendor)
+    """,
+    # Files not opened by the app since soft deletes were added (schema version 0) have no tombstones
+    'portfolio.project_aggregate_legacy': """
+        SELECT pr.project_id || ' - ' || pr.project_name,
+               p.stage,
+               p.category,
+               trim(p.vendor),
+               COALESCE(SUM(p.purchase_amount), 0),
+               COALESCE(SUM(p.paid_amount), 0),
+               COUNT(*)
+        FROM purchases p
+        JOIN projects pr ON pr.project_id = p.project_id
+        GROUP BY pr.project_id, p.stage, p.category, trim(p.vendor)
+    """,
+    # Archived projects are counted from their totals, the archives themselves are never fetched
+    'portfolio.archived_aggregate': """
+        SELECT a.project_id || ' - ' || a.project_name, t.stage, t.category, t.vendor, t.purchased, t.paid,
+               t.purchases
+        FROM archive_totals t
+        JOIN archived_projects a ON a.project_id = t.project_id
+    """,
+    'schema.has_table': "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+}
+
+# The reports page statements, one fixed string per whitelisted column
+for _column in REPORT_COLUMNS:
+    STATEMENTS[f'reports.distinct_{_column}'] = f'''select distinct trim(lower({_column})) as columns from purchases
+                                                    where deleted_at is null'''
+    STATEMENTS[f'reports.purchases_by_{_column}'] = f"""
+        SELECT purchase_id as 'Purchase ID',
+                item_name as 'Item Name',
+                item_qty as 'Item Quantity',
+                vendor as Vendor,
+                stage as Stage,
+                category as Category,
+                date as Date,
+                purchase_amount as 'Purchase Amount',
+                mode_of_payment as 'Mode of Payment',
+                paid_amount as 'Paid Amount',
+                notes as Notes,
+                pr.project_name as 'Project Name'
+        FROM purchases p
+        join projects pr on pr.project_id = p.project_id
+        WHERE trim(lower({_column})) = ?
+        and p.project_id = ?
+        and p.deleted_at is null
+    """
+del _column
+
+
+def statement(name):
+    """Returns the SQL of a named statement; raises KeyError for unknown names."""
+    return STATEMENTS[name]
+
+
+def report_column(column):
+    """Maps a reports page column choice ("Mode Of Payment" or "mode_of_payment") to its column name.
+
+    Raises:
+        ValueError: If the column is not one of REPORT_COLUMNS.
+    """
+    name = str(column).strip().lower().replace(' ', '_')
+    if name not in REPORT_COLUMNS:
+        raise ValueError(f"Unknown report column: {column}")
+    return name
+
+
+# ----------------------------------------------------------------------------------------------------
+# Pivot reports
+# ----------------------------------------------------------------------------------------------------
+
+def quote_identifier(name):
+    """Quotes a category or stage name for use as a column alias."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def expenses_pivot_statement(categories):
+    """SQL and parameters of the Stage x Category pivot with its Total and Percentage rows.
+
+    The SQL only depends on the category names (used as column aliases), so it is reused for as
+    long as the category list stays the same; amounts and the grand total are bound.
+    """
+    sum_case = "COALESCE(SUM(CASE WHEN p.category = ? THEN p.purchase_amount ELSE 0 END), 0)"
+    percentage_case = ("CASE WHEN ? > 0 THEN ROUND(100.0 * SUM(CASE WHEN p.category = ? "
+                       "THEN p.purchase_amount ELSE 0 END) / ?, 2) ELSE 0 END")
+
+    stage_rows = ("SELECT stage as Stage"
+                  + "".join(f", {sum_case} AS {quote_identifier(category)}" for category in categories)
+                  + ", COALESCE(SUM(p.purchase_amount), 0) AS 'Purchase Amount' "
+                  "FROM purchases p WHERE p.deleted_at IS NULL GROUP BY stage")
+    total_row = (" UNION ALL SELECT 'Total'" + "".join(f", {sum_case}" for _ in categories)
+                 + ", COALESCE(SUM(p.purchase_amount), 0) FROM purchases p WHERE p.deleted_at IS NULL")
+    percentage_row = (" UNION ALL SELECT 'Percentage'" + "".join(f", {percentage_case}" for _ in categories)
+                      + ", CASE WHEN ? > 0 THEN 100 ELSE 0 END FROM purchases p WHERE p.deleted_at IS NULL")
+    return stage_rows + total_row + percentage_row
+
+
+def expenses_pivot_params(categories, grand_total):
+    params = list(categories) + list(categories)
+    for category in categories:
+        params += [grand_total, category, grand_total]
+    return tuple(params + [grand_total])
+
+
+def purchase_amounts_statement(stages):
+    """SQL of the Category x Stage purchase amounts; the stage names are bound, not inlined.
+
+    The last two parameters are the project id, or None for every project.
+    """
+    return ("SELECT p.category as Category"
+            + "".join(f", COALESCE(SUM(CASE WHEN p.stage = ? THEN p.purchase_amount ELSE 0 END), 0) "
+                      f"AS {quote_identifier(stage)}" for stage in stages)
+            + ", COALESCE(SUM(p.purchase_amount), 0) AS 'Total' FROM purchases p WHERE p.deleted_at IS NULL "
+            "AND (? IS NULL OR p.project_id = ?) GROUP BY p.category")
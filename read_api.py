@@ -0,0 +1,297 @@
+"""Read-only HTTP/JSON API over the users' databases, for spreadsheets and dashboards.
+
+Serves the databases under the tenant root (tenants.TENANT_ROOT) on the local machine, with the
+Python standard library only:
+
+    GET /databases                                            the user databases, relative to the root
+    GET /projects?database=<db>                               the live projects
+    GET /purchases?database=<db>&project_id=<id>[&after=<purchase id>][&limit=<n>]
+                                                              live purchases in id order, one page at a time
+    GET /reports/stage-category?database=<db>&project_id=<id> amounts per stage and category
+    GET /reports/expenditure?database=<db>&project_id=<id>&by=stage|category
+                                                              the expenditure report of the Reports page
+
+    python read_api.py --port 8765
+    curl 'http://127.0.0.1:8765/purchases?database=b8e30d1addc62fa0/x.db&project_id=2&limit=100'
+
+Every response carries an ETag built from the request and the version of the databases it reads
+(services.database_version: the size and modification time of the file and its write-ahead log).
+A poll sending the ETag back in If-None-Match gets 304 Not Modified after two stat calls per file,
+without the database being opened; clients that do not send it get the last body rendered for
+that ETag. Nothing is written to the databases. Set CONSMAN_API_TOKEN to require an
+`Authorization: Bearer <token>` header.
+
+In the sharded layout (shards.py) the purchases and reports of a project are read from its own
+file; a project whose file is not on this machine reads as empty.
+"""
+import os
+import sys
+import json
+import hmac
+import sqlite3
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import services
+import analytics
+import portfolio
+import shards
+import tenants
+from services import query_table
+from queries import statement
+from instrumentation import timed
+
+API_HOST = os.environ.get('CONSMAN_API_HOST', '127.0.0.1')
+API_PORT = int(os.environ.get('CONSMAN_API_PORT', 8765))
+API_TOKEN = os.environ.get('CONSMAN_API_TOKEN')
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+# Rendered bodies kept per ETag, for the clients that poll without If-None-Match
+MAX_CACHED_RESPONSES = 256
+
+
+# ----------------------------------------------------------------------------------------------------
+# Databases
+# ----------------------------------------------------------------------------------------------------
+
+def list_databases(root):
+    """The user databases under the root, as the names the API takes (paths relative to the root)."""
+    return [portfolio.database_label(path, root) for path in portfolio.find_portfolio_databases(root)]
+
+
+def resolve_database(root, params):
+    """Path of the database named by the `database` parameter.
+
+    Raises:
+        ValueError: If the parameter is missing.
+        LookupError: If it names no user database under the root.
+    """
+    name = params.get('database')
+    if not name:
+        raise ValueError("The database parameter is required.")
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root or not path.endswith('.db') or shards.is_shard(path) \
+            or not os.path.isfile(path):
+        raise LookupError(f"Unknown database {name}.")
+    return path
+
+
+def project_database(database_name, project_id):
+    # Looked up on disk rather than in the catalog, so that a poll answered with 304 opens no database
+    path = shards.shard_path(database_name, project_id)
+    return path if os.path.exists(path) else database_name
+
+
+def integer_param(params, name, default=None):
+    value = params.get(name, default)
+    if value is None:
+        raise ValueError(f"The {name} parameter is required.")
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"The {name} parameter must be an integer.") from None
+
+
+def records(table):
+    return [dict(zip(table.columns, row)) for row in table.rows]
+
+
+# ----------------------------------------------------------------------------------------------------
+# Routes
+# ----------------------------------------------------------------------------------------------------
+
+# Every route returns the databases its response depends on and a function rendering the response;
+# the function only runs when the ETag of those databases has no cached body yet.
+
+def databases_route(root, params):
+    names = list_databases(root)
+    return [os.path.join(root, name) for name in names], lambda: {'databases': names}
+
+
+def projects_route(root, params):
+    database_name = resolve_database(root, params)
+    return [database_name], lambda: {'projects': [asdict(project)
+                                                  for project in services.list_projects(database_name)]}
+
+
+def purchases_route(root, params):
+    database_name = resolve_database(root, params)
+    project_id = integer_param(params, 'project_id')
+    after = integer_param(params, 'after', 0)
+    limit = integer_param(params, 'limit', DEFAULT_PAGE_SIZE)
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"The limit parameter must be between 1 and {MAX_PAGE_SIZE}.")
+    project_db = project_database(database_name, project_id)
+
+    def render():
+        purchases = records(query_table(project_db, statement('api.purchases'), (project_id, after, limit)))
+        # Keyset paging: the next page starts after the last purchase of this one
+        next_after = purchases[-1]['purchase_id'] if len(purchases) == limit else None
+        return {'purchases': purchases, 'next_after': next_after}
+    return [project_db], render
+
+
+def stage_category_route(root, params):
+    database_name = resolve_database(root, params)
+    project_id = integer_param(params, 'project_id')
+    project_db = project_database(database_name, project_id)
+    return [project_db], lambda: {'rows': records(query_table(project_db, statement('api.stage_category'),
+                                                              (project_id,)))}
+
+
+def expenditure_route(root, params):
+    database_name = resolve_database(root, params)
+    project_id = integer_param(params, 'project_id')
+    by = params.get('by', 'category')
+    if by not in ('stage', 'category'):
+        raise ValueError("The by parameter must be stage or category.")
+    report = analytics.expenditure_by_stage if by == 'stage' else analytics.expenditure_by_category
+    project_db = project_database(database_name, project_id)
+    return [project_db], lambda: {'rows': records(report(project_db, project_id))}
+
+
+ROUTES = {
+    '/databases': databases_route,
+    '/projects': projects_route,
+    '/purchases': purchases_route,
+    '/reports/stage-category': stage_category_route,
+    '/reports/expenditure': expenditure_route,
+}
+
+
+# ----------------------------------------------------------------------------------------------------
+# ETags
+# ----------------------------------------------------------------------------------------------------
+
+_responses = OrderedDict()
+_responses_guard = threading.Lock()
+
+
+def entity_tag(path, params, database_names):
+    """ETag of a response: changes when the request or anything written to its databases changes."""
+    key = json.dumps([path, sorted(params.items()),
+                      [(os.path.basename(name), services.database_version(name)) for name in database_names]])
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def cached_response(etag, render):
+    """Body of the response with this ETag, rendered on the first request only."""
+    with _responses_guard:
+        body = _responses.get(etag)
+        if body is not None:
+            _responses.move_to_end(etag)
+            return body
+    body = json.dumps(render(), default=str).encode()
+    with _responses_guard:
+        _responses[etag] = body
+        while len(_responses) > MAX_CACHED_RESPONSES:
+            _responses.popitem(last=False)
+    return body
+
+
+def clear_cache():
+    with _responses_guard:
+        _responses.clear()
+
+
+# ----------------------------------------------------------------------------------------------------
+# Server
+# ----------------------------------------------------------------------------------------------------
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    server_version = 'ConsmanReadAPI/1.0'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        route = ROUTES.get(url.path.rstrip('/'))
+        if route is None:
+            return self.send_json(404, {'error': f"Unknown path {url.path}."})
+        if not self.authorized():
+            return self.send_json(401, {'error': "Missing or invalid token."})
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            with timed('api', url.path) as span:
+                database_names, render = route(self.server.root, params)
+                etag = entity_tag(url.path, params, database_names)
+                if matches(self.headers.get('If-None-Match'), etag):
+                    return self.send_json(304, None, etag)
+                body = cached_response(etag, render)
+                span['bytes'] = len(body)
+            self.send_json(200, body, etag)
+        except LookupError as e:
+            self.send_json(404, {'error': str(e)})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except sqlite3.Error as e:
+            print(f'Error log: {e}')
+            self.send_json(500, {'error': "The database could not be read."})
+        except OSError as e:
+            # e.g. the file was removed or replaced by a download after it was looked up
+            print(f'Error log: {e}')
+            self.send_json(503, {'error': "The database is not available."})
+
+    def authorized(self):
+        token = self.server.token
+        if not token:
+            return True
+        return hmac.compare_digest(self.headers.get('Authorization', ''), f'Bearer {token}')
+
+    def send_json(self, status, body, etag=None):
+        """Sends a JSON response; body is a serializable object or the already encoded bytes."""
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+            # Cached by clients, but always revalidated
+            self.send_header('Cache-Control', 'no-cache')
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+
+
+class ReadApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, token=None):
+        super().__init__(address, ReadApiHandler)
+        self.root = root
+        self.token = token
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=tenants.TENANT_ROOT, help='Directory of the user databases')
+    parser.add_argument('--host', default=API_HOST, help='Interface to listen on (local only by default)')
+    parser.add_argument('--port', type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+
+    server = ReadApiServer((args.host, args.port), args.root, API_TOKEN)
+    print(f"Serving {args.root} on http://{args.host}:{server.server_port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
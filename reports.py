@@ -0,0 +1,270 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import streamlit as st
+import pandas as pd
+from utils import format_currency, format_percentage
+from services import query_table
+# The pivots run on the analytics engine (DuckDB or the columnar cache) instead of re-aggregating in SQL
+from analytics import expenses_pivot_table, purchase_amounts_table
+from instrumentation import instrument
+
+# Columns shown as currency wherever a query result is displayed
+CURRENCY_COLUMNS = ['Purchase Amount', 'Paid Amount', 'Difference', 'Outstanding', 'Balance',
+                    '0-30 Days', '31-60 Days', '61-90 Days', 'Over 90 Days', 'Budget', 'Variance', 'Monthly Burn']
+
+
+# ----------------------------------------------------------------------------------------------------
+# Displaying query results
+# ----------------------------------------------------------------------------------------------------
+
+def display_table(table):
+    """Renders a services.Table as a dataframe with the amount columns formatted as currency."""
+    # Check if there are any results
+    if table.rows:
+        # Convert rows to a pandas DataFrame for better display
+        results_df = pd.DataFrame(table.rows, columns=table.columns)
+        # Check if 'Purchase Amount' column exists and apply formatting
+        for col in CURRENCY_COLUMNS:
+            if col in results_df.columns:
+                results_df[col] = results_df[col].apply(format_currency)
+
+        # Display the DataFrame in tabular format
+        st.dataframe(results_df)  # You can also use st.table(df) for a static table
+    else:
+        # Inform the user if no data was found
+        st.warning("No data found for the selected criteria.")
+
+
+@instrument('report')
+def fetch_and_display_data(query, database_name, params=()):
+    """
+    Execute the given SQL query, fetch the results, and display them in a Streamlit app.
+    Handles any SQL syntax errors and displays appropriate messages.
+
+    Args:
+        query (str): The SQL query to be executed.
+        :param query: SQL query
+        :param database_name: db file name
+        :param params: query parameters
+    """
+    try:
+        display_table(query_table(database_name, query, params))
+
+    except sqlite3.OperationalError:
+        # Catch and handle specific MySQL errors
+        st.warning("Please check if you've selected a valid project")
+
+    except Exception as e:
+        # Catch any other exceptions
+        st.error(f"An unexpected error occurred: {e}")
+
+
+# ----------------------------------------------------------------------------------------------------
+# Concurrent report panels
+# ----------------------------------------------------------------------------------------------------
+
+# Report queries run on a pool shared by every session; SQLite releases the GIL while it executes,
+# and in WAL mode the readers never wait for each other or for the data entry writer
+REPORT_WORKERS = int(os.environ.get('CONSMAN_REPORT_WORKERS', 4))
+_report_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix='report')
+
+
+def fetch_concurrently(fetches):
+    """Runs zero-argument fetch functions on the report pool and returns their results in order."""
+    futures = [_report_pool.submit(fetch) for fetch in fetches]
+    return [future.result() for future in futures]
+
+
+class ReportPanels:
+    """Panels whose data is fetched on the report pool and rendered as soon as it arrives.
+
+    Each panel gets its place on the page when it is added, and its query starts right away, so the
+    page keeps being built while the queries run. render() then fills the panels in the order their
+    queries finish: a slow report does not hold up the fast ones, and the page is complete after
+    roughly the slowest query rather than the sum of all of them.
+
+        panels = ReportPanels()
+        panels.add(lambda: services.vendor_payables(db_name, project_id), display_table)
+        ...
+        panels.render()
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, fetch, render):
+        """Queues a panel.
+
+        Args:
+            fetch: Runs on a worker thread, so it must not call Streamlit; e.g. a services function.
+            render: Called on the script thread with fetch's result to draw the panel.
+        """
+        placeholder = st.empty()
+        placeholder.caption("Loading...")
+        self.pending[_report_pool.submit(fetch)] = (placeholder, render)
+
+    def render(self):
+        for future in as_completed(self.pending):
+            placeholder, render = self.pending[future]
+            with placeholder.container():
+                try:
+                    render(future.result())
+                except ValueError as e:
+                    st.error(str(e))
+                except sqlite3.Error as err:
+                    st.error(f"Database Error: {err}")
+                except Exception as e:
+                    st.error(f"An unexpected error occurred: {e}")
+                    print(f'Error log: {e}')
+        self.pending = {}
+
+
+# ----------------------------------------------------------------------------------------------------
+# Overall Expenses report
+# ----------------------------------------------------------------------------------------------------
+
+@instrument('report')
+def expenses_pivot(database_name):
+    try:
+        table = expenses_pivot_table(database_name)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    except sqlite3.Error as err:
+        st.error(f"Database Error: {err}")
+        return
+
+    # Convert the results into a pandas DataFrame
+    df = pd.DataFrame(table.rows, columns=table.columns)
+
+    # Ensure numeric columns are correctly typed
+    for col in df.columns[1:]:  # All columns except 'stage'
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Create a copy for formatted display
+    formatted_df = df.copy()
+
+    # Format all numeric columns (except 'stage') as currency
+    for col in formatted_df.columns[1:-1]:  # All category columns (excluding Grand_Total)
+        formatted_df[col] = formatted_df[col].apply(format_currency)
+
+    grand_total_col = formatted_df.columns[-1]  # Get the last column name (Grand_Total)
+
+    # Change the dtype of the 'Grand_Total' column to 'object' to avoid dtype incompatibility warning
+    formatted_df[grand_total_col] = formatted_df[grand_total_col].astype('object')
+
+    for i in range(len(formatted_df) - 1):  # Loop through all rows except the last one
+        formatted_df.at[i, grand_total_col] = format_currency(df.at[i, grand_total_col])
+
+    # Format the last row (percentage row) correctly
+    last_row_index = formatted_df.index[-1]  # Index of the percentage row
+    for col in formatted_df.columns[1:]:  # All columns except 'stage'
+        if col != 'Stage':
+            raw_value = df.at[last_row_index, col]  # Get the raw numeric value
+            formatted_df.at[last_row_index, col] = format_percentage(raw_value)  # Format for display
+
+    # Highlight Total and Percentage rows
+    def highlight_rows(row):
+        if row['Stage'] == 'Total':
+            return ['background-color: #FF4B4B'] * len(row)
+        elif row['Stage'] == 'Percentage':
+            return ['background-color: #4B0082'] * len(row)
+        else:
+            return [''] * len(row)
+
+    # Apply highlighting
+    styled_df = formatted_df.style.apply(highlight_rows, axis=1)
+
+    # Display the styled DataFrame in Streamlit
+    st.dataframe(styled_df, use_container_width=True)
+
+
+@instrument('report')
+def purchase_amounts(database_name):
+    try:
+        table = purchase_amounts_table(database_name)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    except sqlite3.Error as err:
+        st.error(f"Database Error: {err}")
+        return
+    show_purchase_amounts(table)
+
+
+def show_purchase_amounts(table):
+    """Renders the purchase_amounts_table with its currency, percentage and highlighting formats."""
+    df = pd.DataFrame(table.rows, columns=table.columns)
+
+    # Ensure numeric columns are correctly typed
+    for col in df.columns[1:]:  # All columns except 'Category'
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Create a copy for formatted display
+    formatted_df = df.copy()
+
+    # Format all numeric columns (except 'Category') as currency
+    for col in formatted_df.columns[1:-2]:  # All columns except 'Category', 'Total', and 'Percentage'
+        formatted_df[col] = formatted_df[col].apply(format_currency)
+
+    # Format Total column
+    formatted_df['Total'] = formatted_df['Total'].apply(format_currency)
+
+    # Format Percentage column (ensure no currency formatting)
+    formatted_df['Percentage'] = formatted_df['Percentage'].apply(format_percentage)
+
+    grand_total_col = formatted_df.columns[-2]
+    # Change the dtype of the 'Grand_Total' column to 'object' to avoid dtype incompatibility warning
+    formatted_df[grand_total_col] = formatted_df[grand_total_col].astype('object')
+
+    for i in range(len(formatted_df) - 1):  # Loop through all rows except the last one
+        formatted_df.at[i, grand_total_col] = format_currency(df.at[i, grand_total_col])
+
+    # Format the last row (percentage row) correctly
+    last_row_index = formatted_df.index[-1]  # Index of the percentage row
+    for col in formatted_df.columns[1:]:  # All columns except 'stage'
+        if col != 'Stage':
+            raw_value = df.at[last_row_index, col]  # Get the raw numeric value
+            formatted_df.at[last_row_index, col] = format_percentage(raw_value)
+
+    def highlight_rows(row):
+        styles = [''] * len(row)
+
+        # Highlight entire row for Grand Total
+        if row['Category'] == 'Grand Total':
+            styles = ['background-color: #93c47d'] * len(row)  # Gold for Grand Total
+        # Highlight entire row for Percentage
+        elif row['Category'] == 'Percentage':
+            styles = ['background-color: #FF4B4B'] * len(row)  # Indigo for Percentage
+
+        return styles
+
+    def highlight_last_column(s):
+        # Create a default style
+        styles = pd.DataFrame('', index=s.index, columns=s.columns)
+
+        styles.iloc[:, -1] = 'background-color: #FF4B4B'
+        styles.iloc[:, -2] = 'background-color: #93c47d'
+        return styles
+
+    # Function to highlight the last value of the second-to-last column
+    def highlight_last_value(s):
+        # Create a default style DataFrame with empty strings
+        styles = pd.DataFrame('', index=s.index, columns=s.columns)
+
+        # Get the index of the last row
+        last_index_in_df = s.index[-1]
+
+        # Apply color to the last value of the second-to-last column
+        styles.iloc[last_index_in_df, -2] = 'background-color: #FF4B4B'  # Change color (Tomato)
+
+        return styles
+
+    # Apply row highlighting
+    styled_df = formatted_df.style.apply(highlight_rows, axis=1)
+    styled_df = styled_df.apply(highlight_last_column, axis=None)
+    styled_df = styled_df.apply(highlight_last_value, axis=None)
+
+    # Display the styled DataFrame in Streamlit
+    st.dataframe(styled_df, use_container_width=True)
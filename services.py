@@ -0,0 +1,1289 @@
+import os
+import sqlite3
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from dataclasses import dataclass, astuple
+import tenants
+from instrumentation import InstrumentedConnection
+from queries import (STATEMENT_CACHE_SIZE, statement, report_column, expenses_pivot_statement,
+                     expenses_pivot_params, purchase_amounts_statement)
+
+# Headless data access for projects, purchases, reports and Drive sync. Nothing in here
+# imports Streamlit or pandas: functions return plain results and raise on errors, and the
+# pages decide how to render them.
+
+
+# ----------------------------------------------------------------------------------------------------
+# Results
+# ----------------------------------------------------------------------------------------------------
+
+@dataclass
+class Project:
+    project_id: int
+    project_name: str
+    project_location: str = None
+
+    @property
+    def label(self):
+        """The "<id> - <name>" text used by the project select boxes."""
+        return f'{self.project_id} - {self.project_name}'
+
+
+@dataclass
+class Purchase:
+    project_id: int
+    item_name: str
+    item_qty: float
+    unit: str
+    vendor: str
+    stage: str
+    category: str
+    date: object
+    purchase_amount: float
+    mode_of_payment: str
+    paid_amount: float = 0
+    paid_by: str = None
+    notes: str = None
+
+
+@dataclass
+class ReferenceData:
+    categories: list
+    payment_modes: list
+    stages: list
+    vendors: list
+
+
+@dataclass
+class Table:
+    """Rows of a query or report together with their column names."""
+    columns: list
+    rows: list
+
+
+@dataclass
+class SyncResult:
+    file_id: str
+    created: bool = False
+
+
+@dataclass
+class VendorBalance:
+    vendor: str
+    purchased: float
+    paid: float
+    purchases: int
+
+    @property
+    def outstanding(self):
+        return self.purchased - self.paid
+
+
+@dataclass
+class BudgetStatus:
+    stage: str
+    category: str
+    budget: float
+    actual: float
+    paid: float
+    recent: float  # purchases of the last BURN_MONTHS months
+
+    @property
+    def variance(self):
+        """Budget left; negative once it is overspent."""
+        return self.budget - self.actual
+
+    @property
+    def used(self):
+        """Fraction of the budget spent so far."""
+        return self.actual / self.budget
+
+    @property
+    def burn_rate(self):
+        """Average purchases per month over the last BURN_MONTHS months."""
+        return self.recent / BURN_MONTHS
+
+    @property
+    def months_left(self):
+        """Months until the budget runs out at the current burn rate, or None if nothing is being spent."""
+        if self.burn_rate <= 0:
+            return None
+        return max(self.variance, 0) / self.burn_rate
+
+
+@dataclass
+class AuditEntry:
+    audit_id: int
+    table_name: str
+    row_id: int
+    action: str
+    changed_at: str
+    payload: str
+
+
+class SyncError(Exception):
+    """Raised when the database could not be transferred to or from Google Drive."""
+
+
+# ----------------------------------------------------------------------------------------------------
+# Connections
+# ----------------------------------------------------------------------------------------------------
+
+def connect_db(database_name):
+    # Every statement run through this connection is timed for the diagnostics page; the catalog
+    # statements are parameterized, so the compiled ones are reused from the statement cache
+    return sqlite3.connect(database_name, factory=InstrumentedConnection, cached_statements=STATEMENT_CACHE_SIZE)
+
+
+def connect_readonly(database_name, immutable=False):
+    """Connection for reports and listings, which can never write or take a write lock.
+
+    Writers (data entry, admin, sync) use their own connection from transaction(). In WAL mode a
+    reader sees the last commit made before its read started, and readers and the writer never
+    wait for each other.
+
+    Args:
+        immutable: The file cannot change while it is open (e.g. a synced snapshot), so SQLite skips
+            locking and the write-ahead log altogether.
+    """
+    uri = f"file:{pathname2url(os.path.abspath(database_name))}?{'immutable=1' if immutable else 'mode=ro'}"
+    conn = sqlite3.connect(uri, uri=True, isolation_level=None, factory=InstrumentedConnection,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+@contextmanager
+def reading(database_name, immutable=False):
+    """Yields a read-only connection (see connect_readonly) and always closes it."""
+    conn = connect_readonly(database_name, immutable)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def transaction(database_name):
+    """Yields a connection that is committed on success, rolled back on error and always closed."""
+    conn = connect_db(database_name)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def enable_wal(database_name):
+    """Switches the database to write-ahead logging (stored in the file, so it only changes once).
+
+    Report readers then never block the data entry writer, nor the writer them.
+    """
+    conn = connect_db(database_name)
+    try:
+        if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            conn.execute('PRAGMA journal_mode=WAL')
+    finally:
+        conn.close()
+
+
+def checkpoint(database_name):
+    """Copies the write-ahead log into the database file, so the file alone holds every commit (e.g. before it
+    is uploaded)."""
+    conn = connect_db(database_name)
+    try:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+
+def compact(database_name):
+    """Gives the free pages of the database back to the file system (e.g. after moving a project out of it).
+
+    Skipped when another connection keeps the database busy; the free pages are reused by the next
+    writes anyway.
+    """
+    conn = connect_db(database_name)
+    try:
+        conn.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        print(f'Error log: {e}')
+    finally:
+        conn.close()
+
+
+def replace_database_file(source_path, database_name):
+    """Moves a complete database file (e.g. a finished download) over the database in one step.
+
+    The old write-ahead log and shared memory files belong to the replaced file and are removed, or
+    SQLite would replay the old log on top of the new file.
+    """
+    os.replace(source_path, database_name)
+    for suffix in ('-wal', '-shm'):
+        try:
+            os.remove(f'{database_name}{suffix}')
+        except FileNotFoundError:
+            pass
+    database_replaced(database_name)
+
+
+# Bumped whenever a database file is replaced wholesale (e.g. downloaded), so caches built on it are rebuilt
+_generations = {}
+
+
+def database_generation(database_name):
+    return _generations.get(os.path.abspath(database_name), 0)
+
+
+def database_replaced(database_name):
+    key = os.path.abspath(database_name)
+    _generations[key] = _generations.get(key, 0) + 1
+
+
+def database_version(database_name):
+    """Modification time and size of the database file and its write-ahead log.
+
+    Changes as soon as anything writes to the database, and is read without opening it, so it keys
+    caches (utils.py) and ETags (read_api.py) at the cost of two stat calls. An empty log counts as
+    no log: the first reader after the last writer closed creates one without changing anything.
+    """
+    version = ()
+    for path in (database_name, f'{database_name}-wal'):
+        try:
+            stat = os.stat(path)
+            version += (stat.st_mtime_ns, stat.st_size) if stat.st_size else (0, 0)
+        except FileNotFoundError:
+            version += (0, 0)
+    return version
+
+
+def query_table(database_name, query, params=()):
+    with reading(database_name) as conn:
+        cursor = conn.execute(query, params)
+        rows = cursor.fetchall()
+        return Table([desc[0] for desc in cursor.description], rows)
+
+
+def query_column(database_name, query, params=()):
+    """First column of every row returned by the query."""
+    with reading(database_name) as conn:
+        return [row[0] for row in conn.execute(query, params).fetchall()]
+
+
+# ----------------------------------------------------------------------------------------------------
+# Schema
+# ----------------------------------------------------------------------------------------------------
+
+STAGES = [
+    ('STAGE-1', 'Basement'),
+    ('STAGE-2', 'Roof'),
+    ('STAGE-3', 'Masonry'),
+    ('STAGE-4', 'Finishes'),
+    ('STAGE-5', 'Site Work and Fixtures')
+]
+
+CATEGORIES = [
+    "General",
+    "Material",
+    "MEP Labour",
+    "Mason Labour",
+    "Misc Civil Labour",
+    "Paint Labour",
+    "Tiling Labour",
+    "Joinery"
+]
+
+MODES_OF_PAYMENT = [
+    "No Payment",
+    "UPI",
+    "Credit Card",
+    "Debit Card",
+    "Cash",
+    "Bank Transfer"
+]
+
+# Units a quantity may be entered in (lower case, trimmed) -> the unit prices are compared in and the
+# factor converting to it; quantities in any other unit ('Others', none) get no unit price
+UNIT_CONVERSIONS = {
+    'nos': ('Nos', 1),
+    'no': ('Nos', 1),
+    'pcs': ('Nos', 1),
+    'units': ('Units', 1),
+    'unit': ('Units', 1),
+    'mt': ('MT', 1),
+    'ton': ('MT', 1),
+    'tonne': ('MT', 1),
+    'kg': ('MT', 0.001),
+    'kgs': ('MT', 0.001),
+    'liters': ('Liters', 1),
+    'litres': ('Liters', 1),
+    'ltr': ('Liters', 1),
+    'l': ('Liters', 1),
+    'ml': ('Liters', 0.001),
+}
+
+
+PROJECT_COLUMNS = ['project_id', 'project_name', 'project_location', 'deleted_at']
+PURCHASE_COLUMNS = ['purchase_id', 'project_id', 'item_name', 'item_qty', 'unit', 'vendor', 'stage', 'category',
+                    'date', 'purchase_amount', 'mode_of_payment', 'paid_amount', 'paid_by', 'notes', 'deleted_at']
+ATTACHMENT_COLUMNS = ['attachment_id', 'purchase_id', 'sha256', 'file_name', 'added_at', 'deleted_at']
+BUDGET_COLUMNS = ['project_id', 'stage', 'category', 'amount']
+# Tables whose changes are appended to audit_log: their key and the columns of the payload
+AUDITED_TABLES = {
+    'projects': ('project_id', PROJECT_COLUMNS),
+    'purchases': ('purchase_id', PURCHASE_COLUMNS),
+    'attachments': ('attachment_id', ATTACHMENT_COLUMNS),
+    # Keyed by project, stage and category; the rowid stands in for the integer key
+    'budgets': ('rowid', BUDGET_COLUMNS),
+}
+
+
+def audit_triggers(table, key, columns):
+    """Triggers appending every insert, update, soft delete, restore and purge of the table to audit_log."""
+    payload = "json_object(" + ", ".join(f"'{column}', NEW.{column}" for column in columns) + ")"
+    now = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+    update_action = '''CASE
+                        WHEN OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL THEN 'delete'
+                        WHEN OLD.deleted_at IS NOT NULL AND NEW.deleted_at IS NULL THEN 'restore'
+                        ELSE 'update'
+                        END''' if 'deleted_at' in columns else "'update'"
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_audit_insert AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO audit_log (table_name, row_id, action, changed_at, payload)
+                VALUES ('{table}', NEW.{key}, 'insert', {now}, {payload});
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_audit_update AFTER UPDATE ON {table}
+            BEGIN
+                INSERT INTO audit_log (table_name, row_id, action, changed_at, payload)
+                VALUES ('{table}', NEW.{key},
+                        {update_action},
+                        {now}, {payload});
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_audit_purge AFTER DELETE ON {table}
+            BEGIN
+                INSERT INTO audit_log (table_name, row_id, action, changed_at, payload)
+                VALUES ('{table}', OLD.{key}, 'purge', {now}, NULL);
+            END''',
+    ]
+
+
+def ledger_triggers():
+    """Triggers keeping vendor_ledger (per vendor) and vendor_balances (per vendor and day) in step with the
+    live purchases, so payables are read from a handful of rows instead of re-aggregating every purchase."""
+    def apply(row, sign, condition):
+        # Adds (sign = +1) or removes (sign = -1) the row's amounts; runs only if the condition holds
+        return f'''
+            INSERT INTO vendor_ledger (project_id, vendor_key, vendor, purchased, paid, purchases)
+            SELECT {row}.project_id, lower(trim({row}.vendor)), trim({row}.vendor), {sign} * {row}.purchase_amount,
+                   {sign} * COALESCE({row}.paid_amount, 0), {sign}
+            WHERE {condition}
+            ON CONFLICT (project_id, vendor_key) DO UPDATE SET
+                vendor = CASE WHEN excluded.purchases > 0 THEN excluded.vendor ELSE vendor END,
+                purchased = purchased + excluded.purchased,
+                paid = paid + excluded.paid,
+                purchases = purchases + excluded.purchases;
+            INSERT INTO vendor_balances (project_id, vendor_key, date, purchased, paid)
+            SELECT {row}.project_id, lower(trim({row}.vendor)), {row}.date, {sign} * {row}.purchase_amount,
+                   {sign} * COALESCE({row}.paid_amount, 0)
+            WHERE {condition}
+            ON CONFLICT (project_id, vendor_key, date) DO UPDATE SET
+                purchased = purchased + excluded.purchased,
+                paid = paid + excluded.paid;'''
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_ledger_insert AFTER INSERT ON purchases
+            BEGIN {apply('NEW', 1, 'NEW.deleted_at IS NULL')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_ledger_update
+            AFTER UPDATE OF project_id, vendor, date, purchase_amount, paid_amount, deleted_at ON purchases
+            BEGIN {apply('OLD', -1, 'OLD.deleted_at IS NULL')}
+                  {apply('NEW', 1, 'NEW.deleted_at IS NULL')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_ledger_purge AFTER DELETE ON purchases
+            BEGIN {apply('OLD', -1, 'OLD.deleted_at IS NULL')}
+            END''',
+    ]
+
+
+def budget_triggers():
+    """Triggers keeping budget_actuals (per stage and category) and budget_burn (per stage, category and month)
+    in step with the live purchases, so a budget check reads a couple of rows whatever the size of the project."""
+    def apply(row, sign, condition):
+        return f'''
+            INSERT INTO budget_actuals (project_id, stage, category, purchased, paid, purchases)
+            SELECT {row}.project_id, {row}.stage, {row}.category, {sign} * {row}.purchase_amount,
+                   {sign} * COALESCE({row}.paid_amount, 0), {sign}
+            WHERE {condition}
+            ON CONFLICT (project_id, stage, category) DO UPDATE SET
+                purchased = purchased + excluded.purchased,
+                paid = paid + excluded.paid,
+                purchases = purchases + excluded.purchases;
+            INSERT INTO budget_burn (project_id, stage, category, month, purchased)
+            SELECT {row}.project_id, {row}.stage, {row}.category, substr({row}.date, 1, 7),
+                   {sign} * {row}.purchase_amount
+            WHERE {condition}
+            ON CONFLICT (project_id, stage, category, month) DO UPDATE SET
+                purchased = purchased + excluded.purchased;'''
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_budget_insert AFTER INSERT ON purchases
+            BEGIN {apply('NEW', 1, 'NEW.deleted_at IS NULL')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_budget_update
+            AFTER UPDATE OF project_id, stage, category, date, purchase_amount, paid_amount, deleted_at ON purchases
+            BEGIN {apply('OLD', -1, 'OLD.deleted_at IS NULL')}
+                  {apply('NEW', 1, 'NEW.deleted_at IS NULL')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_budget_purge AFTER DELETE ON purchases
+            BEGIN {apply('OLD', -1, 'OLD.deleted_at IS NULL')}
+            END''',
+    ]
+
+
+def price_triggers():
+    """Triggers keeping unit_prices (per item, unit, month, vendor and project) in step with the live purchases
+    that have a quantity in a known unit, so a price comparison reads the few rows of one item and period."""
+    def apply(row, sign, condition):
+        return f'''
+            INSERT INTO unit_prices (item_key, base_unit, month, vendor_key, project_id, item_name, vendor, quantity,
+                                     amount, purchases)
+            SELECT lower(trim({row}.item_name)), c.base_unit, substr({row}.date, 1, 7), lower(trim({row}.vendor)),
+                   {row}.project_id, trim({row}.item_name), trim({row}.vendor), {sign} * {row}.item_qty * c.factor,
+                   {sign} * {row}.purchase_amount, {sign}
+            FROM unit_conversions c
+            WHERE c.unit_key = lower(trim({row}.unit)) AND {row}.item_qty > 0 AND {row}.purchase_amount > 0
+                  AND {condition}
+            ON CONFLICT (item_key, base_unit, month, vendor_key, project_id) DO UPDATE SET
+                item_name = CASE WHEN excluded.purchases > 0 THEN excluded.item_name ELSE item_name END,
+                vendor = CASE WHEN excluded.purchases > 0 THEN excluded.vendor ELSE vendor END,
+                quantity = quantity + excluded.quantity,
+                amount = amount + excluded.amount,
+                purchases = purchases + excluded.purchases;'''
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_prices_insert AFTER INSERT ON purchases
+            BEGIN {apply('NEW', 1, 'NEW.deleted_at IS NULL')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_prices_update
+            AFTER UPDATE OF project_id, item_name, item_qty, unit, vendor, date, purchase_amount, deleted_at
+            ON purchases
+            BEGIN {apply('OLD', -1, 'OLD.deleted_at IS NULL')}
+                  {apply('NEW', 1, 'NEW.deleted_at IS NULL')}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS purchases_prices_purge AFTER DELETE ON purchases
+            BEGIN {apply('OLD', -1, 'OLD.deleted_at IS NULL')}
+            END''',
+    ]
+
+
+AUDIT_LOG_NO_DELETE = '''CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log
+                         BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END'''
+
+# Each entry upgrades the schema by one version; PRAGMA user_version records how many have been applied
+MIGRATIONS = [
+    # 1: soft-delete tombstones and the append-only audit log
+    [
+        'ALTER TABLE projects ADD COLUMN deleted_at TEXT',
+        'ALTER TABLE purchases ADD COLUMN deleted_at TEXT',
+        '''
+            CREATE TABLE IF NOT EXISTS "audit_log" (
+                "audit_id"	INTEGER,
+                "table_name"	TEXT NOT NULL,
+                "row_id"	INTEGER NOT NULL,
+                "action"	TEXT NOT NULL,
+                "changed_at"	TEXT NOT NULL,
+                "payload"	TEXT,
+                PRIMARY KEY("audit_id" AUTOINCREMENT)
+            );
+        ''',
+        '''CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log
+           BEGIN SELECT RAISE(ABORT, 'audit_log is append-only'); END''',
+        AUDIT_LOG_NO_DELETE,
+        *audit_triggers('projects', 'project_id', PROJECT_COLUMNS),
+        *audit_triggers('purchases', 'purchase_id', PURCHASE_COLUMNS),
+        'CREATE INDEX IF NOT EXISTS purchases_live_by_project ON purchases (project_id) WHERE deleted_at IS NULL',
+    ],
+    # 2: vendor payables ledger, backfilled from the existing purchases
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS "vendor_ledger" (
+                "project_id"	INTEGER NOT NULL,
+                "vendor_key"	TEXT NOT NULL,
+                "vendor"	TEXT NOT NULL,
+                "purchased"	REAL NOT NULL DEFAULT 0,
+                "paid"	REAL NOT NULL DEFAULT 0,
+                "purchases"	INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY("project_id", "vendor_key")
+            );
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS "vendor_balances" (
+                "project_id"	INTEGER NOT NULL,
+                "vendor_key"	TEXT NOT NULL,
+                "date"	TEXT NOT NULL,
+                "purchased"	REAL NOT NULL DEFAULT 0,
+                "paid"	REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY("project_id", "vendor_key", "date")
+            );
+        ''',
+        '''INSERT INTO vendor_ledger (project_id, vendor_key, vendor, purchased, paid, purchases)
+           SELECT project_id, lower(trim(vendor)), MAX(trim(vendor)), SUM(purchase_amount),
+                  SUM(COALESCE(paid_amount, 0)), COUNT(*)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, lower(trim(vendor))''',
+        '''INSERT INTO vendor_balances (project_id, vendor_key, date, purchased, paid)
+           SELECT project_id, lower(trim(vendor)), date, SUM(purchase_amount), SUM(COALESCE(paid_amount, 0))
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, lower(trim(vendor)), date''',
+        *ledger_triggers(),
+    ],
+    # 3: budgets per project, stage and category, with their actuals kept by triggers
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS "budgets" (
+                "project_id"	INTEGER NOT NULL,
+                "stage"	TEXT NOT NULL,
+                "category"	TEXT NOT NULL,
+                "amount"	REAL NOT NULL,
+                PRIMARY KEY("project_id", "stage", "category")
+            );
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS "budget_actuals" (
+                "project_id"	INTEGER NOT NULL,
+                "stage"	TEXT NOT NULL,
+                "category"	TEXT NOT NULL,
+                "purchased"	REAL NOT NULL DEFAULT 0,
+                "paid"	REAL NOT NULL DEFAULT 0,
+                "purchases"	INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY("project_id", "stage", "category")
+            );
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS "budget_burn" (
+                "project_id"	INTEGER NOT NULL,
+                "stage"	TEXT NOT NULL,
+                "category"	TEXT NOT NULL,
+                "month"	TEXT NOT NULL,
+                "purchased"	REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY("project_id", "stage", "category", "month")
+            );
+        ''',
+        '''INSERT INTO budget_actuals (project_id, stage, category, purchased, paid, purchases)
+           SELECT project_id, stage, category, SUM(purchase_amount), SUM(COALESCE(paid_amount, 0)), COUNT(*)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, stage, category''',
+        '''INSERT INTO budget_burn (project_id, stage, category, month, purchased)
+           SELECT project_id, stage, category, substr(date, 1, 7), SUM(purchase_amount)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, stage, category, substr(date, 1, 7)''',
+        *budget_triggers(),
+    ],
+    # 4: attachments linked to purchases; the files themselves live in a blob store outside the database
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS "blobs" (
+                "sha256"	TEXT NOT NULL,
+                "size"	INTEGER NOT NULL,
+                "mime_type"	TEXT,
+                "drive_file_id"	TEXT,
+                PRIMARY KEY("sha256")
+            );
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS "attachments" (
+                "attachment_id"	INTEGER,
+                "purchase_id"	INTEGER NOT NULL,
+                "sha256"	TEXT NOT NULL,
+                "file_name"	TEXT NOT NULL,
+                "added_at"	TEXT NOT NULL,
+                "deleted_at"	TEXT,
+                PRIMARY KEY("attachment_id" AUTOINCREMENT),
+                CONSTRAINT "purchase_fk" FOREIGN KEY("purchase_id") REFERENCES "purchases"("purchase_id"),
+                CONSTRAINT "blob_fk" FOREIGN KEY("sha256") REFERENCES "blobs"("sha256")
+            );
+        ''',
+        '''CREATE INDEX IF NOT EXISTS attachments_live_by_purchase ON attachments (purchase_id)
+           WHERE deleted_at IS NULL''',
+        'CREATE INDEX IF NOT EXISTS blobs_not_uploaded ON blobs (sha256) WHERE drive_file_id IS NULL',
+        *audit_triggers('attachments', 'attachment_id', ATTACHMENT_COLUMNS),
+    ],
+    # 5: archived projects; their rows are moved to an archive database (see archive.py), their totals stay
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS "archived_projects" (
+                "project_id"	INTEGER NOT NULL,
+                "project_name"	TEXT NOT NULL,
+                "project_location"	TEXT,
+                "archived_at"	TEXT NOT NULL,
+                "sha256"	TEXT NOT NULL,
+                PRIMARY KEY("project_id"),
+                CONSTRAINT "blob_fk" FOREIGN KEY("sha256") REFERENCES "blobs"("sha256")
+            );
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS "archive_totals" (
+                "project_id"	INTEGER NOT NULL,
+                "stage"	TEXT NOT NULL,
+                "category"	TEXT NOT NULL,
+                "vendor"	TEXT NOT NULL,
+                "purchased"	REAL NOT NULL DEFAULT 0,
+                "paid"	REAL NOT NULL DEFAULT 0,
+                "purchases"	INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY("project_id", "stage", "category", "vendor")
+            );
+        ''',
+    ],
+    # 6: projects whose rows live in a database file of their own (see shards.py)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS "project_shards" (
+                "project_id"	INTEGER NOT NULL,
+                "created_at"	TEXT NOT NULL,
+                PRIMARY KEY("project_id")
+            );
+        ''',
+    ],
+    # 7: blocking key of the duplicate check (see duplicates.py)
+    [
+        '''CREATE INDEX IF NOT EXISTS purchases_duplicate_key
+           ON purchases (project_id, lower(trim(vendor)), purchase_amount, date) WHERE deleted_at IS NULL''',
+    ],
+    # 8: unit prices per item, unit, month, vendor and project, kept by triggers (see prices.py)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS "unit_conversions" (
+                "unit_key"	TEXT NOT NULL,
+                "base_unit"	TEXT NOT NULL,
+                "factor"	REAL NOT NULL,
+                PRIMARY KEY("unit_key")
+            );
+        ''',
+        'INSERT OR IGNORE INTO unit_conversions (unit_key, base_unit, factor) VALUES ' + ', '.join(
+            f"('{unit}', '{base_unit}', {factor!r})" for unit, (base_unit, factor) in UNIT_CONVERSIONS.items()),
+        '''
+            CREATE TABLE IF NOT EXISTS "unit_prices" (
+                "item_key"	TEXT NOT NULL,
+                "base_unit"	TEXT NOT NULL,
+                "month"	TEXT NOT NULL,
+                "vendor_key"	TEXT NOT NULL,
+                "project_id"	INTEGER NOT NULL,
+                "item_name"	TEXT NOT NULL,
+                "vendor"	TEXT NOT NULL,
+                "quantity"	REAL NOT NULL DEFAULT 0,
+                "amount"	REAL NOT NULL DEFAULT 0,
+                "purchases"	INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY("item_key", "base_unit", "month", "vendor_key", "project_id")
+            );
+        ''',
+        '''INSERT INTO unit_prices (item_key, base_unit, month, vendor_key, project_id, item_name, vendor, quantity,
+                                   amount, purchases)
+           SELECT lower(trim(p.item_name)), c.base_unit, substr(p.date, 1, 7), lower(trim(p.vendor)), p.project_id,
+                  MAX(trim(p.item_name)), MAX(trim(p.vendor)), SUM(p.item_qty * c.factor), SUM(p.purchase_amount),
+                  COUNT(*)
+           FROM purchases p
+           JOIN unit_conversions c ON c.unit_key = lower(trim(p.unit))
+           WHERE p.deleted_at IS NULL AND p.item_qty > 0 AND p.purchase_amount > 0
+           GROUP BY lower(trim(p.item_name)), c.base_unit, substr(p.date, 1, 7), lower(trim(p.vendor)), p.project_id''',
+        *price_triggers(),
+    ],
+    # 9: budget changes in the audit log, so the outbox uploads them like any other change
+    [
+        *audit_triggers('budgets', 'rowid', BUDGET_COLUMNS),
+    ],
+]
+
+
+def migrate_schema(conn):
+    """Applies the migrations the database has not seen yet, all in the caller's transaction."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+    if not conn.in_transaction:
+        # DDL does not open a transaction implicitly; a half applied migration must roll back
+        conn.execute('BEGIN')
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for sql in statements:
+            conn.execute(sql)
+        conn.execute(f'PRAGMA user_version = {number:d}')
+
+
+def has_schema(database_name):
+    """Whether the file exists and has tables; a first login opens an empty file before the database is created."""
+    if not os.path.exists(database_name):
+        return False
+    with reading(database_name) as conn:
+        return conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchone() is not None
+
+
+def upgrade_schema(database_name):
+    """Brings an existing database file (e.g. one just downloaded from Drive) up to the current schema."""
+    with transaction(database_name) as conn:
+        migrate_schema(conn)
+    enable_wal(database_name)
+
+
+def create_schema(database_name):
+    """Creates the tables and reference rows if they do not exist yet."""
+    with transaction(database_name) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "projects" (
+                "project_id"	INTEGER,
+                "project_name"	TEXT NOT NULL,
+                "project_location"	TEXT,
+                PRIMARY KEY("project_id" AUTOINCREMENT)
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "purchases" (
+                "purchase_id"	INTEGER,
+                "project_id"	INTEGER NOT NULL,
+                "item_name"	TEXT NOT NULL,
+                "item_qty"	REAL,
+                "unit"	TEXT,
+                "vendor"	TEXT NOT NULL,
+                "stage"	TEXT NOT NULL,
+                "category"	TEXT NOT NULL,
+                "date"	TEXT NOT NULL,
+                "purchase_amount"	REAL NOT NULL,
+                "mode_of_payment"	TEXT NOT NULL,
+                "paid_amount"	REAL,
+                "paid_by"	TEXT,
+                "notes"	TEXT,
+                PRIMARY KEY("purchase_id" AUTOINCREMENT),
+                CONSTRAINT "project_fk" FOREIGN KEY("project_id") REFERENCES "projects"("project_id")
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "stages" (
+                "stage_id"	TEXT NOT NULL,
+                "stage"	TEXT NOT NULL
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "category" (
+                "category"	TEXT
+            );
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "mode_of_payment" (
+                "mode_of_payment"	TEXT
+            );
+        ''')
+
+        for stage_id, stage_name in STAGES:
+            cursor.execute('''
+                INSERT INTO stages (stage_id, stage)
+                SELECT ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM stages WHERE stage_id = ? OR stage = ?)
+            ''', (stage_id, stage_name, stage_id, stage_name))
+
+        for category in CATEGORIES:
+            cursor.execute('''
+                INSERT INTO category (category)
+                SELECT ?
+                WHERE NOT EXISTS (SELECT 1 FROM category WHERE category = ?)
+            ''', (category, category))
+
+        for mode_of_payment in MODES_OF_PAYMENT:
+            cursor.execute('''
+                INSERT INTO mode_of_payment (mode_of_payment)
+                SELECT ?
+                WHERE NOT EXISTS (SELECT 1 FROM mode_of_payment WHERE mode_of_payment = ?)
+            ''', (mode_of_payment, mode_of_payment))
+
+        migrate_schema(conn)
+    enable_wal(database_name)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Projects
+# ----------------------------------------------------------------------------------------------------
+
+def list_projects(database_name):
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('projects.list')).fetchall()
+    return [Project(*row) for row in rows]
+
+
+def get_project(database_name, project_id):
+    with reading(database_name) as conn:
+        row = conn.execute(statement('projects.get'), (project_id,)).fetchone()
+    return Project(*row) if row else None
+
+
+def create_project(database_name, project_name, project_location):
+    """Creates a new project and returns its id."""
+    if not project_name:
+        raise ValueError('Please enter the project name')
+    with transaction(database_name) as conn:
+        cursor = conn.execute(statement('projects.insert'), (project_name, project_location))
+        return cursor.lastrowid
+
+
+def update_project(database_name, project_id, project_name, project_location):
+    with transaction(database_name) as conn:
+        conn.execute(statement('projects.update'), (project_name, project_location, project_id))
+
+
+def deletion_timestamp():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+def delete_project(database_name, project_id):
+    """Soft-deletes a project together with its purchases, in one transaction.
+
+    Returns:
+        int: Number of purchases deleted with the project.
+    """
+    deleted_at = deletion_timestamp()
+    with transaction(database_name) as conn:
+        conn.execute(statement('projects.soft_delete'), (deleted_at, project_id))
+        return conn.execute(statement('purchases.soft_delete_by_project'), (deleted_at, project_id)).rowcount
+
+
+# Copied into the new database, then purged from the old one, when a project moves (archive.py, shards.py)
+PROJECT_COPY_STATEMENTS = ('project_copy.project', 'project_copy.purchases', 'project_copy.budgets',
+                           'project_copy.blobs', 'project_copy.attachments', 'project_copy.audit_log')
+PROJECT_PURGE_STATEMENTS = ('project_copy.purge_attachments', 'project_copy.purge_purchases',
+                            'project_copy.purge_budgets', 'project_copy.purge_vendor_ledger',
+                            'project_copy.purge_vendor_balances', 'project_copy.purge_budget_actuals',
+                            'project_copy.purge_budget_burn', 'project_copy.purge_unit_prices')
+
+
+def copy_project(database_name, target_name, project_id):
+    """Copies a project with its purchases, attachment links, budgets and audit history into another database.
+
+    The target must have the app schema (create_schema) and must not hold the project yet. Its audit
+    triggers are suspended during the copy, so the copied history is not recorded a second time.
+    """
+    conn = connect_db(target_name)
+    try:
+        conn.execute('ATTACH DATABASE ? AS live', (database_name,))
+        # One transaction, so a failed copy also rolls back the dropped triggers: a target left
+        # without them would keep its later changes out of audit_log, unseen by the outbox
+        with conn:
+            conn.execute('BEGIN')
+            for table in AUDITED_TABLES:
+                for action in ('insert', 'update', 'purge'):
+                    conn.execute(f'DROP TRIGGER IF EXISTS {table}_audit_{action}')
+            for name in PROJECT_COPY_STATEMENTS:
+                conn.execute(statement(name), (project_id,))
+            for table, (key, columns) in AUDITED_TABLES.items():
+                for sql in audit_triggers(table, key, columns):
+                    conn.execute(sql)
+        conn.execute('DETACH DATABASE live')
+    finally:
+        conn.close()
+
+
+def purge_project_rows(conn, project_id):
+    """Deletes what copy_project copied, except the project row, in the caller's transaction.
+
+    This is the one place entries leave audit_log: only the history of the purged rows, which went
+    with the copy. The purge entries written meanwhile stay, so the outbox and the report caches
+    (which follow the log past their own position) still see the rows go.
+    """
+    conn.execute('DROP TRIGGER audit_log_no_delete')
+    conn.execute(statement('project_copy.purge_audit_log'), (project_id,))
+    conn.execute(AUDIT_LOG_NO_DELETE)
+    for name in PROJECT_PURGE_STATEMENTS:
+        conn.execute(statement(name), (project_id,))
+
+
+def reference_data(database_name):
+    """Option lists of the data entry form."""
+    with reading(database_name) as conn:
+        def column(name):
+            return [row[0] for row in conn.execute(statement(name)).fetchall()]
+        return ReferenceData(
+            categories=column('reference.categories'),
+            payment_modes=column('reference.payment_modes'),
+            stages=column('reference.stages'),
+            vendors=column('reference.vendors'),
+        )
+
+
+# ----------------------------------------------------------------------------------------------------
+# Purchases
+# ----------------------------------------------------------------------------------------------------
+
+INSERT_PURCHASE = statement('purchases.insert')
+
+
+def validate_purchase(purchase):
+    """Returns the reasons a purchase cannot be saved (an empty list when it is valid)."""
+    errors = []
+    required_fields = [purchase.item_name, purchase.vendor, purchase.mode_of_payment, purchase.category,
+                       purchase.stage, purchase.date]
+    if not all(required_fields):
+        errors.append("All fields are mandatory! Please fill in all fields.")
+    if not (purchase.purchase_amount != 0 or (purchase.paid_amount or 0) > 0):
+        errors.append("Enter a purchase amount or a paid amount.")
+    return errors
+
+
+def purchase_values(purchase):
+    values = list(astuple(purchase))
+    # Dates are stored as ISO text, whichever date type the caller passes
+    if hasattr(values[7], 'isoformat'):
+        values[7] = values[7].isoformat()
+    return tuple(values)
+
+
+def add_purchase(database_name, purchase):
+    """Validates and inserts one purchase; returns the new purchase id."""
+    errors = validate_purchase(purchase)
+    if errors:
+        raise ValueError(errors[0])
+    with transaction(database_name) as conn:
+        return conn.execute(INSERT_PURCHASE, purchase_values(purchase)).lastrowid
+
+
+def validate_purchases(purchases):
+    """Validates a batch of purchases; returns {position in the batch: reasons} for the invalid ones."""
+    errors = {}
+    for index, purchase in enumerate(purchases):
+        purchase_errors = validate_purchase(purchase)
+        if purchase_errors:
+            errors[index] = purchase_errors
+    return errors
+
+
+def add_purchases(database_name, purchases):
+    """Validates and inserts a batch of purchases (e.g. the line items of one invoice) in one transaction.
+
+    Either every purchase is saved or none is: nothing is written if any of them is invalid.
+
+    Returns:
+        int: Number of purchases inserted.
+    """
+    if not purchases:
+        raise ValueError("Please add at least one line item.")
+    errors = validate_purchases(purchases)
+    if errors:
+        raise ValueError("; ".join(f"Row {index + 1}: {reasons[0]}" for index, reasons in errors.items()))
+    with transaction(database_name) as conn:
+        conn.executemany(INSERT_PURCHASE, [purchase_values(purchase) for purchase in purchases])
+    return len(purchases)
+
+
+def list_purchase_ids(database_name, project_id):
+    return query_column(database_name, statement('purchases.ids'), (project_id,))
+
+
+def list_deleted_purchase_ids(database_name, project_id):
+    return query_column(database_name, statement('purchases.deleted_ids'), (project_id,))
+
+
+def purchase_details(database_name, purchase_id):
+    return query_table(database_name, statement('purchases.get'), (purchase_id,))
+
+
+def delete_purchases(database_name, purchase_ids):
+    """Soft-deletes the given purchases in one transaction; returns how many were deleted."""
+    deleted_at = deletion_timestamp()
+    with transaction(database_name) as conn:
+        return conn.executemany(statement('purchases.soft_delete'),
+                                [(deleted_at, purchase_id) for purchase_id in purchase_ids]).rowcount
+
+
+def restore_purchases(database_name, purchase_ids):
+    """Undoes the soft delete of the given purchases; returns how many were restored."""
+    with transaction(database_name) as conn:
+        return conn.executemany(statement('purchases.restore'),
+                                [(purchase_id,) for purchase_id in purchase_ids]).rowcount
+
+
+def latest_audit_id(database_name):
+    with reading(database_name) as conn:
+        return conn.execute(statement('audit.latest_id')).fetchone()[0]
+
+
+def count_audit_entries(database_name, after_id=0):
+    with reading(database_name) as conn:
+        return conn.execute(statement('audit.count_since'), (after_id,)).fetchone()[0]
+
+
+def audit_entries(database_name, after_id=0, limit=1000):
+    """Audit log entries with an id greater than after_id, oldest first.
+
+    A sync process ships the log incrementally by passing the last audit_id it has seen.
+    """
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('audit.since'), (after_id, limit)).fetchall()
+    return [AuditEntry(*row) for row in rows]
+
+
+# ----------------------------------------------------------------------------------------------------
+# Vendor ledger
+# ----------------------------------------------------------------------------------------------------
+
+def vendor_balances(database_name, project_id):
+    """Purchased, paid and outstanding amounts of every vendor of the project, largest outstanding first."""
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('ledger.balances'), (project_id,)).fetchall()
+    return [VendorBalance(*row) for row in rows]
+
+
+def vendor_payables(database_name, project_id):
+    """Vendor balances as a report table."""
+    return Table(['Vendor', 'Purchases', 'Purchase Amount', 'Paid Amount', 'Outstanding'],
+                 [(balance.vendor, balance.purchases, balance.purchased, balance.paid, balance.outstanding)
+                  for balance in vendor_balances(database_name, project_id)])
+
+
+def vendor_aging(database_name, project_id, as_of=None):
+    """Outstanding amount of every vendor split by the age of the purchases (days before as_of, default today)."""
+    as_of = (as_of or datetime.now().date()).isoformat()
+    return query_table(database_name, statement('ledger.aging'), (as_of,) * 4 + (project_id,))
+
+
+def vendor_statement(database_name, project_id, vendor):
+    """Day by day purchases and payments of one vendor with the running outstanding balance."""
+    return query_table(database_name, statement('ledger.statement'), (project_id, vendor))
+
+
+# ----------------------------------------------------------------------------------------------------
+# Budgets
+# ----------------------------------------------------------------------------------------------------
+
+# The burn rate is the average monthly purchases over this many months, the current one included
+BURN_MONTHS = 3
+# Share of a budget spent at which data entry starts warning
+BUDGET_WARNING = 0.9
+
+
+def burn_window(as_of=None):
+    """First and last month ('YYYY-MM') of the burn rate window ending in the month of as_of (default today)."""
+    as_of = as_of or datetime.now().date()
+    months = as_of.year * 12 + as_of.month - 1 - (BURN_MONTHS - 1)
+    return f'{months // 12:04d}-{months % 12 + 1:02d}', f'{as_of.year:04d}-{as_of.month:02d}'
+
+
+def set_budget(database_name, project_id, stage, category, amount):
+    """Sets the budget of a stage and category of the project; an empty or zero amount removes it."""
+    if amount is not None and amount < 0:
+        raise ValueError("The budget cannot be negative.")
+    with transaction(database_name) as conn:
+        if amount:
+            conn.execute(statement('budgets.upsert'), (project_id, stage, category, amount))
+        else:
+            conn.execute(statement('budgets.delete'), (project_id, stage, category))
+
+
+def budget_status(database_name, project_id, stage, category, as_of=None):
+    """Budget, actuals and burn rate of one stage and category, or None if it has no budget.
+
+    Reads the budget row, its running actuals and at most BURN_MONTHS monthly rows, so it costs
+    the same on every submit however many purchases the project has.
+    """
+    with reading(database_name) as conn:
+        row = conn.execute(statement('budgets.status'),
+                           burn_window(as_of) + (project_id, stage, category)).fetchone()
+    return BudgetStatus(*row) if row else None
+
+
+def budget_statuses(database_name, project_id, as_of=None):
+    with reading(database_name) as conn:
+        rows = conn.execute(statement('budgets.project'), burn_window(as_of) + (project_id,)).fetchall()
+    return [BudgetStatus(*row) for row in rows]
+
+
+def budget_alerts(database_name, project_id, stages_and_categories, as_of=None):
+    """Budgets among the given (stage, category) pairs that have reached BUDGET_WARNING."""
+    alerts = []
+    for stage, category in dict.fromkeys(stages_and_categories):
+        status = budget_status(database_name, project_id, stage, category, as_of)
+        if status and status.used >= BUDGET_WARNING:
+            alerts.append(status)
+    return alerts
+
+
+def budget_variance(database_name, project_id, as_of=None):
+    """Budget against actual purchases of every budgeted stage and category, as a report table."""
+    return Table(['Stage', 'Category', 'Budget', 'Purchase Amount', 'Paid Amount', 'Variance', 'Used %',
+                  'Monthly Burn', 'Months Left'],
+                 [(status.stage, status.category, status.budget, status.actual, status.paid, status.variance,
+                   round(status.used * 100, 2), round(status.burn_rate, 2),
+                   None if status.months_left is None else round(status.months_left, 1))
+                  for status in budget_statuses(database_name, project_id, as_of)])
+
+
+# ----------------------------------------------------------------------------------------------------
+# Reports
+# ----------------------------------------------------------------------------------------------------
+
+def view_purchases(database_name, project_id):
+    return query_table(database_name, statement('reports.view_purchases'), (project_id,))
+
+
+def distinct_column_values(database_name, column):
+    """Distinct values of a REPORT_COLUMNS column; raises ValueError for any other column."""
+    return query_column(database_name, statement(f'reports.distinct_{report_column(column)}'))
+
+
+def purchase_data_by_column(database_name, column, selected_item, project_id):
+    return query_table(database_name, statement(f'reports.purchases_by_{report_column(column)}'),
+                       (selected_item, project_id))
+
+
+def expenditure_by_category(database_name, project_id):
+    return query_table(database_name, statement('reports.expenditure_by_category'), (project_id,))
+
+
+def expenditure_by_stage(database_name, project_id):
+    return query_table(database_name, statement('reports.expenditure_by_stage'), (project_id,))
+
+
+def expenses_pivot_table(database_name):
+    """Stage x Category purchase amounts with a Total row and a Percentage row."""
+    with reading(database_name) as conn:
+        categories = [row[0] for row in conn.execute(statement('reference.categories')).fetchall()]
+
+        # Check if categories exist
+        if not categories:
+            raise ValueError("No categories found.")
+
+        # The grand total is bound into the percentage row
+        grand_total = conn.execute(statement('purchases.grand_total')).fetchone()[0]
+
+        cursor = conn.execute(expenses_pivot_statement(categories), expenses_pivot_params(categories, grand_total))
+        results = cursor.fetchall()
+
+        if not results:
+            raise ValueError("No results found for the query.")
+        return Table([desc[0] for desc in cursor.description], results)
+
+
+def purchase_amounts_table(database_name, project_id=None):
+    """Category x Stage purchase amounts with Total and Percentage columns and Grand Total / Percentage rows.
+
+    Args:
+        project_id: Optional; the project to report on. Defaults to every project of the database.
+    """
+    with reading(database_name) as conn:
+        categories_list = [row[0] for row in conn.execute(statement('reference.categories')).fetchall()]
+        stages_list = [row[0] for row in conn.execute(statement('reference.stages')).fetchall()]
+
+        # Check if categories or stages exist
+        if not categories_list or not stages_list:
+            raise ValueError("No categories or stages found.")
+
+        # Purchase amounts per category and stage
+        rows = conn.execute(purchase_amounts_statement(stages_list), [*stages_list, project_id, project_id]).fetchall()
+        amounts = {row[0]: list(row[1:]) for row in rows}
+
+    # Ensure all categories are included, even if they have no purchases
+    rows = [[category] + amounts.get(category, [0] * (len(stages_list) + 1)) for category in categories_list]
+
+    # Grand total for each stage (column total)
+    grand_total_row = ['Grand Total'] + [sum(row[i] for row in rows) for i in range(1, len(stages_list) + 2)]
+    rows.append(grand_total_row)
+    grand_total = grand_total_row[-1]
+
+    # Percentage of each category based on the grand total
+    for row in rows:
+        row.append(round(row[-1] / grand_total * 100, 2) if grand_total > 0 else 0)
+
+    # Percentage of each stage (column percentage)
+    rows.append(['Percentage'] + [
+        round(grand_total_row[i] / grand_total * 100, 2) if grand_total > 0 else 0
+        for i in range(1, len(stages_list) + 1)
+    ] + [100, None])
+
+    return Table(['Category'] + stages_list + ['Total', 'Percentage'], [tuple(row) for row in rows])
+
+
+# ----------------------------------------------------------------------------------------------------
+# Google Drive sync
+# ----------------------------------------------------------------------------------------------------
+
+def find_remote_database(service, db_name, user_email=None):
+    """Returns the Drive file id of the database, or None if it was never uploaded.
+
+    On Drive the database is named after its tenant as well (tenants.remote_name). Given the user,
+    a copy saved by an older version under the bare file name and shared with them is adopted:
+    it is copied to the new name, and left for any other user it was shared with.
+    """
+    from connection_utils import check_existing_file, DRIVE_ERRORS
+    try:
+        file_id = check_existing_file(service, tenants.remote_name(db_name))
+        if file_id is None and user_email and tenants.remote_name(db_name) != os.path.basename(db_name):
+            file_id = adopt_legacy_database(service, db_name, user_email)
+        return file_id
+    except DRIVE_ERRORS as e:
+        raise SyncError(f"An error occurred while checking for existing files: {e}") from e
+
+
+def adopt_legacy_database(service, db_name, user_email):
+    """Copies the user's Drive file named <file name> to its tenant name; returns the copy's id, or None."""
+    from connection_utils import find_files, granted_permission, copy_file, share_file_with_user
+    for legacy_id in find_files(service, os.path.basename(db_name)):
+        # Users with the same email local part shared that name: the file is the one shared with this user
+        if granted_permission(service, legacy_id, user_email):
+            file_id = copy_file(service, legacy_id, tenants.remote_name(db_name))
+            share_file_with_user(service, file_id, user_email)
+            return file_id
+    return None
+
+
+def remote_modified_at(service, file_id):
+    """Seconds since the epoch at which the Drive copy of the database last changed."""
+    from connection_utils import get_modified_time, DRIVE_ERRORS
+    try:
+        return get_modified_time(service, file_id)
+    except DRIVE_ERRORS as e:
+        raise SyncError(f"An error occurred while checking the Drive copy: {e}") from e
+
+
+def download_database(service, file_id, db_name, progress_callback=None):
+    from connection_utils import download_db_from_drive, DRIVE_ERRORS
+    try:
+        # Readers keep seeing the old file until the download is complete
+        download_db_from_drive(service, file_id, f'{db_name}.download', progress_callback)
+    except DRIVE_ERRORS as e:
+        raise SyncError(f"An error occurred during download: {e}") from e
+    replace_database_file(f'{db_name}.download', db_name)
+    # Files saved by an older version of the app are migrated on arrival
+    upgrade_schema(db_name)
+    return SyncResult(file_id)
+
+
+def create_remote_database(service, db_name, user_email):
+    """Creates a fresh local database, uploads it and shares it with the user."""
+    from connection_utils import upload_db_to_drive, share_file_with_user, DRIVE_ERRORS
+    create_schema(db_name)
+    checkpoint(db_name)
+    try:
+        file_id = upload_db_to_drive(service, tenants.remote_name(db_name), None, source_path=db_name)
+        share_file_with_user(service, file_id, user_email)
+    except DRIVE_ERRORS as e:
+        raise SyncError(f"An error occurred during upload: {e}") from e
+    return SyncResult(file_id, created=True)
+
+
+def save_database(service, db_name, user_email, source_path=None):
+    """Uploads the local database over its Drive copy and keeps it shared with the user.
+
+    Args:
+        source_path: Optional; snapshot of the database to upload instead of the live file.
+    """
+    from connection_utils import upload_db_to_drive, share_file_with_user, DRIVE_ERRORS, HttpError
+    file_id = find_remote_database(service, db_name, user_email)
+    if not file_id:
+        raise SyncError('Error while saving the file')
+    if source_path is None:
+        # Commits still in the write-ahead log would be missing from the uploaded file
+        checkpoint(db_name)
+    try:
+        result_id = upload_db_to_drive(service, tenants.remote_name(db_name), file_id, source_path or db_name)
+        share_file_with_user(service, result_id, user_email)
+    except DRIVE_ERRORS as e:
+        if isinstance(e, HttpError) and e.resp.status == 404:
+            raise SyncError("File not found. Please check the file ID.") from e
+        raise SyncError(f"An error occurred during upload: {e}") from e
+    return SyncResult(result_id)
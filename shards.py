@@ -0,0 +1,204 @@
+"""One database file per project, with the user's database as the catalog of their projects.
+
+In the sharded layout (CONSMAN_STORAGE=sharded) the user's database (`<name>.db`) keeps the
+projects, the reference lists and the archived projects, while the purchases, attachment links,
+budgets, vendor ledger and audit history of each project live in a database of their own,
+`<name>.project-<id>.db`, next to it and on Drive. A shard has the schema of the app and a copy
+of its project row, so every per-project form and report runs on it unchanged: the pages pass
+project_database() where they passed the user's database.
+
+Every shard has its own outbox and replayer, so saving a purchase uploads that project's file
+only, and the writers of one project never wait for another's. A shard is downloaded the first
+time its project is opened on a device (open_project). Projects created before the switch move to
+their shards at the next login (split_database). The vendors offered by the entry form are then
+those of the project.
+
+The layout is chosen per deployment: once a database is split, versions of the app without
+shards see its projects without their purchases.
+"""
+import os
+import re
+import glob
+from datetime import datetime, timezone
+import services
+import outbox
+import tenants
+from services import SyncError, transaction, reading
+from queries import statement
+
+STORAGE = os.environ.get('CONSMAN_STORAGE', 'single')
+SHARD_NAME = re.compile(r'\.project-\d+\.db$')
+
+
+def enabled():
+    return STORAGE == 'sharded'
+
+
+# ----------------------------------------------------------------------------------------------------
+# Locating projects
+# ----------------------------------------------------------------------------------------------------
+
+def shard_path(database_name, project_id):
+    """<name>.project-<id>.db next to the catalog; on Drive it is named after the tenant too (tenants.remote_name)."""
+    return f'{os.path.splitext(database_name)[0]}.project-{int(project_id)}.db'
+
+
+def is_shard(path):
+    """True for the file of a project, as opposed to a user's database."""
+    return SHARD_NAME.search(path) is not None
+
+
+def local_shards(database_name):
+    """Paths of the shards of the database that are on this device, found next to it rather than in the catalog."""
+    pattern = f'{glob.escape(os.path.splitext(database_name)[0])}.project-*.db'
+    return sorted(path for path in glob.glob(pattern) if is_shard(path))
+
+
+def sharded_projects(database_name):
+    return services.query_column(database_name, statement('shards.list'))
+
+
+def project_database(database_name, project_id):
+    """The database holding the purchases of the project: its shard, or the catalog for a project never split."""
+    with reading(database_name) as conn:
+        sharded = conn.execute(statement('shards.get'), (project_id,)).fetchone()
+    return shard_path(database_name, project_id) if sharded else database_name
+
+
+def remove_local(path):
+    """Deletes a shard and its sync state from this device (its Drive copy is left alone)."""
+    outbox.stop_replayer(path, wait=False)
+    for file_name in (path, f'{path}-wal', f'{path}-shm', outbox.outbox_path(path), outbox.synced_snapshot_path(path)):
+        try:
+            os.remove(file_name)
+        except FileNotFoundError:
+            pass
+    services.database_replaced(path)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Splitting
+# ----------------------------------------------------------------------------------------------------
+
+def create_shard(database_name, project_id):
+    """Moves the rows of a project from the catalog into a new shard; returns the shard path."""
+    path = shard_path(database_name, project_id)
+    created_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with transaction(database_name) as conn:
+        # Taken before the copy, so nothing is added to the project between the copy and the purge
+        conn.execute('BEGIN IMMEDIATE')
+        if conn.execute(statement('shards.get'), (project_id,)).fetchone():
+            return path
+        # Left over by a split that did not complete
+        remove_local(path)
+        services.create_schema(path)
+        services.copy_project(database_name, path, project_id)
+        services.purge_project_rows(conn, project_id)
+        conn.execute(statement('shards.insert'), (project_id, created_at))
+    return path
+
+
+def split_database(database_name):
+    """Moves every live project still kept in the catalog into its shard; returns the new shard paths."""
+    paths = [create_shard(database_name, project_id)
+             for project_id in services.query_column(database_name, statement('shards.unsharded'))]
+    if paths:
+        services.compact(database_name)
+    return paths
+
+
+# ----------------------------------------------------------------------------------------------------
+# Projects
+# ----------------------------------------------------------------------------------------------------
+
+def create_project(database_name, project_name, project_location):
+    """Creates a project in the catalog together with its empty shard; returns the project id."""
+    project_id = services.create_project(database_name, project_name, project_location)
+    create_shard(database_name, project_id)
+    return project_id
+
+
+def update_project(database_name, project_id, project_name, project_location):
+    services.update_project(database_name, project_id, project_name, project_location)
+    copy_project_details(database_name, project_id)
+
+
+def copy_project_details(database_name, project_id):
+    """Copies the name and location of the project from the catalog into its shard, if the shard is here."""
+    path = project_database(database_name, project_id)
+    if path == database_name or not services.has_schema(path):
+        return
+    project = services.get_project(database_name, project_id)
+    if project and project != services.get_project(path, project_id):
+        services.update_project(path, project_id, project.project_name, project.project_location)
+
+
+def delete_project(database_name, project_id):
+    """Soft-deletes the project in the catalog and its purchases in its shard (if the shard is on this device).
+
+    Returns:
+        int: Number of purchases deleted with the project.
+    """
+    deleted = services.delete_project(database_name, project_id)
+    path = project_database(database_name, project_id)
+    if path != database_name and services.has_schema(path):
+        deleted = services.delete_project(path, project_id)
+    return deleted
+
+
+# ----------------------------------------------------------------------------------------------------
+# Drive
+# ----------------------------------------------------------------------------------------------------
+
+def publish(service, path, user_email):
+    """Uploads a shard that was created on this device and shares it with the user."""
+    with tenants.drive_transfer():
+        services.create_remote_database(service, path, user_email)
+    outbox.mark_in_sync(path)
+
+
+def upload_new_shards(service, database_name, user_email):
+    """Uploads the shards of this device that never reached Drive (e.g. just split); returns how many."""
+    uploaded = 0
+    for project_id in sharded_projects(database_name):
+        path = shard_path(database_name, project_id)
+        if services.has_schema(path) and outbox.read_state(path).last_synced_at is None \
+                and not services.find_remote_database(service, path, user_email):
+            publish(service, path, user_email)
+            uploaded += 1
+    return uploaded
+
+
+def open_project(service, database_name, project_id, user_email, progress_callback=None):
+    """Path of the database of the project, with its shard brought up to date with Drive first.
+
+    Raises:
+        SyncError: If Drive cannot be reached, or the shard was created on another device that has
+            not uploaded it yet. A shard already on this device can still be used offline.
+    """
+    path = project_database(database_name, project_id)
+    if path == database_name:
+        return path
+    file_id = services.find_remote_database(service, path, user_email)
+    if file_id:
+        outbox.pull(service, path, user_email, file_id, progress_callback)
+    elif services.has_schema(path):
+        publish(service, path, user_email)
+    else:
+        raise SyncError(f"The purchases of project {project_id} are not on Google Drive yet. They are uploaded "
+                        f"the next time the project is opened on the device it was created on.")
+    copy_project_details(database_name, project_id)
+    return path
+
+
+def evict(database_name):
+    """Eviction hook: the replayers of an idle tenant's shards stop too, unless they have changes to ship."""
+    if not services.has_schema(database_name):
+        return
+    for project_id in sharded_projects(database_name):
+        path = shard_path(database_name, project_id)
+        if os.path.exists(path):
+            outbox.evict(path)
+
+
+tenants.register_eviction_hook(evict)
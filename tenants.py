@@ -0,0 +1,162 @@
+"""Per-user storage when one Streamlit server is shared by many users.
+
+Every user (tenant) gets a directory of their own under TENANT_ROOT, named after a stable hash of
+their full email address, so two users with the same local part on different domains never share a
+file. The database keeps its `<email-localpart>.db` file name. All users' files are kept in the one
+Drive of the app's service account, so there they are named `<tenant key>-<file name>`
+(remote_name); copies saved by older versions under the bare file name are adopted by the user
+they are shared with (see services.find_remote_database).
+
+Server-wide limits:
+    - At most DRIVE_WORKERS Drive transfers (downloads and uploads) run at the same time.
+    - At most MAX_ACTIVE_TENANTS tenants are active at a time. Beyond that, the least recently
+      used tenants idle for IDLE_SECONDS are evicted: their background work (e.g. the outbox
+      replayer) is stopped and their files simply stay on disk until they come back.
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: tenant locks are only held within this process
+    fcntl = None
+
+TENANT_ROOT = os.environ.get('CONSMAN_TENANT_ROOT', 'tenants')
+DRIVE_WORKERS = int(os.environ.get('CONSMAN_DRIVE_WORKERS', 8))
+MAX_ACTIVE_TENANTS = int(os.environ.get('CONSMAN_MAX_ACTIVE_TENANTS', 500))
+IDLE_SECONDS = 15 * 60
+TENANT_KEY = re.compile(r'[0-9a-f]{16}')
+
+
+class TenantCapacityError(Exception):
+    """Raised when every tenant slot is taken by a recently active user."""
+
+
+# ----------------------------------------------------------------------------------------------------
+# Paths
+# ----------------------------------------------------------------------------------------------------
+
+def tenant_key(user_email):
+    """Stable directory name of a user: the first 16 hex digits of the SHA-256 of the normalized email."""
+    return hashlib.sha256(user_email.strip().lower().encode('utf-8')).hexdigest()[:16]
+
+
+def remote_name(database_name):
+    """Name of a tenant's file on Drive: <tenant key>-<file name>, e.g. 3f2a...-alice.db or 3f2a...-alice.project-2.db.
+
+    Files outside a tenant directory keep their file name.
+    """
+    directory, file_name = os.path.split(os.path.abspath(database_name))
+    key = os.path.basename(directory)
+    return f'{key}-{file_name}' if TENANT_KEY.fullmatch(key) else file_name
+
+
+def tenant_dir(user_email):
+    directory = os.path.join(TENANT_ROOT, tenant_key(user_email))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def database_path(user_email):
+    """Local path of the user's database: <TENANT_ROOT>/<tenant key>/<email-localpart>.db"""
+    return os.path.join(tenant_dir(user_email), f"{user_email.split('@')[0]}.db")
+
+
+# ----------------------------------------------------------------------------------------------------
+# Locks
+# ----------------------------------------------------------------------------------------------------
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def tenant_lock(user_email):
+    """Exclusive lock on a tenant's files, across threads and (where fcntl exists) server processes.
+
+    Hold it while replacing the database file, e.g. during a download.
+    """
+    key = tenant_key(user_email)
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(key, threading.RLock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(tenant_dir(user_email), '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# ----------------------------------------------------------------------------------------------------
+# Drive transfers
+# ----------------------------------------------------------------------------------------------------
+
+_drive_slots = threading.BoundedSemaphore(DRIVE_WORKERS)
+
+
+@contextmanager
+def drive_transfer():
+    """Waits for one of the DRIVE_WORKERS transfer slots and holds it for the duration of the block.
+
+    The transfer runs in the caller's thread, so a Streamlit progress callback keeps working.
+    """
+    with _drive_slots:
+        yield
+
+
+# ----------------------------------------------------------------------------------------------------
+# Admission control
+# ----------------------------------------------------------------------------------------------------
+
+_active = OrderedDict()  # tenant key -> (database path, last seen), least recently used first
+_active_guard = threading.Lock()
+_eviction_hooks = []
+
+
+def register_eviction_hook(hook):
+    """Registers hook(database_path), called when a tenant is evicted."""
+    _eviction_hooks.append(hook)
+
+
+def admit(user_email, now=None):
+    """Marks the user as active and returns the path of their database.
+
+    Raises:
+        TenantCapacityError: If MAX_ACTIVE_TENANTS tenants are active and none of them is idle.
+    """
+    now = now if now is not None else time.time()
+    key = tenant_key(user_email)
+    path = database_path(user_email)
+    evicted = []
+    with _active_guard:
+        if key not in _active:
+            while len(_active) >= MAX_ACTIVE_TENANTS:
+                oldest_key, (oldest_path, last_seen) = next(iter(_active.items()))
+                if now - last_seen < IDLE_SECONDS:
+                    raise TenantCapacityError("The server is busy, please try again in a few minutes.")
+                del _active[oldest_key]
+                evicted.append(oldest_path)
+        _active[key] = (path, now)
+        _active.move_to_end(key)
+
+    for evicted_path in evicted:
+        for hook in _eviction_hooks:
+            try:
+                hook(evicted_path)
+            except Exception as e:
+                print(f'Error log: {e}')
+    return path
+
+
+def active_tenants():
+    with _active_guard:
+        return len(_active)
@@ -0,0 +1,58 @@
+"""Shared fixtures: small generated databases and an in-memory Drive, so the suite runs offline."""
+import os
+import sys
+
+# The modules of the app live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging
+import pytest
+import services
+import benchmark
+import drive_client
+import drive_stub
+from datetime import date
+from services import Purchase, transaction
+
+# The report modules render through Streamlit, which only logs bare-mode warnings outside `streamlit run`
+logging.disable(logging.WARNING)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A database of the app with 600 generated purchases over 3 projects and 20 vendors."""
+    path = str(tmp_path / 'site.db')
+    benchmark.generate_database(path, 600, projects=3, vendors=20)
+    return path
+
+
+@pytest.fixture
+def drive(monkeypatch):
+    """An online FakeDrive; retries do not sleep."""
+    monkeypatch.setattr(drive_client, 'backoff_delay', lambda attempt: 0)
+    return drive_stub.FakeDrive()
+
+
+def edit_purchases(database_name):
+    """Adds, edits, soft-deletes, restores and purges purchases, the changes the triggers must follow."""
+    services.add_purchases(database_name, [
+        Purchase(1, ' Cement ', 2500, 'Kg', ' VENDOR 0001 ', 'Roof', 'Material', date(2024, 1, 5), 21000, 'UPI',
+                 21000, 'Site Engineer'),
+        Purchase(2, 'paint', 500, 'ml', 'Vendor 0002', 'Finishes', 'Material', date(2024, 2, 9), 150, 'Cash', 0,
+                 'Site Engineer'),
+        Purchase(3, 'Labour', None, 'Others', 'Vendor 0003', 'Basement', 'Mason Labour', date(2024, 3, 1), 900,
+                 'No Payment', 0, None),
+    ])
+    with transaction(database_name) as conn:
+        conn.execute('UPDATE purchases SET vendor = upper(vendor) WHERE purchase_id % 7 = 0')
+        conn.execute('''UPDATE purchases SET purchase_amount = purchase_amount + 10, paid_amount = 0,
+                        date = date(date, '+40 days'), stage = 'Roof' WHERE purchase_id % 5 = 0''')
+        conn.execute("UPDATE purchases SET unit = 'Kg', item_qty = item_qty * 1000 "
+                     "WHERE unit = 'MT' AND purchase_id % 3 = 0")
+        conn.execute('UPDATE purchases SET project_id = 2 WHERE purchase_id % 17 = 0')
+    services.delete_purchases(database_name, services.query_column(
+        database_name, 'SELECT purchase_id FROM purchases WHERE purchase_id % 11 = 0'))
+    services.restore_purchases(database_name, services.query_column(
+        database_name, 'SELECT purchase_id FROM purchases WHERE purchase_id % 22 = 0'))
+    with transaction(database_name) as conn:
+        conn.execute('DELETE FROM purchases WHERE purchase_id % 13 = 0')
@@ -0,0 +1,81 @@
+"""Archiving a project moves all of its rows into a compressed archive with unchanged totals."""
+import os
+import gzip
+import sqlite3
+from contextlib import closing
+import pytest
+import services
+import shards
+import archive
+from attachments import blob_path
+
+# Everything kept for a project, tombstones included, and the live totals the archive summary reports
+ROWS = {
+    'purchases': 'SELECT COUNT(*), round(SUM(purchase_amount), 6) FROM purchases WHERE project_id = ?',
+    'budgets': 'SELECT COUNT(*), round(SUM(amount), 6) FROM budgets WHERE project_id = ?',
+}
+LIVE_TOTALS = '''SELECT stage, category, COUNT(*), round(SUM(purchase_amount), 6),
+                        round(SUM(COALESCE(paid_amount, 0)), 6)
+                 FROM purchases WHERE project_id = ? AND deleted_at IS NULL GROUP BY stage, category'''
+
+
+def project_rows(database_name, project_id):
+    with closing(sqlite3.connect(database_name)) as conn:
+        return {table: conn.execute(sql, (project_id,)).fetchone() for table, sql in ROWS.items()}
+
+
+def live_totals(database_name, project_id):
+    with closing(sqlite3.connect(database_name)) as conn:
+        return sorted(conn.execute(LIVE_TOTALS, (project_id,)).fetchall())
+
+
+@pytest.fixture(params=['single', 'sharded'])
+def site(request, database):
+    """The generated database with a budget and a few tombstones in project 1, split into shards or not."""
+    services.set_budget(database, 1, 'Roof', 'Material', 250000)
+    services.delete_purchases(database, services.list_purchase_ids(database, 1)[:5])
+    if request.param == 'sharded':
+        shards.split_database(database)
+    return database
+
+
+def test_round_trip(site):
+    source = shards.project_database(site, 1)
+    rows, totals = project_rows(source, 1), live_totals(source, 1)
+    other_project = project_rows(site if source == site else shards.project_database(site, 2), 2)
+
+    project = archive.archive_project(site, 1)
+
+    assert (project.purchases, round(project.purchased, 6)) == (sum(row[2] for row in totals),
+                                                                round(sum(row[3] for row in totals), 6))
+    assert 1 not in [listed.project_id for listed in services.list_projects(site)]
+    assert [listed.project_id for listed in archive.list_archived_projects(site)] == [1]
+    # Nothing of the project is left behind, in the catalog or as a shard
+    assert project_rows(site, 1) == {table: (0, None) for table in ROWS}
+    assert not os.path.exists(shards.shard_path(site, 1))
+    assert project_rows(shards.project_database(site, 2), 2) == other_project
+
+    summary = archive.archived_totals(site, 1)
+    assert [(stage, category, purchases, round(purchased, 6), round(paid, 6))
+            for stage, category, purchases, purchased, paid, _ in summary.rows] == totals
+
+    path = archive.open_archive(None, site, 1)
+    assert project_rows(path, 1) == rows
+    assert live_totals(path, 1) == totals
+    assert services.get_project(path, 1).project_name == project.project_name
+
+
+def test_blob_is_the_compressed_archive(site):
+    project = archive.archive_project(site, 1)
+    with open(blob_path(site, project.sha256), 'rb') as file:
+        data = gzip.decompress(file.read())
+    assert data.startswith(b'SQLite format 3\x00')
+    assert services.query_column(site, 'SELECT size FROM blobs WHERE sha256 = ?', (project.sha256,)) \
+        == [os.path.getsize(blob_path(site, project.sha256))]
+
+
+def test_unknown_project(site):
+    with pytest.raises(ValueError):
+        archive.archive_project(site, 99)
+    with pytest.raises(ValueError):
+        archive.open_archive(None, site, 99)
@@ -0,0 +1,96 @@
+"""Attachments are stored once per content, and their blobs reach Drive before the database that links them."""
+import os
+import sqlite3
+import hashlib
+from contextlib import closing
+import pytest
+import services
+import attachments
+from attachments import blob_path, drive_name
+
+RECEIPT = b'%PDF-1.4 receipt of invoice 42'
+
+
+def stored_blobs(database_name):
+    directory = attachments.store_dir(database_name, 'blobs')
+    return sorted(name for _, _, names in os.walk(directory) for name in names)
+
+
+def drive_file_ids(database_name):
+    return dict(services.query_table(database_name, 'SELECT sha256, drive_file_id FROM blobs').rows)
+
+
+def copy_database(database_name, target_name):
+    """The same database on another device: a copy in another directory, with a blob store of its own."""
+    os.makedirs(os.path.dirname(target_name), exist_ok=True)
+    with closing(sqlite3.connect(database_name)) as source, closing(sqlite3.connect(target_name)) as target:
+        source.backup(target)
+
+
+def test_same_content_is_stored_once(database):
+    sha256 = hashlib.sha256(RECEIPT).hexdigest()
+    first = attachments.add_attachment(database, 1, 'receipt.pdf', RECEIPT)
+    second = attachments.add_attachment(database, 2, 'scan of receipt.pdf', RECEIPT)
+
+    assert first != second
+    assert stored_blobs(database) == [sha256]
+    assert list(drive_file_ids(database)) == [sha256]
+    attachment, = attachments.list_attachments(database, 2)
+    assert (attachment.sha256, attachment.file_name, attachment.size, attachment.mime_type) \
+        == (sha256, 'scan of receipt.pdf', len(RECEIPT), 'application/pdf')
+
+
+def test_unknown_purchase_stores_nothing(database):
+    with pytest.raises(ValueError, match='does not exist'):
+        attachments.add_attachment(database, 999999, 'receipt.pdf', RECEIPT)
+    assert stored_blobs(database) == []
+    assert drive_file_ids(database) == {}
+
+
+def test_empty_file(database):
+    with pytest.raises(ValueError, match='empty'):
+        attachments.add_attachment(database, 1, 'receipt.pdf', b'')
+
+
+def test_upload_pending_blobs(database, drive):
+    sha256 = hashlib.sha256(RECEIPT).hexdigest()
+    attachments.add_attachment(database, 1, 'receipt.pdf', RECEIPT)
+    attachments.add_attachment(database, 2, 'photo.jpg', b'\xff\xd8 photo')
+
+    assert attachments.upload_pending_blobs(drive, database) == 2
+    assert drive.file_named(drive_name(sha256)) == RECEIPT
+    assert all(drive_file_ids(database).values())
+    # Nothing left to upload
+    assert attachments.upload_pending_blobs(drive, database) == 0
+
+
+def test_blob_already_on_drive_is_only_linked(database, drive, tmp_path):
+    sha256 = hashlib.sha256(RECEIPT).hexdigest()
+    other_device = str(tmp_path / 'other' / 'site.db')
+    copy_database(database, other_device)
+    attachments.add_attachment(other_device, 1, 'receipt.pdf', RECEIPT)
+    attachments.upload_pending_blobs(drive, other_device)
+    uploads = drive.calls.count('files.create')
+
+    attachments.add_attachment(database, 1, 'receipt.pdf', RECEIPT)
+    assert attachments.upload_pending_blobs(drive, database) == 0
+    assert drive.calls.count('files.create') == uploads
+    assert drive_file_ids(database) == drive_file_ids(other_device)
+
+
+def test_blob_of_another_device_waits(database, drive):
+    attachments.add_attachment(database, 1, 'receipt.pdf', RECEIPT)
+    os.remove(blob_path(database, hashlib.sha256(RECEIPT).hexdigest()))
+
+    assert attachments.upload_pending_blobs(drive, database) == 0
+    assert list(drive_file_ids(database).values()) == [None]
+
+
+def test_read_attachment_downloads_a_missing_blob(database, drive):
+    sha256 = hashlib.sha256(RECEIPT).hexdigest()
+    attachments.add_attachment(database, 1, 'receipt.pdf', RECEIPT)
+    attachments.upload_pending_blobs(drive, database)
+    os.remove(blob_path(database, sha256))
+
+    assert attachments.read_attachment(drive, database, sha256) == RECEIPT
+    assert os.path.exists(blob_path(database, sha256))
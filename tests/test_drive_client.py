@@ -0,0 +1,128 @@
+"""Which failed Drive calls are retried, and how often a create is sent."""
+import json
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+import drive_client
+import connection_utils
+
+
+def http_error(status, reason=None):
+    content = {'error': {'code': status, 'message': 'failed'}}
+    if reason:
+        content['error']['errors'] = [{'reason': reason}]
+    return HttpError(httplib2.Response({'status': status}), json.dumps(content).encode(), uri='https://drive')
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (http_error(429), True),
+    (http_error(500), True),
+    (http_error(502), True),
+    (http_error(503), True),
+    (http_error(504), True),
+    (http_error(403, 'userRateLimitExceeded'), True),
+    (http_error(403, 'rateLimitExceeded'), True),
+    (http_error(403, 'insufficientFilePermissions'), False),
+    (http_error(403), False),
+    (http_error(400), False),
+    (http_error(404), False),
+    (TimeoutError('timed out'), True),
+    (ConnectionResetError('reset'), True),
+    (httplib2.ServerNotFoundError('no route'), True),
+    (ValueError('bad argument'), False),
+])
+def test_is_retryable(error, retryable):
+    assert drive_client.is_retryable(error) is retryable
+
+
+@pytest.mark.parametrize('error, rejected', [
+    (http_error(429), True),
+    (http_error(403, 'userRateLimitExceeded'), True),
+    (http_error(500), False),
+    (http_error(503), False),
+    (TimeoutError('timed out'), False),
+])
+def test_is_rejected(error, rejected):
+    assert drive_client.is_rejected(error) is rejected
+
+
+class FailingCall:
+    """Raises the given errors in turn, then returns 'done'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'done'
+
+
+def no_sleep(seconds):
+    pass
+
+
+def test_idempotent_call_is_retried_after_a_server_error():
+    func = FailingCall(http_error(503), TimeoutError('timed out'))
+    assert drive_client.call(func, sleep=no_sleep) == 'done'
+    assert func.calls == 3
+
+
+def test_retries_are_bounded():
+    func = FailingCall(*[http_error(503)] * 10)
+    with pytest.raises(HttpError):
+        drive_client.call(func, num_retries=2, sleep=no_sleep)
+    assert func.calls == 3
+
+
+def test_permanent_error_is_not_retried():
+    func = FailingCall(http_error(404))
+    with pytest.raises(HttpError):
+        drive_client.call(func, sleep=no_sleep)
+    assert func.calls == 1
+
+
+def test_create_is_retried_after_a_rate_limit():
+    func = FailingCall(http_error(429))
+    assert drive_client.call(func, sleep=no_sleep, idempotent=False) == 'done'
+    assert func.calls == 2
+
+
+def test_create_without_lookup_is_not_retried_after_a_server_error():
+    func = FailingCall(http_error(503))
+    with pytest.raises(HttpError):
+        drive_client.call(func, sleep=no_sleep, idempotent=False)
+    assert func.calls == 1
+
+
+def test_create_that_went_through_is_not_sent_again():
+    func = FailingCall(TimeoutError('response lost'))
+    result = drive_client.call(func, sleep=no_sleep, idempotent=False, recover=lambda: {'id': 'created'})
+    assert result == {'id': 'created'} and func.calls == 1
+
+
+def test_create_that_did_not_go_through_is_sent_again():
+    func = FailingCall(TimeoutError('request lost'))
+    assert drive_client.call(func, sleep=no_sleep, idempotent=False, recover=lambda: None) == 'done'
+    assert func.calls == 2
+
+
+def test_fake_drive_create_leaves_one_file(drive, tmp_path):
+    source = tmp_path / 'site.db'
+    source.write_bytes(b'data')
+    run = drive._run
+    lost = ['files.create']
+
+    def lose_first_create_response(name, func):
+        result = run(name, func)
+        if name in lost:
+            lost.remove(name)
+            raise TimeoutError('response lost')
+        return result
+    drive._run = lose_first_create_response
+
+    file_id = connection_utils.upload_db_to_drive(drive, 'site.db', None, source_path=str(source))
+
+    assert [file['id'] for file in drive.files_by_id.values()] == [file_id]
@@ -0,0 +1,76 @@
+"""Likely duplicates: same vendor and amount within the date window, and similar item names."""
+from datetime import date, timedelta
+import pytest
+import services
+import duplicates
+from services import Purchase
+
+DAY = date(2024, 6, 10)
+
+
+def purchase(item_name='Cement OPC 53', vendor='Ace Traders', amount=12000, day=DAY, project_id=1):
+    return Purchase(project_id, item_name, 30, 'Bags', vendor, 'Basement', 'Material', day, amount, 'Cash', 0,
+                    'Site Engineer')
+
+
+@pytest.fixture
+def site(tmp_path):
+    """A database with two projects and one saved purchase of cement in the first."""
+    path = str(tmp_path / 'site.db')
+    services.create_schema(path)
+    services.create_project(path, 'Villa', 'Pune')
+    services.create_project(path, 'Office', 'Pune')
+    services.add_purchase(path, purchase())
+    return path
+
+
+def found_ids(database_name, new_purchase):
+    found = duplicates.find_duplicates(database_name, [new_purchase])
+    return [candidate.purchase_id for candidate in found.get(0, [])]
+
+
+@pytest.mark.parametrize('name, normalized', [('Cement  (OPC)', 'cement opc'), (' CEMENT-opc ', 'cement opc'),
+                                              (None, ''), (53, '53')])
+def test_normalize_name(name, normalized):
+    assert duplicates.normalize_name(name) == normalized
+
+
+def test_same_line_is_found(site):
+    assert found_ids(site, purchase()) == [1]
+    # Vendors compare trimmed and in lower case, item names normalized
+    assert found_ids(site, purchase(item_name='cement (OPC-53)', vendor=' ACE TRADERS ')) == [1]
+
+
+@pytest.mark.parametrize('days, found', [(duplicates.DATE_WINDOW_DAYS, True), (-duplicates.DATE_WINDOW_DAYS, True),
+                                         (duplicates.DATE_WINDOW_DAYS + 1, False)])
+def test_date_window(site, days, found):
+    assert bool(found_ids(site, purchase(day=DAY + timedelta(days=days)))) is found
+
+
+@pytest.mark.parametrize('changes', [{'vendor': 'Best Traders'}, {'amount': 12001}, {'project_id': 2}])
+def test_blocking_key(site, changes):
+    assert found_ids(site, purchase(**changes)) == []
+
+
+def test_similarity_threshold(site):
+    similar, different = 'Cement OPC 43', 'Sand'
+    assert duplicates.name_similarity('Cement OPC 53', similar) >= duplicates.SIMILARITY_THRESHOLD
+    assert duplicates.name_similarity('Cement OPC 53', different) < duplicates.SIMILARITY_THRESHOLD
+    assert found_ids(site, purchase(item_name=similar)) == [1]
+    assert found_ids(site, purchase(item_name=different)) == []
+
+
+def test_deleted_purchases_are_not_candidates(site):
+    services.delete_purchases(site, [1])
+    assert found_ids(site, purchase()) == []
+
+
+def test_scan_lists_each_pair_once(site):
+    services.add_purchases(site, [purchase(day=DAY + timedelta(days=2)), purchase(item_name='cement opc-53'),
+                                  purchase(item_name='Sand')])
+    table = duplicates.scan_duplicates(site, 1)
+
+    pairs = [(row[0], row[1]) for row in table.rows]
+    assert sorted(pairs) == [(2, 1), (3, 1), (3, 2)]
+    assert all(later > earlier for later, earlier in pairs)
+    assert duplicates.scan_duplicates(site, 2).rows == []
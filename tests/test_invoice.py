@@ -0,0 +1,45 @@
+"""An invoice (services.add_purchases) is saved all or nothing."""
+import sqlite3
+from datetime import date
+import pytest
+import services
+from services import Purchase
+
+
+def line_item(item_name='Cement', purchase_amount=4200, paid_amount=0):
+    return Purchase(1, item_name, 10, 'Bags', 'Vendor 0001', 'Basement', 'Material', date(2024, 4, 2),
+                    purchase_amount, 'Cash', paid_amount, 'Site Engineer')
+
+
+def state(database_name):
+    """Everything a saved line item would change: the purchases, the change feed and a trigger-kept aggregate."""
+    return (services.query_column(database_name, 'SELECT COUNT(*) FROM purchases')[0],
+            services.latest_audit_id(database_name),
+            services.query_column(database_name, 'SELECT round(SUM(purchased), 6) FROM vendor_ledger')[0])
+
+
+def test_invoice_is_saved(database):
+    purchases = services.query_column(database, 'SELECT COUNT(*) FROM purchases')[0]
+    assert services.add_purchases(database, [line_item('Cement'), line_item('Sand', 900)]) == 2
+    assert services.query_column(database, 'SELECT COUNT(*) FROM purchases')[0] == purchases + 2
+
+
+def test_failed_insert_saves_nothing(database):
+    before = state(database)
+    # Passes validation (a payment without a purchase amount) but breaks the NOT NULL constraint
+    with pytest.raises(sqlite3.IntegrityError):
+        services.add_purchases(database, [line_item('Cement'), line_item('Sand'),
+                                          line_item('Steel', purchase_amount=None, paid_amount=500)])
+    assert state(database) == before
+
+
+def test_invalid_line_item_saves_nothing(database):
+    before = state(database)
+    with pytest.raises(ValueError, match='Row 2: All fields are mandatory'):
+        services.add_purchases(database, [line_item('Cement'), line_item('')])
+    assert state(database) == before
+
+
+def test_empty_invoice(database):
+    with pytest.raises(ValueError, match='at least one line item'):
+        services.add_purchases(database, [])
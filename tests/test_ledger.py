@@ -0,0 +1,50 @@
+"""The aggregates kept by triggers match the same aggregates computed afresh from the purchases."""
+import sqlite3
+from contextlib import closing
+from conftest import edit_purchases
+
+# (table kept by triggers, the same rows computed from the live purchases)
+AGGREGATES = {
+    'vendor_ledger': (
+        '''SELECT project_id, vendor_key, round(purchased, 6), round(paid, 6), purchases
+           FROM vendor_ledger WHERE purchases > 0''',
+        '''SELECT project_id, lower(trim(vendor)), round(SUM(purchase_amount), 6),
+                  round(SUM(COALESCE(paid_amount, 0)), 6), COUNT(*)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, lower(trim(vendor))''',
+    ),
+    'vendor_balances': (
+        '''SELECT project_id, vendor_key, date, round(purchased, 6), round(paid, 6) FROM vendor_balances
+           WHERE round(purchased, 6) != 0 OR round(paid, 6) != 0''',
+        '''SELECT project_id, lower(trim(vendor)), date, round(SUM(purchase_amount), 6),
+                  round(SUM(COALESCE(paid_amount, 0)), 6)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, lower(trim(vendor)), date''',
+    ),
+    'budget_actuals': (
+        '''SELECT project_id, stage, category, round(purchased, 6), round(paid, 6), purchases
+           FROM budget_actuals WHERE purchases > 0''',
+        '''SELECT project_id, stage, category, round(SUM(purchase_amount), 6),
+                  round(SUM(COALESCE(paid_amount, 0)), 6), COUNT(*)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, stage, category''',
+    ),
+    'budget_burn': (
+        '''SELECT project_id, stage, category, month, round(purchased, 6) FROM budget_burn
+           WHERE round(purchased, 6) != 0''',
+        '''SELECT project_id, stage, category, substr(date, 1, 7), round(SUM(purchase_amount), 6)
+           FROM purchases WHERE deleted_at IS NULL GROUP BY project_id, stage, category, substr(date, 1, 7)''',
+    ),
+}
+
+
+def assert_aggregates_match(database_name):
+    with closing(sqlite3.connect(database_name)) as conn:
+        for table, (kept, computed) in AGGREGATES.items():
+            assert sorted(conn.execute(kept).fetchall()) == sorted(conn.execute(computed).fetchall()), table
+
+
+def test_backfill_matches(database):
+    assert_aggregates_match(database)
+
+
+def test_triggers_follow_edits(database):
+    edit_purchases(database)
+    assert_aggregates_match(database)
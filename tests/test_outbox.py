@@ -0,0 +1,87 @@
+"""The outbox: committed changes stay pending until an upload of them reaches Drive."""
+import sqlite3
+from contextlib import closing
+import services
+import outbox
+import tenants
+from services import Purchase
+from datetime import date
+
+USER = 'engineer@site.example'
+
+
+def drive_copy(drive, database_name, tmp_path):
+    """The Drive copy of the database, written to a file of its own."""
+    path = tmp_path / 'drive-copy.db'
+    path.write_bytes(drive.file_named(tenants.remote_name(database_name)))
+    return str(path)
+
+
+def count(database_name, sql):
+    with closing(sqlite3.connect(database_name)) as conn:
+        return conn.execute(sql).fetchone()[0]
+
+
+def synced_database(drive, tmp_path):
+    database_name = str(tmp_path / 'site.db')
+    services.create_remote_database(drive, database_name, USER)
+    outbox.mark_in_sync(database_name)
+    return database_name
+
+
+def test_purchase_is_pending_until_replayed(drive, tmp_path):
+    database_name = synced_database(drive, tmp_path)
+    project_id = services.create_project(database_name, 'Villa', 'Site 1')
+    services.add_purchase(database_name, Purchase(project_id, 'Cement', 10, 'MT', 'Vendor 0001', 'Roof', 'Material',
+                                                  date(2024, 1, 5), 75000, 'UPI', 75000, 'Site Engineer'))
+    assert outbox.read_state(database_name).pending == 2
+
+    state = outbox.replay(drive, database_name, USER)
+
+    assert state.pending == 0 and state.last_error is None
+    assert count(drive_copy(drive, database_name, tmp_path), 'SELECT COUNT(*) FROM purchases') == 1
+
+
+def test_budget_change_is_pending_until_replayed(drive, tmp_path):
+    database_name = synced_database(drive, tmp_path)
+    project_id = services.create_project(database_name, 'Villa', 'Site 1')
+    outbox.replay(drive, database_name, USER)
+
+    services.set_budget(database_name, project_id, 'Roof', 'Material', 100000)
+    assert outbox.read_state(database_name).pending == 1
+    outbox.replay(drive, database_name, USER)
+    assert outbox.read_state(database_name).pending == 0
+    assert count(drive_copy(drive, database_name, tmp_path), 'SELECT amount FROM budgets') == 100000
+
+    services.set_budget(database_name, project_id, 'Roof', 'Material', 0)
+    assert outbox.read_state(database_name).pending == 1
+    outbox.replay(drive, database_name, USER)
+    assert count(drive_copy(drive, database_name, tmp_path), 'SELECT COUNT(*) FROM budgets') == 0
+
+
+def test_offline_replay_keeps_changes_and_backs_off(drive, tmp_path):
+    database_name = synced_database(drive, tmp_path)
+    services.create_project(database_name, 'Villa', 'Site 1')
+    drive.online = False
+
+    state = outbox.replay(drive, database_name, USER, now=1000)
+
+    assert state.pending == 1 and state.attempts == 1 and state.last_error
+    assert state.next_attempt_at > 1000
+    # Within the backoff delay nothing is attempted, unless forced
+    calls = len(drive.calls)
+    assert outbox.replay(drive, database_name, USER, now=1000).attempts == 1
+    assert len(drive.calls) == calls
+
+    drive.online = True
+    state = outbox.replay(drive, database_name, USER, force=True, now=1000)
+    assert state.pending == 0 and state.attempts == 0 and state.last_error is None
+
+
+def test_pull_keeps_local_changes(drive, tmp_path):
+    database_name = synced_database(drive, tmp_path)
+    services.create_project(database_name, 'Villa', 'Site 1')
+    file_id = services.find_remote_database(drive, database_name, USER)
+
+    assert outbox.pull(drive, database_name, USER, file_id) == outbox.PULL_LOCAL_CHANGES
+    assert [project.project_name for project in services.list_projects(database_name)] == ['Villa']
@@ -0,0 +1,84 @@
+"""Unit prices: unit normalization, the trigger-kept unit_prices table and the comparisons read from it."""
+import sqlite3
+from contextlib import closing
+from datetime import date
+import pytest
+import services
+import prices
+from services import Purchase
+from conftest import edit_purchases
+
+KEPT = '''SELECT item_key, base_unit, month, vendor_key, project_id, round(quantity, 6), round(amount, 6), purchases
+          FROM unit_prices WHERE purchases > 0'''
+COMPUTED = '''SELECT lower(trim(p.item_name)), c.base_unit, substr(p.date, 1, 7), lower(trim(p.vendor)), p.project_id,
+                     round(SUM(p.item_qty * c.factor), 6), round(SUM(p.purchase_amount), 6), COUNT(*)
+              FROM purchases p JOIN unit_conversions c ON c.unit_key = lower(trim(p.unit))
+              WHERE p.deleted_at IS NULL AND p.item_qty > 0 AND p.purchase_amount > 0
+              GROUP BY 1, 2, 3, 4, 5'''
+
+
+def assert_unit_prices_match(database_name):
+    with closing(sqlite3.connect(database_name)) as conn:
+        assert sorted(conn.execute(KEPT).fetchall()) == sorted(conn.execute(COMPUTED).fetchall())
+
+
+def test_backfill_matches(database):
+    assert_unit_prices_match(database)
+
+
+def test_triggers_follow_edits(database):
+    edit_purchases(database)
+    assert_unit_prices_match(database)
+
+
+@pytest.mark.parametrize('unit, expected', [
+    ('MT', ('MT', 1)),
+    (' kg ', ('MT', 0.001)),
+    ('Liters', ('Liters', 1)),
+    ('ml', ('Liters', 0.001)),
+    ('Nos', ('Nos', 1)),
+    ('Others', (None, None)),
+    (None, (None, None)),
+])
+def test_normalize_unit(unit, expected):
+    assert prices.normalize_unit(unit) == expected
+
+
+def test_unit_price():
+    assert prices.unit_price(21000, 2500, 'Kg') == pytest.approx(8400)
+    assert prices.unit_price(21000, 0, 'Kg') is None
+    assert prices.unit_price(21000, 10, 'Others') is None
+
+
+@pytest.mark.parametrize('period, today, months', [
+    ('This Quarter', date(2026, 2, 5), ('2026-01', '2026-03')),
+    ('This Quarter', date(2026, 12, 31), ('2026-10', '2026-12')),
+    ('Last Quarter', date(2026, 2, 5), ('2025-10', '2025-12')),
+    ('Last Quarter', date(2026, 8, 1), ('2026-04', '2026-06')),
+    ('This Year', date(2026, 8, 1), ('2026-01', '2026-12')),
+])
+def test_period_months(period, today, months):
+    assert prices.period_months(period, today) == months
+
+
+def test_cheapest_vendor_compares_across_units(tmp_path):
+    database_name = str(tmp_path / 'site.db')
+    services.create_schema(database_name)
+    project_id = services.create_project(database_name, 'Villa', 'Site 1')
+
+    def purchase(qty, unit, vendor, day, amount):
+        return Purchase(project_id, 'Cement', qty, unit, vendor, 'Roof', 'Material', day, amount, 'UPI', amount, 'x')
+    services.add_purchases(database_name, [
+        purchase(2, 'MT', 'Ace Traders', date(2026, 1, 10), 16000),     # 8000 per MT
+        purchase(500, 'Kg', 'ace traders ', date(2026, 2, 10), 3500),   # 7000 per MT, same vendor
+        purchase(1, 'MT', 'Bharat Supply', date(2026, 3, 10), 7200),    # 7200 per MT
+        purchase(1, 'MT', 'Cheap Co', date(2025, 12, 10), 5000),        # last quarter
+    ])
+
+    vendors = prices.best_vendors(database_name, 'cement', 'MT', '2026-01', '2026-03', project_id)
+    assert [row[0].lower() for row in vendors.rows] == ['bharat supply', 'ace traders']
+    assert vendors.rows[1][-1] == pytest.approx(19500 / 2.5)
+    assert prices.cheapest_vendor(database_name, 'Cement', 'MT', '2025-10', '2025-12') == ('Cheap Co', 5000)
+    assert prices.priced_items(database_name, project_id) == [('Cement', 'MT')]
+    assert [row[0] for row in prices.price_trend(database_name, 'Cement', 'MT').rows] == \
+        ['2025-12', '2026-01', '2026-02', '2026-03']
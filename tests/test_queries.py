@@ -0,0 +1,64 @@
+"""The statement catalog compiles against the current schema, and report columns come from the whitelist only."""
+import re
+import sqlite3
+from contextlib import closing
+import pytest
+import services
+import queries
+from queries import STATEMENTS, REPORT_COLUMNS, report_column
+
+
+def parameter_count(sql):
+    numbered = [int(number) for number in re.findall(r'\?(\d+)', sql)]
+    return max(numbered) if numbered else sql.count('?')
+
+
+@pytest.fixture(scope='module')
+def schema(tmp_path_factory):
+    """A connection to a fresh database, with a second one attached as `live` for the project copy statements."""
+    path = str(tmp_path_factory.mktemp('schema') / 'fresh.db')
+    services.create_schema(path)
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('ATTACH DATABASE ? AS live', (path,))
+        yield conn
+
+
+@pytest.mark.parametrize('name', sorted(STATEMENTS))
+def test_statement_prepares(schema, name):
+    sql = queries.statement(name)
+    schema.execute(f'EXPLAIN {sql}', [None] * parameter_count(sql))
+
+
+@pytest.mark.parametrize('sql', [
+    queries.expenses_pivot_statement(['Material', 'Labour "Day"']),
+    queries.purchase_amounts_statement(['Basement', "Roof's Top"]),
+])
+def test_pivot_statements_prepare(schema, sql):
+    schema.execute(f'EXPLAIN {sql}', [None] * parameter_count(sql))
+
+
+def test_unknown_statement():
+    with pytest.raises(KeyError):
+        queries.statement('purchases.drop_everything')
+
+
+@pytest.mark.parametrize('choice, column', [('Mode Of Payment', 'mode_of_payment'), ('vendor', 'vendor'),
+                                            (' Stage ', 'stage'), ('CATEGORY', 'category')])
+def test_report_column_accepts_the_whitelist(choice, column):
+    assert report_column(choice) == column
+    assert f'reports.purchases_by_{column}' in STATEMENTS
+
+
+@pytest.mark.parametrize('choice', ['item_name', 'purchase_amount', 'vendor; DROP TABLE purchases', '1=1', ''])
+def test_report_column_rejects_other_columns(database, choice):
+    with pytest.raises(ValueError, match='Unknown report column'):
+        report_column(choice)
+    with pytest.raises(ValueError):
+        services.purchase_data_by_column(database, choice, 'x', 1)
+    with pytest.raises(ValueError):
+        services.distinct_column_values(database, choice)
+
+
+def test_report_statements_cover_the_whitelist():
+    by_column = {name.rsplit('_by_', 1)[1] for name in STATEMENTS if name.startswith('reports.purchases_by_')}
+    assert by_column == set(REPORT_COLUMNS)
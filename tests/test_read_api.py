@@ -0,0 +1,80 @@
+"""The read API over a directory of user databases, served on a free local port."""
+import os
+import json
+import shutil
+import threading
+import urllib.request
+from urllib.error import HTTPError
+import pytest
+import services
+import read_api
+
+
+@pytest.fixture
+def api(database, tmp_path):
+    """Base URL of a read API serving a root with the generated database as tenant/site.db."""
+    root = tmp_path / 'root'
+    (root / 'tenant').mkdir(parents=True)
+    shutil.copy(database, root / 'tenant' / 'site.db')
+    read_api.clear_cache()
+    server = read_api.ReadApiServer(('127.0.0.1', 0), str(root))
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def get(url, etag=None):
+    """(status, headers, decoded body or None) of a GET request."""
+    request = urllib.request.Request(url, headers={'If-None-Match': etag} if etag else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, json.loads(response.read())
+    except HTTPError as e:
+        body = e.read()
+        return e.code, e.headers, json.loads(body) if body else None
+
+
+def test_list_databases(api):
+    status, _, body = get(f'{api}/databases')
+    assert status == 200
+    assert body == {'databases': ['tenant/site.db']}
+
+
+def test_etag_revalidation(api):
+    url = f'{api}/purchases?database=tenant/site.db&project_id=1&limit=10'
+    status, headers, body = get(url)
+    assert status == 200 and len(body['purchases']) == 10
+    etag = headers['ETag']
+
+    status, headers, body = get(url, etag)
+    assert (status, headers['ETag'], body) == (304, etag, None)
+    # Another request has another tag
+    assert get(f'{api}/purchases?database=tenant/site.db&project_id=2&limit=10', etag)[0] == 200
+
+
+def test_etag_changes_with_the_database(api, tmp_path):
+    url = f'{api}/projects?database=tenant/site.db'
+    _, headers, _ = get(url)
+    services.delete_project(str(tmp_path / 'root' / 'tenant' / 'site.db'), 3)
+
+    status, changed, body = get(url, headers['ETag'])
+    assert status == 200 and changed['ETag'] != headers['ETag']
+    assert 3 not in [project['project_id'] for project in body['projects']]
+
+
+@pytest.mark.parametrize('path, status', [('/nowhere', 404), ('/projects?database=tenant/other.db', 404),
+                                          ('/projects', 400), ('/purchases?database=tenant/site.db', 400)])
+def test_bad_requests(api, path, status):
+    assert get(f'{api}{path}')[0] == status
+
+
+def test_unavailable_file(api, monkeypatch):
+    def unreadable(database_name):
+        raise PermissionError(f'Permission denied: {os.path.basename(database_name)}')
+    monkeypatch.setattr(services, 'database_version', unreadable)
+
+    status, _, body = get(f'{api}/projects?database=tenant/site.db')
+    assert status == 503
+    assert body == {'error': "The database is not available."}
@@ -0,0 +1,115 @@
+"""Splitting a database moves every row of a project into its shard and leaves none behind in the catalog."""
+import os
+import sqlite3
+from contextlib import closing
+import pytest
+import services
+import shards
+import portfolio
+
+# Tables with rows of a single project, and the per-project totals compared before and after the split
+PROJECT_TABLES = ['purchases', 'vendor_ledger', 'vendor_balances', 'budgets', 'budget_actuals', 'budget_burn',
+                  'unit_prices']
+TOTALS = {
+    'purchases': 'SELECT COUNT(*), round(SUM(purchase_amount), 6) FROM purchases WHERE project_id = ?',
+    'vendor_ledger': 'SELECT round(SUM(purchased), 6), round(SUM(paid), 6) FROM vendor_ledger WHERE project_id = ?',
+    'budgets': 'SELECT COUNT(*), round(SUM(amount), 6) FROM budgets WHERE project_id = ?',
+    'budget_actuals': 'SELECT round(SUM(purchased), 6) FROM budget_actuals WHERE project_id = ?',
+    'unit_prices': 'SELECT round(SUM(amount), 6), SUM(purchases) FROM unit_prices WHERE project_id = ?',
+}
+
+
+def totals(database_name, project_id):
+    with closing(sqlite3.connect(database_name)) as conn:
+        return {table: conn.execute(query, (project_id,)).fetchone() for table, query in TOTALS.items()}
+
+
+def project_rows(database_name, project_id):
+    with closing(sqlite3.connect(database_name)) as conn:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table} WHERE project_id = ?', (project_id,)).fetchone()[0]
+                for table in PROJECT_TABLES}
+
+
+@pytest.fixture
+def budgeted(database):
+    for project_id in (1, 2, 3):
+        services.set_budget(database, project_id, 'Roof', 'Material', 100000 * project_id)
+    return database
+
+
+def test_create_shard_moves_the_project(budgeted):
+    before = totals(budgeted, 1)
+    path = shards.create_shard(budgeted, 1)
+
+    assert shards.project_database(budgeted, 1) == path
+    assert shards.project_database(budgeted, 2) == budgeted
+    assert set(project_rows(budgeted, 1).values()) == {0}
+    assert all(project_rows(path, 1).values())
+    assert totals(path, 1) == before
+    assert services.get_project(path, 1) == services.get_project(budgeted, 1)
+
+
+def test_split_database(budgeted):
+    before = {project_id: totals(budgeted, project_id) for project_id in (1, 2, 3)}
+    paths = shards.split_database(budgeted)
+
+    assert paths == [shards.shard_path(budgeted, project_id) for project_id in (1, 2, 3)]
+    assert shards.local_shards(budgeted) == paths
+    for project_id, path in zip((1, 2, 3), paths):
+        assert set(project_rows(budgeted, project_id).values()) == {0}
+        assert totals(path, project_id) == before[project_id]
+    # Already split: nothing left to move
+    assert shards.split_database(budgeted) == []
+
+
+def test_purge_keeps_the_audit_log_append_only(budgeted):
+    shards.create_shard(budgeted, 1)
+    with pytest.raises(sqlite3.DatabaseError):
+        with services.transaction(budgeted) as conn:
+            conn.execute('DELETE FROM audit_log')
+
+
+def test_delete_project_marks_both(budgeted):
+    path = shards.create_shard(budgeted, 1)
+    live = project_rows(path, 1)['purchases']
+
+    assert shards.delete_project(budgeted, 1) == live
+    for database_name in (budgeted, path):
+        with closing(sqlite3.connect(database_name)) as conn:
+            assert conn.execute('SELECT deleted_at FROM projects WHERE project_id = 1').fetchone()[0] is not None
+    with closing(sqlite3.connect(path)) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM purchases WHERE deleted_at IS NULL').fetchone()[0] == 0
+
+
+def test_portfolio_reads_shards_with_their_catalog(budgeted):
+    root = os.path.dirname(budgeted)
+    before, _ = portfolio.aggregate_database(budgeted, root)
+    shards.split_database(budgeted)
+
+    assert portfolio.find_portfolio_databases(root) == [budgeted]
+    after, _ = portfolio.aggregate_database(budgeted, root)
+    assert sorted(after) == sorted(before)
+    assert {row[0] for row in after} == {'site.db'}
+
+
+def audit_triggers(database_name):
+    with closing(sqlite3.connect(database_name)) as conn:
+        return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                                                 "AND name LIKE '%\\_audit\\_%' ESCAPE '\\'")}
+
+
+def test_failed_copy_keeps_the_audit_triggers(budgeted, tmp_path):
+    target = str(tmp_path / 'target.db')
+    services.create_schema(target)
+    triggers = audit_triggers(target)
+    services.copy_project(budgeted, target, 1)
+    # The project is there already, so the copy fails after the triggers were dropped
+    with pytest.raises(sqlite3.IntegrityError):
+        services.copy_project(budgeted, target, 1)
+
+    assert audit_triggers(target) == triggers
+    with closing(sqlite3.connect(target)) as conn:
+        logged = conn.execute('SELECT COUNT(*) FROM audit_log').fetchone()[0]
+    services.set_budget(target, 1, 'Roof', 'Labour', 5000)
+    with closing(sqlite3.connect(target)) as conn:
+        assert conn.execute('SELECT COUNT(*) FROM audit_log').fetchone()[0] == logged + 1
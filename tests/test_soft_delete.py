@@ -0,0 +1,69 @@
+"""Soft delete, restore and the audit log they write, the change feed the outbox and the report caches follow."""
+import json
+import sqlite3
+import pytest
+import services
+from services import transaction
+
+
+def live_purchases(database_name, project_id=None):
+    sql = 'SELECT COUNT(*) FROM purchases WHERE deleted_at IS NULL'
+    if project_id is None:
+        return services.query_column(database_name, sql)[0]
+    return services.query_column(database_name, sql + ' AND project_id = ?', (project_id,))[0]
+
+
+def actions_since(database_name, audit_id):
+    return [(entry.table_name, entry.row_id, entry.action) for entry in services.audit_entries(database_name, audit_id)]
+
+
+def test_delete_and_restore_count_the_changed_rows(database):
+    live = live_purchases(database)
+
+    assert services.delete_purchases(database, [1, 2, 3]) == 3
+    assert live_purchases(database) == live - 3
+    # Already deleted or unknown rows are not counted again
+    assert services.delete_purchases(database, [3, 4, 999999]) == 1
+    assert live_purchases(database) == live - 4
+
+    assert services.restore_purchases(database, [1, 2, 5]) == 2
+    assert live_purchases(database) == live - 2
+
+
+def test_every_action_is_logged(database):
+    start = services.latest_audit_id(database)
+
+    services.delete_purchases(database, [1, 2])
+    services.restore_purchases(database, [2])
+    with transaction(database) as conn:
+        conn.execute('UPDATE purchases SET vendor = ? WHERE purchase_id = 3', ('Vendor 0009',))
+        conn.execute('DELETE FROM purchases WHERE purchase_id = 4')
+
+    assert actions_since(database, start) == [('purchases', 1, 'delete'), ('purchases', 2, 'delete'),
+                                              ('purchases', 2, 'restore'), ('purchases', 3, 'update'),
+                                              ('purchases', 4, 'purge')]
+    update = services.audit_entries(database, start)[3]
+    assert json.loads(update.payload)['vendor'] == 'Vendor 0009'
+    assert services.count_audit_entries(database, start) == 5
+
+
+def test_delete_project_deletes_its_purchases(database):
+    live = live_purchases(database, 1)
+    start = services.latest_audit_id(database)
+
+    assert services.delete_project(database, 1) == live
+    assert live_purchases(database, 1) == 0
+    assert live_purchases(database, 2) > 0
+    actions = actions_since(database, start)
+    assert actions[0] == ('projects', 1, 'delete')
+    assert actions[1:] == [('purchases', row_id, 'delete') for _, row_id, _ in actions[1:]]
+    assert len(actions) == live + 1
+
+
+@pytest.mark.parametrize('sql', ['DELETE FROM audit_log', "UPDATE audit_log SET action = 'insert'"])
+def test_audit_log_is_append_only(database, sql):
+    entries = services.count_audit_entries(database)
+    with pytest.raises(sqlite3.IntegrityError, match='append-only'):
+        with transaction(database) as conn:
+            conn.execute(sql)
+    assert services.count_audit_entries(database) == entries
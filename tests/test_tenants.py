@@ -0,0 +1,86 @@
+"""Tenant keys and Drive names decide whose file a user reads; admission bounds the active tenants."""
+import os
+import pytest
+import tenants
+from tenants import TenantCapacityError
+
+
+@pytest.fixture
+def slots(tmp_path, monkeypatch):
+    """Tenant directories under tmp_path and an empty active set of two slots; returns the evicted paths."""
+    monkeypatch.setattr(tenants, 'TENANT_ROOT', str(tmp_path))
+    monkeypatch.setattr(tenants, 'MAX_ACTIVE_TENANTS', 2)
+    monkeypatch.setattr(tenants, '_active', tenants.OrderedDict())
+    evicted = []
+    monkeypatch.setattr(tenants, '_eviction_hooks', [evicted.append])
+    return evicted
+
+
+def test_tenant_key_is_stable_and_normalized():
+    key = tenants.tenant_key('Alice@Example.com ')
+    assert key == tenants.tenant_key('alice@example.com')
+    assert tenants.TENANT_KEY.fullmatch(key)
+
+
+def test_same_local_part_on_other_domains():
+    assert tenants.tenant_key('alice@x.com') != tenants.tenant_key('alice@y.com')
+
+
+def test_database_path(slots, tmp_path):
+    first, second = tenants.database_path('alice@x.com'), tenants.database_path('alice@y.com')
+    assert os.path.basename(first) == os.path.basename(second) == 'alice.db'
+    assert first != second
+    assert os.path.dirname(first) == os.path.join(str(tmp_path), tenants.tenant_key('alice@x.com'))
+
+
+def test_remote_name(slots):
+    key = tenants.tenant_key('alice@x.com')
+    path = tenants.database_path('alice@x.com')
+    assert tenants.remote_name(path) == f'{key}-alice.db'
+    assert tenants.remote_name(path.replace('alice.db', 'alice.project-2.db')) == f'{key}-alice.project-2.db'
+    assert tenants.remote_name(tenants.database_path('alice@y.com')) != tenants.remote_name(path)
+
+
+@pytest.mark.parametrize('path', ['alice.db', os.path.join('data', 'alice.db'),
+                                  os.path.join('0123456789abcdeF', 'alice.db')])
+def test_remote_name_outside_a_tenant_directory(path):
+    assert tenants.remote_name(path) == 'alice.db'
+
+
+def test_admit_returns_the_database(slots):
+    assert tenants.admit('alice@x.com', now=0) == tenants.database_path('alice@x.com')
+    assert tenants.admit('alice@x.com', now=10) == tenants.database_path('alice@x.com')
+    assert tenants.active_tenants() == 1
+
+
+def test_admit_evicts_the_least_recently_used_idle_tenant(slots):
+    tenants.admit('alice@x.com', now=0)
+    tenants.admit('bob@x.com', now=10)
+    # Alice comes back, so Bob is now the least recently used
+    tenants.admit('alice@x.com', now=20)
+    later = 10 + tenants.IDLE_SECONDS
+
+    tenants.admit('carol@x.com', now=later)
+    assert slots == [tenants.database_path('bob@x.com')]
+    assert tenants.active_tenants() == 2
+
+
+def test_admit_refuses_when_no_tenant_is_idle(slots):
+    tenants.admit('alice@x.com', now=0)
+    tenants.admit('bob@x.com', now=10)
+    with pytest.raises(TenantCapacityError):
+        tenants.admit('carol@x.com', now=tenants.IDLE_SECONDS - 1)
+    assert slots == []
+    # Tenants already active are always admitted
+    tenants.admit('bob@x.com', now=tenants.IDLE_SECONDS - 1)
+
+
+def test_failing_hook_does_not_stop_the_others(slots, monkeypatch):
+    def failing(path):
+        raise RuntimeError('hook failed')
+    monkeypatch.setattr(tenants, '_eviction_hooks', [failing, slots.append])
+    tenants.admit('alice@x.com', now=0)
+    tenants.admit('bob@x.com', now=0)
+
+    assert tenants.admit('carol@x.com', now=tenants.IDLE_SECONDS) == tenants.database_path('carol@x.com')
+    assert slots == [tenants.database_path('alice@x.com')]
@@ -2,27 +2,30 @@ import sqlite3
 import streamlit as st
 import os
 from datetime import datetime
-import pandas as pd
 from time import sleep
 import datetime
+import services
+import outbox
+import tenants
+import archive
+import shards
+import duplicates
+from services import connect_db, SyncError, database_version
 
 
 def db_name_creation():
     try:
         if 'user_email' in st.session_state and st.session_state['user_email']:
-            user_email = st.session_state['user_email'].split('@')[0]
-            database_name = f'{user_email}.db'
-            return database_name
+            # Each user's files live in their own tenant directory
+            return tenants.admit(st.session_state['user_email'])
         else:
             st.error('Unable to identify the user !!')
+    except tenants.TenantCapacityError as e:
+        st.error(str(e))
     except Exception as e:
         st.error(f'Error while creating db file {e}')
 
 
-def connect_db(database_name):
-    return sqlite3.connect(database_name)
-
-
 def db_cursor(database_name):
     # Try connecting to the database and executing the query
     connection = connect_db(database_name)
@@ -30,6 +33,11 @@ def db_cursor(database_name):
     return connection, conn_cursor
 
 
+def is_admin():
+    """True for the office administrators listed in the [portfolio] secrets, who may see every user's data."""
+    return st.session_state.get('user_email') in st.secrets.get('portfolio', {}).get('admins', [])
+
+
 def cursor_conn():
     database_name = db_name_creation()
     connection, cursor = db_cursor(database_name)
@@ -44,112 +52,9 @@ def create_tables_in_db(database_name):
     """
     Creates necessary tables in the database.
     """
-
-    stages_to_insert = [
-        ('STAGE-1', 'Basement'),
-        ('STAGE-2', 'Roof'),
-        ('STAGE-3', 'Masonry'),
-        ('STAGE-4', 'Finishes'),
-        ('STAGE-5', 'Site Work and Fixtures')
-    ]
-
-    categories_to_insert = [
-        "General",
-        "Material",
-        "MEP Labour",
-        "Mason Labour",
-        "Misc Civil Labour",
-        "Paint Labour",
-        "Tiling Labour",
-        "Joinery"
-    ]
-
-    modes_of_payment_to_insert = [
-        "No Payment",
-        "UPI",
-        "Credit Card",
-        "Debit Card",
-        "Cash",
-        "Bank Transfer"
-    ]
-
     try:
-        with connect_db(database_name) as conn:
-            cursor = conn.cursor()
-            # Example table creation queries
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS "projects" (
-                    "project_id"	INTEGER,
-                    "project_name"	TEXT NOT NULL,
-                    "project_location"	TEXT,
-                    PRIMARY KEY("project_id" AUTOINCREMENT)
-                );     
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS "purchases" (
-                    "purchase_id"	INTEGER,
-                    "project_id"	INTEGER NOT NULL,
-                    "item_name"	TEXT NOT NULL,
-                    "item_qty"	REAL,
-                    "unit"	TEXT,
-                    "vendor"	TEXT NOT NULL,
-                    "stage"	TEXT NOT NULL,
-                    "category"	TEXT NOT NULL,
-                    "date"	TEXT NOT NULL,
-                    "purchase_amount"	REAL NOT NULL,
-                    "mode_of_payment"	TEXT NOT NULL,
-                    "paid_amount"	REAL,
-                    "paid_by"	TEXT,
-                    "notes"	TEXT,
-                    PRIMARY KEY("purchase_id" AUTOINCREMENT),
-                    CONSTRAINT "project_fk" FOREIGN KEY("project_id") REFERENCES "projects"("project_id")
-                );
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS "stages" (
-                    "stage_id"	TEXT NOT NULL,
-                    "stage"	TEXT NOT NULL
-                );
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS "category" (
-                    "category"	TEXT
-                );
-            ''')
-
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS "mode_of_payment" (
-                    "mode_of_payment"	TEXT
-                );
-            ''')
-
-            for stage_id, stage_name in stages_to_insert:
-                cursor.execute('''
-                    INSERT INTO stages (stage_id, stage)
-                    SELECT ?, ?
-                    WHERE NOT EXISTS (SELECT 1 FROM stages WHERE stage_id = ? OR stage = ?)
-                ''', (stage_id, stage_name, stage_id, stage_name))
-
-            for category in categories_to_insert:
-                cursor.execute('''
-                    INSERT INTO category (category)
-                    SELECT ?
-                    WHERE NOT EXISTS (SELECT 1 FROM category WHERE category = ?)
-                ''', (category, category))
-
-            for mode_of_payment in modes_of_payment_to_insert:
-                cursor.execute('''
-                    INSERT INTO mode_of_payment (mode_of_payment)
-                    SELECT ?
-                    WHERE NOT EXISTS (SELECT 1 FROM mode_of_payment WHERE mode_of_payment = ?)
-                ''', (mode_of_payment, mode_of_payment))
-
-            # Connection commit and close
-            st.success("Tables created successfully!")
-            conn.commit()
+        services.create_schema(database_name)
+        st.success("Tables created successfully!")
 
     except Exception as e:
         st.error(f"Error creating tables: {e}")
@@ -167,40 +72,28 @@ def create_new_project(database_name):
         project_submission = st.form_submit_button('Create')
 
     if project_submission:
-        if project_name:  # Check if the project name is provided
-            with connect_db(database_name) as conn:
-                # Insert the new project into the database
-                cursor = conn.cursor()
-                cursor.execute('''INSERT INTO projects 
-                                  (project_name, project_location)
-                                  VALUES (?, ?)''',
-                               (project_name, project_location))
-                conn.commit()  # Commit the changes
-                st.success("New project created successfully!")
-        else:
-            st.error('Please enter the project name')
+        try:
+            if shards.enabled():
+                shards.create_project(database_name, project_name, project_location)
+            else:
+                services.create_project(database_name, project_name, project_location)
+            st.success("New project created successfully!")
+        except ValueError as e:
+            st.error(str(e))
 
 
-def delete_the_last_project(database_name):
+def delete_project(database_name):
+    """Deletes a project together with all of its purchases."""
     with st.form('Delete a Project'):
-        project_query = "SELECT project_id || ' - ' || project_name AS project FROM projects;"
-        project = fetch_data_from_db(project_query, database_name)
+        project = [p.label for p in services.list_projects(database_name)]
         project_id_selection = st.selectbox('Select a project to delete:', project)
         project_submission = st.form_submit_button('Delete')
-        project_id_selected = project_id_selection.split(' - ')[0]
 
     if project_submission:
         try:
             if project_id_selection:
-                with connect_db(database_name) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(f"""select max(project_id) from projects 
-                                        where project_id not in ({project_id_selected})""")
-                    b = cursor.fetchone()[0]
-                    cursor.execute(f"UPDATE sqlite_sequence SET seq = {b} WHERE name = 'projects';")
-                    cursor.execute(f'''DELETE FROM projects WHERE project_id = {project_id_selected}''')
-                    conn.commit()
-                    st.success("Project deleted successfully!")
+                deleted_purchases = shards.delete_project(database_name, int(project_id_selection.split(' - ')[0]))
+                st.success(f"Project deleted successfully along with {deleted_purchases} purchases!")
             else:
                 st.error('Select a valid project id')
         except Exception as e:
@@ -208,48 +101,63 @@ def delete_the_last_project(database_name):
 
 
 def edit_project(database_name):
-    with connect_db(database_name) as conn:
-        cursor = conn.cursor()
-        # Fetch the list of projects
-        cursor.execute("SELECT project_id, project_name || ' - ' || project_location AS project_info FROM projects")
-        projects = cursor.fetchall()
-
-        if projects:
-            # Convert fetched projects into a dictionary for easier selection
-            project_dict = {f"{p[1]}": p[0] for p in projects}
-
-            # Allow the user to select a project
-            selected_project = st.selectbox("Select the project to edit:", list(project_dict.keys()))
-            selected_project_id = project_dict[selected_project]
-
-            # Fetch the current project details
-            cursor.execute("SELECT project_name, project_location FROM projects WHERE project_id = ?",
-                           (selected_project_id,))
-            project_details = cursor.fetchone()
-
-            # Prepopulate the current project details in input fields
-            new_project_name = st.text_input("Edit Project Name:", value=project_details[0])
-            new_project_location = st.text_input("Edit Project Location:", value=project_details[1])
-
-            if st.button("Save Changes"):
-                # Update the project details in the database
-                cursor.execute("""
-                    UPDATE projects 
-                    SET project_name = ?, project_location = ? 
-                    WHERE project_id = ?
-                """, (new_project_name, new_project_location, selected_project_id))
-                conn.commit()
-                # Set a flag in session_state before rerunning
-                st.session_state['project_updated'] = True
-                st.rerun()
-
-            # Check for the success flag in session_state
-            if 'project_updated' in st.session_state and st.session_state['project_updated']:
-                st.success("Project details updated successfully!")
-                # Reset the flag to prevent showing success again on the next rerun
-                st.session_state['project_updated'] = False
-        else:
-            st.warning("No projects found.")
+    # Fetch the list of projects
+    projects = services.list_projects(database_name)
+
+    if projects:
+        # Convert fetched projects into a dictionary for easier selection
+        project_dict = {f"{p.project_name} - {p.project_location}": p for p in projects}
+
+        # Allow the user to select a project
+        selected_project = st.selectbox("Select the project to edit:", list(project_dict.keys()))
+        project_details = project_dict[selected_project]
+
+        # Prepopulate the current project details in input fields
+        new_project_name = st.text_input("Edit Project Name:", value=project_details.project_name)
+        new_project_location = st.text_input("Edit Project Location:", value=project_details.project_location)
+
+        if st.button("Save Changes"):
+            # Update the project details in the database
+            shards.update_project(database_name, project_details.project_id, new_project_name,
+                                  new_project_location)
+            # Set a flag in session_state before rerunning
+            st.session_state['project_updated'] = True
+            st.rerun()
+
+        # Check for the success flag in session_state
+        if 'project_updated' in st.session_state and st.session_state['project_updated']:
+            st.success("Project details updated successfully!")
+            # Reset the flag to prevent showing success again on the next rerun
+            st.session_state['project_updated'] = False
+    else:
+        st.warning("No projects found.")
+
+
+def open_project(service, database_name, project_id):
+    """Database of the selected project, its shard being downloaded the first time it is opened in the session.
+
+    Returns:
+        str: Path of the database, or None (after showing the error) if the project cannot be reached.
+    """
+    opened = st.session_state.setdefault('opened_projects', {})
+    if project_id not in opened:
+        try:
+            with st.spinner("Opening the project..."):
+                opened[project_id] = shards.open_project(service, database_name, project_id,
+                                                         st.session_state['user_email'], download_progress())
+        except SyncError as e:
+            project_db = shards.project_database(database_name, project_id)
+            if not services.has_schema(project_db):
+                st.error(str(e))
+                print(f'Error log: {e}')
+                return None
+            # Offline: keep working on the local copy, the outbox ships the changes once Drive is back
+            st.warning(f"Google Drive is unreachable, working offline on the local copy of the project. ({e})")
+            opened[project_id] = project_db
+    project_db = opened[project_id]
+    if project_db != database_name:
+        start_replayer(project_db)
+    return project_db
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -259,7 +167,7 @@ def edit_project(database_name):
 
 def fetch_data_from_db(query, database_name):
     try:
-        with connect_db(database_name) as conn:
+        with services.reading(database_name) as conn:
             cursor = conn.cursor()
             cursor.execute(query)
             data = [row[0] for row in cursor.fetchall()]
@@ -276,47 +184,40 @@ def fetch_data_from_db(query, database_name):
         return None
 
 
-def fetch_and_display_data(query, database_name):
-    """
-    Execute the given SQL query, fetch the results, and display them in a Streamlit app.
-    Handles any SQL syntax errors and displays appropriate messages.
+# ----------------------------------------------------------------------------------------------------
+# Cached reads
+# ----------------------------------------------------------------------------------------------------
 
-    Args:
-        query (str): The SQL query to be executed.
-        :param query: SQL query
-        :param database_name: db file name
-    """
-    try:
-        with connect_db(database_name) as conn:
-            cursor = conn.cursor()
-            # Execute the SQL query
-            cursor.execute(query)
+# Lookups that every rerun needs are cached per database file version: the cache key changes as soon
+# as anything writes to the file, so they are never stale and cost nothing while nothing is written.
+CACHE_ENTRIES = 256
 
-            # Fetch all rows from the executed query
-            results = cursor.fetchall()
 
-            # Check if there are any results
-            if results:
-                # Convert rows to a pandas DataFrame for better display
-                results_df = pd.DataFrame(results, columns=[desc[0] for desc in cursor.description])
-                # Check if 'Purchase Amount' column exists and apply formatting
-                for col in ['Purchase Amount', 'Paid Amount', 'Difference']:
-                    if col in results_df.columns:
-                        results_df[col] = results_df[col].apply(format_currency)
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def _projects(database_name, version):
+    return services.list_projects(database_name)
 
-                # Display the DataFrame in tabular format
-                st.dataframe(results_df)  # You can also use st.table(df) for a static table
-            else:
-                # Inform the user if no data was found
-                st.warning("No data found for the selected criteria.")
 
-    except sqlite3.OperationalError:
-        # Catch and handle specific MySQL errors
-        st.warning("Please check if you've selected a valid project")
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def _reference_data(database_name, version):
+    return services.reference_data(database_name)
 
-    except Exception as e:
-        # Catch any other exceptions
-        st.error(f"An unexpected error occurred: {e}")
+
+@st.cache_data(max_entries=CACHE_ENTRIES, show_spinner=False)
+def _distinct_column_values(database_name, column, version):
+    return services.distinct_column_values(database_name, column)
+
+
+def cached_projects(database_name):
+    return _projects(database_name, database_version(database_name))
+
+
+def cached_reference_data(database_name):
+    return _reference_data(database_name, database_version(database_name))
+
+
+def cached_distinct_column_values(database_name, column):
+    return _distinct_column_values(database_name, column, database_version(database_name))
 
 
 # ----------------------------------------------------------------------------------------------------
@@ -422,6 +323,170 @@ def format_percentage(value):
     return value
 
 
+# ----------------------------------------------------------------------------------------------------
+# Sync status
+# ----------------------------------------------------------------------------------------------------
+
+# Seconds between two refreshes of the sync status, which reruns on its own without the page
+SYNC_STATUS_INTERVAL = 10
+
+
+def start_replayer(database_name):
+    """Starts the background thread that ships saved changes to Drive (once per database and process)."""
+    from connection_utils import establish_gdrive_connections
+    service_account_info = dict(st.secrets['gdrive'])
+    outbox.start_replayer(lambda: establish_gdrive_connections(service_account_info), database_name,
+                          st.session_state['user_email'])
+
+
+def download_progress():
+    """Progress callback of a database download, showing the progress bar once the download starts."""
+    progress_bar = []
+
+    def show(fraction):
+        if not progress_bar:
+            st.info('Download in progress...')
+            progress_bar.append(st.progress(0))
+        progress_bar[0].progress(fraction)
+    return show
+
+
+def sync_status_sidebar(*database_names):
+    """Shows in the sidebar how many saved changes have not reached Google Drive yet."""
+    with st.sidebar:
+        sync_status(*database_names)
+
+
+@st.fragment(run_every=SYNC_STATUS_INTERVAL)
+def sync_status(*database_names):
+    # The user's database and the opened project's shard are reported as one
+    states = [outbox.read_state(name) for name in dict.fromkeys(database_names)]
+    pending = sum(state.pending for state in states)
+    failing = [state for state in states if state.pending and state.last_error and not state.syncing]
+    if not pending:
+        st.success("All changes are synced to Google Drive")
+    elif any(state.syncing for state in states):
+        st.info(f"Syncing {pending} changes to Google Drive...")
+    elif failing:
+        st.warning(f"{pending} changes pending sync, retrying after {failing[0].attempts} failed "
+                   f"attempts. Last error: {failing[0].last_error}")
+    else:
+        st.warning(f"{pending} changes pending sync")
+
+
+def save_to_drive(service, *database_names):
+    """Pushes the pending changes: hands them to the background replayer, or uploads right away if none runs."""
+    in_background, uploaded = False, []
+    for database_name in dict.fromkeys(database_names):
+        if outbox.request_sync(database_name):
+            in_background = True
+            continue
+        state = outbox.replay(service, database_name, st.session_state['user_email'], force=True)
+        if state.pending:
+            st.warning(f"Saved locally. {state.pending} changes will be synced once Google Drive is reachable "
+                       f"({state.last_error}).")
+        else:
+            uploaded.append(database_name)
+    if in_background:
+        st.info("Your changes are saved locally and are being synced to Google Drive in the background.")
+    if uploaded:
+        st.success("Data saved")
+        for database_name in uploaded:
+            st.success(f"Updated the file with ID: {database_name}")
+        st.rerun()
+
+
+# ----------------------------------------------------------------------------------------------------
+# Budgets
+# ----------------------------------------------------------------------------------------------------
+
+def edit_budgets(database_name, project_id):
+    """Sets the budget of a stage and category of the project; a zero amount removes it."""
+    reference = services.reference_data(database_name)
+    with st.form("budget_form", clear_on_submit=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            stage = st.selectbox("Select stage:", reference.stages, key='budget_stage')
+        with col2:
+            category = st.selectbox("Select category:", reference.categories, key='budget_category')
+        with col3:
+            amount = st.number_input("Budget amount:", min_value=0, max_value=1000000000, value=0,
+                                     key='budget_amount')
+        submitted = st.form_submit_button("Save Budget")
+
+    if submitted:
+        try:
+            services.set_budget(database_name, project_id, stage, category, amount)
+            st.success(f"Budget of {stage} / {category} saved." if amount else
+                       f"Budget of {stage} / {category} removed.")
+        except ValueError as e:
+            st.error(str(e))
+
+
+def show_budget_alerts(database_name, project_id, stages_and_categories):
+    """Warns when a submit brought a budget close to (or over) its limit."""
+    for status in services.budget_alerts(database_name, project_id, stages_and_categories):
+        message = (f"{status.stage} / {status.category} has used {status.used:.0%} of its budget "
+                   f"({format_currency(status.actual)} of {format_currency(status.budget)}).")
+        if status.variance < 0:
+            st.error(f"Over budget: {message}", icon="🚨")
+        else:
+            st.warning(message, icon="⚠️")
+
+
+# ----------------------------------------------------------------------------------------------------
+# Archived projects
+# ----------------------------------------------------------------------------------------------------
+
+def archive_project(database_name):
+    """Moves a finished project out of the working database into an archive."""
+    with st.form('Archive a Project'):
+        projects = [p.label for p in services.list_projects(database_name)]
+        project_id_selection = st.selectbox('Select a finished project to archive:', projects)
+        confirmed = st.checkbox("Its purchases can only be viewed from the archived projects on the Reports page "
+                                "afterwards")
+        project_submission = st.form_submit_button('Archive')
+
+    if project_submission:
+        if not project_id_selection:
+            st.error('Select a valid project id')
+        elif not confirmed:
+            st.warning('Please confirm the project is finished')
+        else:
+            try:
+                archived = archive.archive_project(database_name, int(project_id_selection.split(' - ')[0]))
+                st.success(f"Project archived along with {archived.purchases} purchases! It will be uploaded to "
+                           f"Google Drive with your next changes.")
+            except (ValueError, sqlite3.Error) as e:
+                st.error(f'Error {e}')
+                print(f'Error log: {e}')
+
+
+@st.fragment
+def archived_projects(service, database_name):
+    """Totals of the archived projects, and their purchases once an archive is opened."""
+    projects = archive.list_archived_projects(database_name)
+    if not projects:
+        st.info("No archived projects.")
+        return
+    from reports import display_table
+    display_table(archive.archive_summary(database_name))
+
+    selection = st.selectbox("Select the archived project:", [p.label for p in projects])
+    project_id = int(selection.split(' - ')[0])
+    display_table(archive.archived_totals(database_name, project_id))
+
+    if st.button("Open the archive"):
+        try:
+            with st.spinner("Fetching the archive..."):
+                archive_db = archive.open_archive(service, database_name, project_id)
+        except (ValueError, services.SyncError) as e:
+            st.error(str(e))
+            print(f'Error log: {e}')
+            return
+        display_table(services.view_purchases(archive_db, project_id))
+
+
 # ----------------------------------------------------------------------------------------------------
 # Local file and GDrive file modified time
 # ----------------------------------------------------------------------------------------------------
@@ -429,11 +494,12 @@ def format_percentage(value):
 
 def get_google_drive_modified_time(service, file_id):
     """Fetches the last modified time of a file in Google Drive."""
-    file = service.files().get(fileId=file_id, fields='modifiedTime').execute()
+    from drive_client import lookup
+    file = lookup(service.files().get(fileId=file_id, fields='modifiedTime'))
     modified_time = file['modifiedTime']
 
     # Parse the modified time and convert it to a datetime object
-    gdrive_modified_time = datetime.strptime(modified_time, '%Y-%m-%dT%H:%M:%S.%fZ')
+    gdrive_modified_time = datetime.datetime.strptime(modified_time, '%Y-%m-%dT%H:%M:%S.%fZ')
     return gdrive_modified_time
 
 
@@ -474,316 +540,42 @@ def list_files_in_directory(directory):
     return file_info
 
 
-# ----------------------------------------------------------------------------------------------------
-# Overall Expenses report
-# ----------------------------------------------------------------------------------------------------
-
-def expenses_pivot(database_name):
-    try:
-        with connect_db(database_name) as conn:
-            cursor = conn.cursor()
-            # Fetch distinct categories from the category table
-            cursor.execute("SELECT category FROM category")
-            categories = cursor.fetchall()
-
-            # Check if categories exist
-            if not categories:
-                st.error("No categories found.")
-                return
-
-            # Start building the SQL query for each stage and category
-            sql_query = "SELECT stage as Stage"
-
-            # Add dynamic category columns to the SQL query
-            for (category,) in categories:
-                sql_query += f", COALESCE(SUM(CASE WHEN p.category = '{category}' THEN p.purchase_amount ELSE 0 END), 0) AS '{category}'"
-
-            # Add grand total column for each stage
-            sql_query += ", COALESCE(SUM(p.purchase_amount), 0) AS 'Purchase Amount'"
-
-            # Complete the main SQL query
-            sql_query += " FROM purchases p GROUP BY stage"
-
-            # Start building the UNION query for totals
-            union_query = " UNION ALL SELECT 'Total'"
-
-            # Add totals for each category
-            for (category,) in categories:
-                union_query += f", COALESCE(SUM(CASE WHEN p.category = '{category}' THEN p.purchase_amount ELSE 0 END), 0)"
-
-            # Add grand total
-            union_query += ", COALESCE(SUM(p.purchase_amount), 0) FROM purchases p"
-
-            # Add the row for percentage
-            percentage_query = " UNION ALL SELECT 'Percentage'"
-
-            # First, fetch the grand total to use for percentage calculation
-            cursor.execute("SELECT COALESCE(SUM(purchase_amount), 0) FROM purchases")
-            grand_total = cursor.fetchone()[0]
-
-            # Check if grand total is fetched
-            if grand_total is None:
-                st.error("Failed to fetch grand total.")
-                return
-
-            # Calculate percentage for each category and grand total
-            for (category,) in categories:
-                percentage_query += f", CASE WHEN {grand_total} > 0 THEN ROUND(100 * SUM(CASE WHEN p.category = '{category}' THEN p.purchase_amount ELSE 0 END) / {grand_total}, 2) ELSE 0 END"
-
-            # Grand total percentage (which will always be 100%)
-            percentage_query += f", CASE WHEN {grand_total} > 0 THEN 100 ELSE 0 END FROM purchases p"
-
-            # Combine the main query, totals, and percentage rows
-            final_query = sql_query + union_query + percentage_query
-
-            # Display the final query for debugging
-            # st.write("Executing SQL Query:")
-            # st.code(final_query)
-
-            # Execute the dynamic SQL query
-            cursor.execute(final_query)
-
-            results = cursor.fetchall()
-
-            # Get column names
-            column_names = [desc[0] for desc in cursor.description]
-
-            # Check if results were fetched
-            if not results:
-                st.error("No results found for the query.")
-                return
-
-            # Convert the results into a pandas DataFrame
-            df = pd.DataFrame(results, columns=column_names)
-
-            # Ensure numeric columns are correctly typed
-            for col in df.columns[1:]:  # All columns except 'stage'
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-            # Create a copy for formatted display
-            formatted_df = df.copy()
-
-            # Format all numeric columns (except 'stage') as currency
-            for col in formatted_df.columns[1:-1]:  # All category columns (excluding Grand_Total)
-                formatted_df[col] = formatted_df[col].apply(format_currency)
-
-            grand_total_col = formatted_df.columns[-1]  # Get the last column name (Grand_Total)
-
-            # Change the dtype of the 'Grand_Total' column to 'object' to avoid dtype incompatibility warning
-            formatted_df[grand_total_col] = formatted_df[grand_total_col].astype('object')
-
-            for i in range(len(formatted_df) - 1):  # Loop through all rows except the last one
-                formatted_df.at[i, grand_total_col] = format_currency(df.at[i, grand_total_col])
-
-            # Format the last row (percentage row) correctly
-            last_row_index = formatted_df.index[-1]  # Index of the percentage row
-            for col in formatted_df.columns[1:]:  # All columns except 'stage'
-                if col != 'Stage':
-                    raw_value = df.at[last_row_index, col]  # Get the raw numeric value
-                    formatted_df.at[last_row_index, col] = format_percentage(raw_value)  # Format for display
-
-            # Highlight Total and Percentage rows
-            def highlight_rows(row):
-                if row['Stage'] == 'Total':
-                    return ['background-color: #FF4B4B'] * len(row)
-                elif row['Stage'] == 'Percentage':
-                    return ['background-color: #4B0082'] * len(row)
-                else:
-                    return [''] * len(row)
-
-            # Apply highlighting
-            styled_df = formatted_df.style.apply(highlight_rows, axis=1)
-
-            # Display the styled DataFrame in Streamlit
-            st.dataframe(styled_df, use_container_width=True)
-
-    except sqlite3.Error as err:
-        st.error(f"Database Error: {err}")
-
-
-def purchase_amounts(database_name):
-    try:
-        with connect_db(database_name) as conn:
-            cursor = conn.cursor()
-            # Fetch distinct categories from the category table
-            cursor.execute("SELECT category FROM category")
-            categories = cursor.fetchall()
-
-            # Fetch distinct stages from the stages table
-            cursor.execute("SELECT stage FROM stages")
-            stages = cursor.fetchall()
-
-            # Check if categories or stages exist
-            if not categories or not stages:
-                st.error("No categories or stages found.")
-                return
-
-            # Create a list of stages and categories
-            stages_list = [stage[0] for stage in stages]
-            categories_list = [category[0] for category in categories]
-
-            # Build SQL query to get purchase amounts per category and stage
-            sql_query = "SELECT p.category as Category"
-
-            # Add dynamic stage columns
-            for stage in stages_list:
-                sql_query += f", COALESCE(SUM(CASE WHEN p.stage = '{stage}' THEN p.purchase_amount ELSE 0 END), 0) AS '{stage}'"
-
-            # Add grand total for each category
-            sql_query += ", COALESCE(SUM(p.purchase_amount), 0) AS 'Total'"
-
-            # Complete the SQL query
-            sql_query += " FROM purchases p GROUP BY p.category"
-
-            # Execute the main SQL query
-            cursor.execute(sql_query)
-            results = cursor.fetchall()
-
-            # Convert the results into a pandas DataFrame
-            column_names = ['Category'] + stages_list + ['Total']
-            df = pd.DataFrame(results, columns=column_names)
-
-            # Ensure all categories are included, even if they have no purchases
-            all_categories_df = pd.DataFrame(categories_list, columns=['Category'])
-            df = pd.merge(all_categories_df, df, on='Category', how='left').fillna(0)
-
-            # Calculate the grand total for each stage (column total)
-            grand_total_row = df.sum(numeric_only=True).to_frame().T
-            grand_total_row.insert(0, 'Category', 'Grand Total')
-
-            # Append the grand total row to the DataFrame
-            df = pd.concat([df, grand_total_row], ignore_index=True)
-
-            # Calculate percentage for each category based on the grand total
-            grand_total = grand_total_row['Total'].iloc[0]
-
-            if grand_total > 0:
-                df['Percentage'] = (df['Total'] / grand_total * 100).round(2)
-            else:
-                df['Percentage'] = 0
-
-            # Calculate the percentage for each stage (column percentage)
-            percentage_row = pd.DataFrame(columns=df.columns)
-            percentage_row.loc[0] = ['Percentage'] + [
-                (df[stage].iloc[:-1].sum() / grand_total * 100).round(2) if grand_total > 0 else 0
-                for stage in stages_list
-            ] + [100, '']
-
-            # Append the percentage row to the DataFrame
-            df = pd.concat([df, percentage_row], ignore_index=True)
-
-            # Ensure numeric columns are correctly typed
-            for col in df.columns[1:]:  # All columns except 'Category'
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-            # Create a copy for formatted display
-            formatted_df = df.copy()
-
-            # Format all numeric columns (except 'Category') as currency
-            for col in formatted_df.columns[1:-2]:  # All columns except 'Category', 'Total', and 'Percentage'
-                formatted_df[col] = formatted_df[col].apply(format_currency)
-
-            # Format Total column
-            formatted_df['Total'] = formatted_df['Total'].apply(format_currency)
-
-            # Format Percentage column (ensure no currency formatting)
-            formatted_df['Percentage'] = formatted_df['Percentage'].apply(format_percentage)
-
-            grand_total_col = formatted_df.columns[-2]
-            # Change the dtype of the 'Grand_Total' column to 'object' to avoid dtype incompatibility warning
-            formatted_df[grand_total_col] = formatted_df[grand_total_col].astype('object')
-
-            for i in range(len(formatted_df) - 1):  # Loop through all rows except the last one
-                formatted_df.at[i, grand_total_col] = format_currency(df.at[i, grand_total_col])
-
-            # Format the last row (percentage row) correctly
-            last_row_index = formatted_df.index[-1]  # Index of the percentage row
-            for col in formatted_df.columns[1:]:  # All columns except 'stage'
-                if col != 'Stage':
-                    raw_value = df.at[last_row_index, col]  # Get the raw numeric value
-                    formatted_df.at[last_row_index, col] = format_percentage(raw_value)
-
-            def highlight_rows(row):
-                styles = [''] * len(row)
-
-                # Highlight entire row for Grand Total
-                if row['Category'] == 'Grand Total':
-                    styles = ['background-color: #93c47d'] * len(row)  # Gold for Grand Total
-                # Highlight entire row for Percentage
-                elif row['Category'] == 'Percentage':
-                    styles = ['background-color: #FF4B4B'] * len(row)  # Indigo for Percentage
-
-                return styles
-
-            def highlight_last_column(s):
-                # Create a default style
-                styles = pd.DataFrame('', index=s.index, columns=s.columns)
-
-                styles.iloc[:, -1] = ['background-color: #FF4B4B']
-                styles.iloc[:, -2] = ['background-color: #93c47d']
-                return styles
-
-            # Function to highlight the last value of the second-to-last column
-            def highlight_last_value(s):
-                # Create a default style DataFrame with empty strings
-                styles = pd.DataFrame('', index=s.index, columns=s.columns)
-
-                # Get the index of the last row
-                last_index_in_df = s.index[-1]
-
-                # Apply color to the last value of the second-to-last column
-                styles.iloc[last_index_in_df, -2] = 'background-color: #FF4B4B'  # Change color (Tomato)
-
-                return styles
-
-            # Apply row highlighting
-            styled_df = formatted_df.style.apply(highlight_rows, axis=1)
-            styled_df = styled_df.apply(highlight_last_column, axis=None)
-            styled_df = styled_df.apply(highlight_last_value, axis=None)
-
-            # Display the styled DataFrame in Streamlit
-            st.dataframe(styled_df, use_container_width=True)
-
-    except sqlite3.Error as err:
-        st.error(f"Database Error: {err}")
-
-
 # ----------------------------------------------------------------------------------------------------
 # Delete Record Function
 # ----------------------------------------------------------------------------------------------------
 
-def delete_purchase_record(database_name):
-    # Fetch existing purchase IDs for deletion
-    purchases_query = "SELECT purchase_id FROM purchases"
-    purchases = fetch_data_from_db(purchases_query, database_name)
-
-    # Convert list of tuples to a list of IDs for the select box
-    purchases_with_blank = ["Select Purchase ID to delete"] + purchases  # Flatten the list of tuples
+def delete_purchase_records(database_name, project_id):
+    """Deletes the selected purchases of the project in one go, after a confirmation."""
+    # Only the selected project's purchases are offered
+    purchases = services.list_purchase_ids(database_name, project_id)
 
     with st.form("delete_form"):
-        purchase_id = st.selectbox("Select Purchase ID", purchases_with_blank)
+        purchase_ids = st.multiselect("Select Purchase IDs to delete", purchases)
         submitted = st.form_submit_button("Delete")
 
-        if submitted and purchase_id != "Select Purchase ID to delete":
-            # Set the purchase ID in session state for confirmation
-            st.session_state.purchase_id_to_delete = purchase_id
+        if submitted and purchase_ids:
+            # Set the purchase IDs in session state for confirmation
+            st.session_state.purchase_ids_to_delete = purchase_ids
             st.session_state.confirm_delete = True
 
     # Confirmation message and action
     if st.session_state.get("confirm_delete", False):
-        st.warning(f"Are you sure you want to delete Purchase ID: {st.session_state.purchase_id_to_delete}?", icon="⚠️")
-        fetch_and_display_data(f'select * from purchases where purchase_id = {st.session_state.purchase_id_to_delete}', database_name)
+        purchase_ids = st.session_state.purchase_ids_to_delete
+        st.warning(f"Are you sure you want to delete {len(purchase_ids)} purchases?", icon="⚠️")
+        # Reporting pulls in pandas, so it is only imported once a deletion is being confirmed
+        from reports import display_table
+        selected = set(purchase_ids)
+        purchases_table = services.view_purchases(database_name, project_id)
+        purchases_table.rows = [row for row in purchases_table.rows if row[0] in selected]
+        display_table(purchases_table)
 
         # Buttons for confirmation
         if st.button("Yes, delete"):
             try:
-                with connect_db(database_name) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("DELETE FROM purchases WHERE purchase_id = ?", (st.session_state.purchase_id_to_delete,))
-                    conn.commit()
-                    st.success(f"Purchase ID {st.session_state.purchase_id_to_delete} deleted successfully.")
-                    # Reset the session state
-                    st.session_state.confirm_delete = False
+                deleted = services.delete_purchases(database_name, purchase_ids)
+                st.success(f"{deleted} purchases deleted successfully.")
+                # Reset the session state
+                st.session_state.confirm_delete = False
             except sqlite3.Error as e:
                 st.error(f"An error occurred while deleting: {e}")
 
@@ -795,3 +587,32 @@ def delete_purchase_record(database_name):
         # Reset the form if needed after the operation
         if not st.session_state.get("confirm_delete", False):
             st.rerun()
+
+
+def restore_purchase_records(database_name, project_id):
+    """Brings back purchases deleted by mistake."""
+    deleted_purchases = services.list_deleted_purchase_ids(database_name, project_id)
+    if not deleted_purchases:
+        st.info("No deleted purchases in this project.")
+        return
+
+    with st.form("restore_form"):
+        purchase_ids = st.multiselect("Select Purchase IDs to restore", deleted_purchases)
+        submitted = st.form_submit_button("Restore")
+
+    if submitted and purchase_ids:
+        restored = services.restore_purchases(database_name, purchase_ids)
+        st.success(f"{restored} purchases restored successfully.")
+
+
+def duplicate_purchases(database_name, project_id):
+    """Lists the saved purchases of the project that look like an earlier one entered twice."""
+    if st.button("Scan for duplicates"):
+        from reports import display_table
+        found = duplicates.scan_duplicates(database_name, project_id)
+        if found.rows:
+            st.warning(f"{len(found.rows)} purchases look like duplicates of earlier ones. Delete the unwanted "
+                       f"ones above.")
+            display_table(found)
+        else:
+            st.success("No likely duplicates found.")